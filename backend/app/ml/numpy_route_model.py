@@ -0,0 +1,199 @@
+"""NumPy-реализация RouteNet для инференса без torch"""
+
+import os
+import sys
+from typing import Dict
+
+import numpy as np
+
+
+class NumpyRouteNet:
+    """
+    Инференс RouteNet на NumPy.
+
+    При оценке клиента модель всегда получает граф из одного узла с петлёй.
+    Внимание такого узла направлено только на него самого (коэффициент 1),
+    поэтому GATConv вырождается в линейный слой: первый слой - lin(x) + bias
+    с конкатенацией голов, второй - среднее по головам lin(h) + bias.
+    Среднее по головам сворачивается в одну матрицу заранее, и прямой проход
+    становится тремя матричными умножениями с ReLU.
+    """
+
+    def __init__(self, weights: Dict[str, np.ndarray]):
+        """
+        Инициализация модели из весов.
+
+        Args:
+            weights: Словарь весов в формате state_dict RouteNet
+        """
+        w1 = self._lin_weight(weights, "gat1")
+        w2 = self._lin_weight(weights, "gat2")
+        heads2 = weights["gat2.att_src"].shape[1]
+        hid_dim = weights["gat2.bias"].shape[0]
+
+        # Первый слой: головы конкатенируются, это просто lin(x)
+        self.w1 = np.ascontiguousarray(w1.T, dtype=np.float32)
+        self.b1 = weights["gat1.bias"].astype(np.float32)
+
+        # Второй слой: среднее по головам линейных отображений = одно отображение
+        self.w2 = np.ascontiguousarray(
+            w2.reshape(heads2, hid_dim, -1).mean(axis=0).T,
+            dtype=np.float32
+        )
+        self.b2 = weights["gat2.bias"].astype(np.float32)
+
+        self.w_fc = np.ascontiguousarray(weights["fc.weight"].T, dtype=np.float32)
+        self.b_fc = weights["fc.bias"].astype(np.float32)
+
+    @staticmethod
+    def _lin_weight(weights: Dict[str, np.ndarray], layer: str) -> np.ndarray:
+        """Получить веса линейного слоя GATConv (имя зависит от версии torch_geometric)"""
+        for name in (f"{layer}.lin.weight", f"{layer}.lin_src.weight"):
+            if name in weights:
+                return weights[name]
+        raise KeyError(f"Не найдены веса линейного слоя {layer}")
+
+    @staticmethod
+    def export_path(model_path: str) -> str:
+        """Путь к файлу весов в формате NumPy рядом с файлом модели"""
+        return os.path.splitext(model_path)[0] + ".npz"
+
+    @classmethod
+    def export(cls, model_path: str) -> Dict[str, np.ndarray]:
+        """
+        Выгрузить веса torch-модели в .npz (единственное место, где нужен torch).
+
+        Args:
+            model_path: Путь к файлу модели .pt
+
+        Returns:
+            Словарь весов в виде массивов NumPy
+        """
+        import torch
+
+        state_dict = torch.load(model_path, map_location="cpu")
+        weights = {name: tensor.detach().cpu().numpy() for name, tensor in state_dict.items()}
+
+        npz_path = cls.export_path(model_path)
+        try:
+            np.savez(npz_path, **weights)
+            print(f"✅ Веса модели выгружены в {npz_path}")
+        except OSError as e:
+            print(f"⚠ Не удалось сохранить {npz_path}: {e}")
+
+        return weights
+
+    @classmethod
+    def load(cls, model_path: str) -> "NumpyRouteNet":
+        """
+        Загрузить модель.
+
+        Если рядом с .pt есть актуальный .npz - torch не импортируется.
+        Иначе веса один раз выгружаются из .pt.
+
+        Args:
+            model_path: Путь к файлу модели .pt
+
+        Returns:
+            Модель NumpyRouteNet
+        """
+        npz_path = cls.export_path(model_path)
+        npz_fresh = os.path.exists(npz_path) and (
+            not os.path.exists(model_path)
+            or os.path.getmtime(npz_path) >= os.path.getmtime(model_path)
+        )
+
+        if npz_fresh:
+            with np.load(npz_path) as data:
+                weights = {name: data[name] for name in data.files}
+        elif os.path.exists(model_path):
+            weights = cls.export(model_path)
+        else:
+            raise FileNotFoundError(model_path)
+
+        return cls(weights)
+
+    def node_scores(self, x: np.ndarray) -> np.ndarray:
+        """
+        Вычислить scores узлов до нормализации softmax.
+
+        Args:
+            x: Признаки узлов n x 3 (lat, lon, feature)
+
+        Returns:
+            Ненормализованный score для каждого узла
+        """
+        h = np.maximum(x.astype(np.float32, copy=False) @ self.w1 + self.b1, 0.0)
+        h = np.maximum(h @ self.w2 + self.b2, 0.0)
+        return (h @ self.w_fc + self.b_fc)[:, 0]
+
+    def attention_scores(self, coords: np.ndarray) -> np.ndarray:
+        """
+        Получить attention scores для точек, каждая - отдельный граф из одного узла.
+
+        Args:
+            coords: Массив координат n x 2 (lat, lon)
+
+        Returns:
+            Массив attention scores (softmax внутри графа каждой точки)
+        """
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 2)
+        x = np.zeros((len(coords), 3), dtype=np.float32)
+        x[:, :2] = coords
+
+        # Softmax по графу из одного узла
+        scores = self.node_scores(x)[:, None]
+        exp = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return (exp / exp.sum(axis=1, keepdims=True))[:, 0]
+
+
+def check_parity(model_path: str, samples: int = 1000, atol: float = 1e-4) -> float:
+    """
+    Сверить NumPy-модель с torch-моделью на случайных координатах.
+
+    Args:
+        model_path: Путь к файлу модели .pt
+        samples: Количество точек для сверки
+        atol: Допустимое расхождение scores до softmax
+
+    Returns:
+        Максимальное расхождение scores до softmax
+    """
+    import torch
+    from app.ml.route_model import RouteNet
+
+    model = RouteNet(in_dim=3)
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    model.eval()
+
+    numpy_model = NumpyRouteNet(NumpyRouteNet.export(model_path))
+
+    rng = np.random.default_rng(0)
+    x = np.zeros((samples, 3), dtype=np.float32)
+    x[:, 0] = rng.uniform(-90, 90, samples)
+    x[:, 1] = rng.uniform(-180, 180, samples)
+
+    with torch.no_grad():
+        edge_index = torch.arange(samples, dtype=torch.long).repeat(2, 1)
+        expected = model.node_scores(torch.from_numpy(x), edge_index).numpy()
+
+    diff = float(np.max(np.abs(numpy_model.node_scores(x) - expected)))
+    if diff > atol:
+        raise AssertionError(f"Расхождение NumPy и torch моделей: {diff} > {atol}")
+    return diff
+
+
+if __name__ == "__main__":
+    # Выгрузка весов в .npz: python -m app.ml.numpy_route_model [model_path] [--check]
+    # (--check - дополнительно сверить с torch-моделью)
+    args = [arg for arg in sys.argv[1:] if arg != "--check"]
+    path = args[0] if args else os.getenv("MODEL_PATH", "models/routenet_traffic.pt")
+    if not os.path.exists(path):
+        print(f"⚠ Файл модели {path} не найден, выгрузка весов пропущена")
+        sys.exit(0)
+
+    if "--check" in sys.argv[1:]:
+        max_diff = check_parity(path)
+        print(f"✅ NumPy-модель совпадает с torch-моделью (макс. расхождение {max_diff:.2e})")
+    else:
+        NumpyRouteNet.export(path)
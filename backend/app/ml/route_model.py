@@ -34,21 +34,17 @@ class RouteNet(nn.Module):
         # Полносвязный слой для получения финального score
         self.fc = nn.Linear(hid_dim, 1)
 
-    def forward(self, data):
+    def node_scores(self, x: torch.Tensor, edge_index: torch.Tensor) -> torch.Tensor:
         """
-        Прямой проход модели.
+        Вычислить scores узлов до нормализации softmax.
 
         Args:
-            data: PyTorch Geometric Data объект с полями:
-                - x: признаки узлов (координаты клиентов)
-                - edge_index: граф соединений
-                - edge_attr: признаки рёбер (опционально)
+            x: Признаки узлов
+            edge_index: Граф соединений
 
         Returns:
-            attn: Attention scores для каждого узла (после softmax)
+            scores: Ненормализованный score для каждого узла
         """
-        x, edge_index = data.x, data.edge_index
-
         # Первый GAT слой + ReLU
         h = F.relu(self.gat1(x, edge_index))
 
@@ -56,7 +52,22 @@ class RouteNet(nn.Module):
         h = F.relu(self.gat2(h, edge_index))
 
         # Вычисление scores
-        scores = self.fc(h).squeeze(-1)
+        return self.fc(h).squeeze(-1)
+
+    def forward(self, data):
+        """
+        Прямой проход модели.
+
+        Args:
+            data: PyTorch Geometric Data объект с полями:
+                - x: признаки узлов (координаты клиентов)
+                - edge_index: граф соединений
+                - edge_attr: признаки рёбер (опционально)
+
+        Returns:
+            attn: Attention scores для каждого узла (после softmax)
+        """
+        scores = self.node_scores(data.x, data.edge_index)
 
         # Softmax для получения attention weights
         attn = F.softmax(scores, dim=0)
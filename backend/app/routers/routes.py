@@ -1,11 +1,28 @@
 """Роуты для работы с маршрутами"""
 
+import asyncio
+import json
+import math
 import re
-from fastapi import APIRouter, HTTPException
+import threading
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from app.schemas.route import RouteAnalysisRequest, RouteAnalysisResponse
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+
+from app.schemas.route import (
+    RouteAnalysisRequest,
+    RouteAnalysisResponse,
+    RouteBatchItem,
+    RouteBatchRequest,
+    RouteBatchResponse,
+    RouteJobStatus,
+)
 from app.schemas.response import ResponseModel
-from app.services.ml_route_optimizer import MLRouteOptimizer
+from app.services.client_records import ClientRecord
+from app.services.ml_route_optimizer import MLRouteOptimizer, OptimizationCancelled, RouteEventHandler
+from app.services.route_jobs import JobQueueFullError, RouteJob, RouteJobQueue
 
 router = APIRouter(prefix="/routes", tags=["routes"])
 
@@ -13,105 +30,184 @@ router = APIRouter(prefix="/routes", tags=["routes"])
 ml_optimizer = MLRouteOptimizer()
 
 
-@router.post("/analyze", response_model=ResponseModel[RouteAnalysisResponse])
-async def analyze_route(request: RouteAnalysisRequest):
+def _validate_route_request(request: RouteAnalysisRequest):
     """
-    Запустить анализ и оптимизацию маршрута с использованием ML-модели
+    Проверить запрос на анализ маршрута.
 
-    Принимает список клиентов с координатами и возвращает оптимизированный маршрут
-    с учетом:
-    - Трафика по времени суток и дню недели
-    - Рабочего времени клиентов
-    - Обеденных перерывов
-    - Уровня клиента (VIP = 25 мин, Standard = 15 мин обслуживания)
-    - ML-модели для выбора оптимального следующего клиента
+    Args:
+        request: Запрос на анализ маршрута
+
+    Raises:
+        HTTPException: 400, если запрос некорректен
     """
-    try:
-        # Валидация: минимум 1 клиент
-        if len(request.clients) == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Необходимо указать хотя бы одного клиента"
-            )
+    # Валидация: минимум 1 клиент
+    if len(request.clients) == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Необходимо указать хотя бы одного клиента"
+        )
 
-        # Валидация: максимум 50 клиентов (для производительности)
-        if len(request.clients) > 50:
+    # Валидация: максимум клиентов (свыше LARGE_INSTANCE_THRESHOLD маршрут строится по кластерам)
+    if len(request.clients) > ml_optimizer.max_clients:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Максимальное количество клиентов: {ml_optimizer.max_clients}"
+        )
+
+    # Валидация формата времени
+    if request.start_time and not re.match(r'^([01]\d|2[0-3]):([0-5]\d)$', request.start_time):
+        raise HTTPException(
+            status_code=400,
+            detail="Неверный формат времени start_time. Используйте HH:MM"
+        )
+
+    # Валидация дня недели
+    valid_days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+    if request.start_day and request.start_day.lower() not in valid_days:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неверный день недели. Допустимые: {', '.join(valid_days)}"
+        )
+
+    # Валидация бюджета локального поиска
+    if request.time_budget_ms is not None and not (0 <= request.time_budget_ms <= 10000):
+        raise HTTPException(
+            status_code=400,
+            detail="time_budget_ms должен быть от 0 до 10000"
+        )
+
+    # Валидация координат
+    for idx, client in enumerate(request.clients):
+        if not (-90 <= client.latitude <= 90):
             raise HTTPException(
                 status_code=400,
-                detail="Максимальное количество клиентов: 50"
+                detail=f"Неверная широта у клиента {idx + 1}: {client.latitude}"
             )
-
-        # Валидация формата времени
-        if request.start_time and not re.match(r'^([01]\d|2[0-3]):([0-5]\d)$', request.start_time):
+        if not (-180 <= client.longitude <= 180):
             raise HTTPException(
                 status_code=400,
-                detail="Неверный формат времени start_time. Используйте HH:MM"
+                detail=f"Неверная долгота у клиента {idx + 1}: {client.longitude}"
             )
 
-        # Валидация дня недели
-        valid_days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-        if request.start_day and request.start_day.lower() not in valid_days:
+        # Валидация уровня клиента
+        if client.level.lower() not in ["vip", "standard"]:
             raise HTTPException(
                 status_code=400,
-                detail=f"Неверный день недели. Допустимые: {', '.join(valid_days)}"
+                detail=f"Неверный уровень клиента {idx + 1}: {client.level}. Допустимые: vip, standard"
             )
 
-        # Валидация координат
-        for idx, client in enumerate(request.clients):
-            if not (-90 <= client.latitude <= 90):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Неверная широта у клиента {idx + 1}: {client.latitude}"
-                )
-            if not (-180 <= client.longitude <= 180):
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Неверная долгота у клиента {idx + 1}: {client.longitude}"
-                )
-
-            # Валидация уровня клиента
-            if client.level.lower() not in ["vip", "standard"]:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Неверный уровень клиента {idx + 1}: {client.level}. Допустимые: vip, standard"
-                )
-
-        # Конвертируем Pydantic модели в словари для оптимизатора
-        clients_data = [
-            {
-                "address": client.address,
-                "latitude": client.latitude,
-                "longitude": client.longitude,
-                "level": client.level,
-                "work_start": client.work_start,
-                "work_end": client.work_end,
-                "lunch_start": client.lunch_start,
-                "lunch_end": client.lunch_end,
-                "id": client.id or f"client_{idx}"
-            }
-            for idx, client in enumerate(request.clients)
-        ]
-
-        # Подготавливаем стартовую точку если указана
-        start_point_data = None
-        if request.start_point:
-            start_point_data = {
-                "address": request.start_point.address,
-                "latitude": request.start_point.latitude,
-                "longitude": request.start_point.longitude
-            }
+
+def _route_records(request: RouteAnalysisRequest) -> Tuple[List[ClientRecord], Optional[ClientRecord]]:
+    """
+    Нормализовать клиентов и стартовую точку запроса один раз.
+
+    Args:
+        request: Запрос на анализ маршрута
+
+    Returns:
+        Кортеж (записи клиентов, запись стартовой точки или None)
+    """
+    client_records = [
+        ClientRecord.from_client(client, idx)
+        for idx, client in enumerate(request.clients)
+    ]
+
+    start_record = None
+    if request.start_point:
+        start_record = ClientRecord.from_start_point(request.start_point)
+
+    return client_records, start_record
+
+
+async def _optimize_records(
+    request: RouteAnalysisRequest,
+    client_records: List[ClientRecord],
+    start_record: Optional[ClientRecord],
+    on_event: Optional[RouteEventHandler] = None
+) -> Tuple[RouteAnalysisResponse, str, bool]:
+    """
+    Оптимизировать маршрут по нормализованным записям (через кэш результатов).
+
+    Args:
+        request: Запрос на анализ маршрута
+        client_records: Записи клиентов
+        start_record: Запись стартовой точки или None
+        on_event: Обработчик событий хода оптимизации
+
+    Returns:
+        Кортеж (оптимизированный маршрут, ETag, взят ли результат из кэша)
+    """
+    print(f"\n🚀 Запуск оптимизации маршрута для {len(client_records)} клиентов...")
+    if start_record:
+        print(f"📍 Стартовая точка: {start_record.address}")
+
+    optimized_result, etag, cached = await ml_optimizer.optimize_route_cached(
+        clients=client_records,
+        start_point=start_record,
+        start_time=request.start_time,
+        start_day=request.start_day,
+        time_budget_ms=request.time_budget_ms,
+        on_event=on_event
+    )
+    if cached:
+        print("♻️ Маршрут взят из кэша результатов")
+
+    return optimized_result, etag, cached
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверить заголовок If-None-Match (слабые валидаторы сравниваются как сильные)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _error_message(e: Exception) -> str:
+    """Текст ошибки оптимизации для ответа"""
+    if isinstance(e, FileNotFoundError):
+        return f"ML-модель не найдена. Убедитесь, что файл модели находится в папке models/: {str(e)}"
+    return f"Ошибка при оптимизации маршрута: {str(e)}"
+
+
+# Очередь фоновых задач оптимизации (POST /routes/jobs)
+route_jobs = RouteJobQueue(describe_error=_error_message)
+
+
+@router.post("/analyze", response_model=ResponseModel[RouteAnalysisResponse])
+async def analyze_route(
+    request: RouteAnalysisRequest,
+    response: Response,
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Запустить анализ и оптимизацию маршрута с использованием ML-модели
+
+    Принимает список клиентов с координатами и возвращает оптимизированный маршрут
+    с учетом:
+    - Трафика по времени суток и дню недели
+    - Рабочего времени клиентов
+    - Обеденных перерывов
+    - Уровня клиента (VIP = 25 мин, Standard = 15 мин обслуживания)
+    - ML-модели для выбора оптимального следующего клиента
+
+    Одинаковые запросы (порядок клиентов не важен) отдаются из кэша результатов.
+    Ответ содержит ETag: при совпадении с заголовком If-None-Match возвращается 304.
+    """
+    try:
+        _validate_route_request(request)
+
+        # Нормализуем клиентов один раз: окна времени в минутах, время обслуживания
+        client_records, start_record = _route_records(request)
 
         # Оптимизируем маршрут с использованием ML-модели
-        print(f"\n🚀 Запуск оптимизации маршрута для {len(clients_data)} клиентов...")
-        if start_point_data:
-            print(f"📍 Стартовая точка: {start_point_data['address']}")
-
-        optimized_result = await ml_optimizer.optimize_route(
-            clients=clients_data,
-            start_point=start_point_data,
-            start_time=request.start_time,
-            start_day=request.start_day
-        )
+        optimized_result, etag, cached = await _optimize_records(request, client_records, start_record)
+
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+
+        response.headers["ETag"] = etag
+        response.headers["X-Cache"] = "HIT" if cached else "MISS"
 
         return ResponseModel(
             success=True,
@@ -124,26 +220,252 @@ async def analyze_route(request: RouteAnalysisRequest):
     except FileNotFoundError as e:
         raise HTTPException(
             status_code=500,
-            detail=f"ML-модель не найдена. Убедитесь, что файл модели находится в папке models/: {str(e)}"
+            detail=_error_message(e)
         )
     except Exception as e:
         print(f"❌ Ошибка при оптимизации маршрута: {e}")
         raise HTTPException(
             status_code=500,
-            detail=f"Ошибка при оптимизации маршрута: {str(e)}"
+            detail=_error_message(e)
+        )
+
+
+def _format_event(event: str, data: Dict[str, Any], sse: bool) -> str:
+    """Сериализовать событие потока: строка NDJSON или сообщение Server-Sent Events"""
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n"
+
+
+@router.post("/analyze/stream")
+async def analyze_route_stream(
+    request: RouteAnalysisRequest,
+    accept: Optional[str] = Header(None)
+):
+    """
+    Анализ маршрута с потоковой выдачей хода оптимизации
+
+    Тот же расчёт, что и /routes/analyze, но результат отдаётся по частям,
+    не дожидаясь всего маршрута. Формат - NDJSON (по умолчанию) или
+    Server-Sent Events при заголовке `Accept: text/event-stream`.
+
+    События:
+    - `matrix` - ход построения матриц OSRM (started / progress / done)
+    - `point` - точка маршрута (RoutePoint), как только выбран переход к ней.
+      С локальным поиском точки отдаются после улучшения маршрута
+    - `result` - итог в формате ответа /routes/analyze (с общими расстоянием и временем)
+    - `error` - ошибка оптимизации (поток завершается)
+    """
+    _validate_route_request(request)
+    client_records, start_record = _route_records(request)
+
+    sse = bool(accept) and "text/event-stream" in accept
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def on_event(event: str, data: Dict[str, Any]):
+        # Клиент отключился - прерываем построение маршрута в потоке пула на ближайшем событии
+        if cancelled.is_set():
+            raise OptimizationCancelled()
+        # Точки маршрута приходят из потока пула оптимизации
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def optimize():
+        try:
+            optimized_result, _, _ = await _optimize_records(request, client_records, start_record, on_event)
+            result = ResponseModel(
+                success=True,
+                message=f"Маршрут успешно оптимизирован ({len(request.clients)} клиентов)",
+                data=optimized_result
+            )
+            on_event("result", result.model_dump())
+        except OptimizationCancelled:
+            pass
+        except Exception as e:
+            print(f"❌ Ошибка при оптимизации маршрута: {e}")
+            # После отключения клиента ошибку отдавать некому
+            if not cancelled.is_set():
+                loop.call_soon_threadsafe(events.put_nowait, ("error", {"message": _error_message(e)}))
+        finally:
+            # Конец потока ставится после всех событий из пула
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    async def stream() -> AsyncIterator[str]:
+        task = asyncio.create_task(optimize())
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield _format_event(*item, sse)
+        finally:
+            # Клиент отключился - прекращаем оптимизацию (и её поток в пуле)
+            cancelled.set()
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.post("/analyze/batch", response_model=ResponseModel[RouteBatchResponse])
+async def analyze_route_batch(request: RouteBatchRequest):
+    """
+    Оптимизировать пакет независимых маршрутов
+
+    Точки всех маршрутов дедуплицируются, матрицы OSRM для них запрашиваются
+    общими пакетами один раз, затем маршруты оптимизируются параллельно.
+    Ошибка в одном маршруте не влияет на остальные - результат возвращается
+    для каждого маршрута отдельно.
+    """
+    if len(request.routes) == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Необходимо указать хотя бы один маршрут"
+        )
+
+    if len(request.routes) > ml_optimizer.batch_max_routes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Максимальное количество маршрутов в пакете: {ml_optimizer.batch_max_routes}"
+        )
+
+    results: List[Optional[RouteBatchItem]] = [None] * len(request.routes)
+
+    # Проверяем и нормализуем каждый маршрут отдельно
+    prepared = []
+    for idx, route in enumerate(request.routes):
+        try:
+            _validate_route_request(route)
+            prepared.append((idx, route, *_route_records(route)))
+        except HTTPException as e:
+            results[idx] = RouteBatchItem(index=idx, success=False, message=str(e.detail))
+
+    # Общая загрузка матриц для всех маршрутов (большие маршруты строят свои матрицы по кластерам)
+    coord_groups = [
+        [record.coords for record in ([start_record] if start_record else []) + client_records]
+        for _, _, client_records, start_record in prepared
+        if len(client_records) <= ml_optimizer.large_instance_threshold
+    ]
+    try:
+        batches = await ml_optimizer.prefetch_matrices(coord_groups)
+        print(f"📦 Пакет: {len(request.routes)} маршрутов, матрицы загружены за {batches} запросов ({ml_optimizer.cost_provider.name})")
+    except Exception as e:
+        # Матрицы будут получены для каждого маршрута отдельно
+        print(f"⚠ Не удалось загрузить матрицы пакета: {e}")
+
+    async def run(idx: int, route: RouteAnalysisRequest, client_records, start_record) -> RouteBatchItem:
+        try:
+            optimized_result, _, _ = await _optimize_records(route, client_records, start_record)
+            return RouteBatchItem(
+                index=idx,
+                success=True,
+                message=f"Маршрут успешно оптимизирован ({len(route.clients)} клиентов)",
+                data=optimized_result
+            )
+        except Exception as e:
+            print(f"❌ Ошибка при оптимизации маршрута {idx}: {e}")
+            return RouteBatchItem(index=idx, success=False, message=_error_message(e))
+
+    # Маршруты оптимизируются параллельно (одновременность ограничивает пул оптимизатора)
+    for item in await asyncio.gather(*(run(*args) for args in prepared)):
+        results[item.index] = item
+
+    succeeded = sum(1 for item in results if item.success)
+    return ResponseModel(
+        success=True,
+        message=f"Пакет обработан: {succeeded} из {len(results)} маршрутов оптимизировано",
+        data=RouteBatchResponse(
+            results=results,
+            succeeded=succeeded,
+            failed=len(results) - succeeded
+        )
+    )
+
+
+def _timestamp(value: Optional[float]) -> Optional[str]:
+    """Время задачи в формате ISO 8601"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value).isoformat(timespec="milliseconds")
+
+
+def _job_status(job: RouteJob) -> RouteJobStatus:
+    """Статус задачи для ответа"""
+    return RouteJobStatus(
+        job_id=job.id,
+        status=job.status,
+        created_at=_timestamp(job.created_at),
+        started_at=_timestamp(job.started_at),
+        finished_at=_timestamp(job.finished_at),
+        result=job.result,
+        error=job.error
+    )
+
+
+@router.post("/jobs", response_model=ResponseModel[RouteJobStatus], status_code=202)
+async def create_route_job(request: RouteAnalysisRequest, response: Response):
+    """
+    Поставить оптимизацию маршрута в очередь
+
+    Запрос проверяется сразу (400 при ошибке), а оптимизация выполняется
+    в фоне ограниченным пулом обработчиков. Возвращает ID задачи, статус и
+    результат доступны через GET /routes/jobs/{job_id}. Если очередь
+    заполнена - 429 с заголовком Retry-After.
+    """
+    _validate_route_request(request)
+    client_records, start_record = _route_records(request)
+
+    async def work() -> RouteAnalysisResponse:
+        optimized_result, _, _ = await _optimize_records(request, client_records, start_record)
+        return optimized_result
+
+    try:
+        job = await route_jobs.submit(work)
+    except JobQueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Очередь задач оптимизации заполнена, повторите запрос позже",
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
         )
 
+    response.headers["Location"] = f"{router.prefix}/jobs/{job.id}"
+    return ResponseModel(
+        success=True,
+        message=f"Задача поставлена в очередь ({len(request.clients)} клиентов)",
+        data=_job_status(job)
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=ResponseModel[RouteJobStatus])
+async def get_route_job(job_id: str):
+    """Получить статус и результат задачи оптимизации"""
+    job = await route_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Задача не найдена или срок хранения результата истёк"
+        )
+
+    return ResponseModel(
+        success=True,
+        message=f"Статус задачи: {job.status}",
+        data=_job_status(job)
+    )
+
 
 @router.get("/stats", response_model=ResponseModel)
 async def get_route_stats():
-    """Получить статистику по маршрутам (заглушка)"""
-    # Заглушка для будущей функциональности
+    """Получить статистику: очередь фоновых задач и кэш результатов"""
     return ResponseModel(
         success=True,
         message="Статистика по маршрутам",
         data={
-            "total_routes_analyzed": 0,
-            "average_distance": 0,
-            "average_duration": 0
+            "jobs": route_jobs.get_stats(),
+            "result_cache": ml_optimizer.result_cache.get_stats()
         }
     )
@@ -46,6 +46,7 @@ class RouteAnalysisRequest(BaseModel):
     start_point: Optional[StartPoint] = Field(None, description="Стартовая точка (офис, склад). Если не указана - используется первый клиент")
     start_time: Optional[str] = Field(default="09:00", description="Время начала маршрута (формат HH:MM)")
     start_day: Optional[str] = Field(None, description="День недели (Monday, Tuesday, и т.д.)")
+    time_budget_ms: Optional[int] = Field(None, description="Бюджет улучшения маршрута локальным поиском в мс (0 - без улучшения). Если не указан - значение сервера")
 
 
 class RouteAnalysisResponse(BaseModel):
@@ -53,3 +54,34 @@ class RouteAnalysisResponse(BaseModel):
     total_distance: float = Field(..., description="Общее расстояние маршрута в км")
     total_duration: float = Field(..., description="Общее время маршрута в минутах")
     optimized_route: list[RoutePoint] = Field(..., description="Оптимизированный маршрут")
+
+
+class RouteBatchRequest(BaseModel):
+    """Пакетный запрос на анализ нескольких независимых маршрутов"""
+    routes: list[RouteAnalysisRequest] = Field(..., description="Запросы на анализ маршрутов")
+
+
+class RouteBatchItem(BaseModel):
+    """Результат одного маршрута из пакета"""
+    index: int = Field(..., description="Номер маршрута в пакете (с 0)")
+    success: bool = Field(..., description="Статус оптимизации маршрута")
+    message: str = Field(..., description="Сообщение о результате")
+    data: Optional[RouteAnalysisResponse] = Field(None, description="Оптимизированный маршрут")
+
+
+class RouteBatchResponse(BaseModel):
+    """Результат пакетного анализа маршрутов"""
+    results: list[RouteBatchItem] = Field(..., description="Результаты в порядке запросов")
+    succeeded: int = Field(..., description="Количество успешно оптимизированных маршрутов")
+    failed: int = Field(..., description="Количество маршрутов с ошибкой")
+
+
+class RouteJobStatus(BaseModel):
+    """Статус фоновой задачи оптимизации маршрута"""
+    job_id: str = Field(..., description="ID задачи")
+    status: str = Field(..., description="Статус задачи (queued, running, done, failed)")
+    created_at: str = Field(..., description="Время постановки в очередь (ISO 8601)")
+    started_at: Optional[str] = Field(None, description="Время начала выполнения (ISO 8601)")
+    finished_at: Optional[str] = Field(None, description="Время завершения (ISO 8601)")
+    result: Optional[RouteAnalysisResponse] = Field(None, description="Оптимизированный маршрут (для status=done)")
+    error: Optional[str] = Field(None, description="Текст ошибки (для status=failed)")
@@ -0,0 +1,156 @@
+"""Компактное представление клиентов для оптимизатора"""
+
+from datetime import datetime
+from typing import Tuple
+
+from app.schemas.route import ClientData, StartPoint
+
+
+def parse_minutes(val: str, default: str) -> int:
+    """
+    Безопасно разобрать время HH:MM в минуты от полуночи.
+
+    Args:
+        val: Значение времени (HH:MM)
+        default: Значение по умолчанию, если val не разбирается
+
+    Returns:
+        Минуты от полуночи
+    """
+    try:
+        parsed = datetime.strptime(str(val), "%H:%M")
+    except Exception:
+        parsed = datetime.strptime(default, "%H:%M")
+    return parsed.hour * 60 + parsed.minute
+
+
+def get_visit_duration(level: str) -> int:
+    """
+    Получить время обслуживания клиента в минутах.
+
+    Args:
+        level: Уровень клиента (VIP или Standard)
+
+    Returns:
+        Время обслуживания в минутах
+    """
+    if level.lower() == "vip":
+        return 25
+    else:
+        return 15
+
+
+class ClientRecord:
+    """
+    Клиент, нормализованный один раз на входе запроса.
+
+    Окна работы и обеда хранятся целыми минутами от полуночи, время
+    обслуживания уже посчитано по уровню клиента, поэтому оптимизатору
+    не нужно разбирать строки времени в цикле.
+    """
+
+    __slots__ = (
+        "id",
+        "address",
+        "latitude",
+        "longitude",
+        "level",
+        "service_time",
+        "work_start",
+        "work_end",
+        "lunch_start",
+        "lunch_end",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        address: str,
+        latitude: float,
+        longitude: float,
+        level: str,
+        work_start: int,
+        work_end: int,
+        lunch_start: int,
+        lunch_end: int
+    ):
+        """
+        Инициализация записи клиента.
+
+        Args:
+            id: ID клиента
+            address: Адрес
+            latitude: Широта
+            longitude: Долгота
+            level: Уровень клиента (vip, standard или start для стартовой точки)
+            work_start: Начало рабочего дня (минуты от полуночи)
+            work_end: Конец рабочего дня (минуты от полуночи)
+            lunch_start: Начало обеда (минуты от полуночи)
+            lunch_end: Конец обеда (минуты от полуночи)
+        """
+        self.id = id
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+        self.level = level
+        self.service_time = get_visit_duration(level)
+        self.work_start = work_start
+        self.work_end = work_end
+        self.lunch_start = lunch_start
+        self.lunch_end = lunch_end
+
+    @classmethod
+    def from_client(cls, client: ClientData, idx: int) -> "ClientRecord":
+        """
+        Создать запись из клиента запроса.
+
+        Args:
+            client: Клиент из запроса
+            idx: Порядковый номер клиента (для ID по умолчанию)
+
+        Returns:
+            Запись клиента
+        """
+        return cls(
+            id=client.id or f"client_{idx}",
+            address=client.address,
+            latitude=client.latitude,
+            longitude=client.longitude,
+            level=client.level,
+            work_start=parse_minutes(client.work_start, "09:00"),
+            work_end=parse_minutes(client.work_end, "18:00"),
+            lunch_start=parse_minutes(client.lunch_start, "13:00"),
+            lunch_end=parse_minutes(client.lunch_end, "14:00")
+        )
+
+    @classmethod
+    def from_start_point(cls, start_point: StartPoint) -> "ClientRecord":
+        """
+        Создать запись для стартовой точки (доступна круглосуточно).
+
+        Args:
+            start_point: Стартовая точка из запроса (или любая запись с адресом
+                и координатами, например клиент, из которого стартует кластер)
+
+        Returns:
+            Запись стартовой точки
+        """
+        return cls(
+            id="START",
+            address=start_point.address,
+            latitude=start_point.latitude,
+            longitude=start_point.longitude,
+            level="start",
+            work_start=0,
+            work_end=23 * 60 + 59,
+            lunch_start=23 * 60 + 59,
+            lunch_end=23 * 60 + 59
+        )
+
+    @property
+    def coords(self) -> Tuple[float, float]:
+        """Координаты (latitude, longitude)"""
+        return (self.latitude, self.longitude)
+
+    def __repr__(self) -> str:
+        return f"ClientRecord(id={self.id!r}, address={self.address!r})"
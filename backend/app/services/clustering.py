@@ -0,0 +1,153 @@
+"""Пространственное разбиение клиентов для больших маршрутов"""
+
+import math
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+
+# Километров в градусе широты
+KM_PER_DEGREE = 111.32
+
+
+def project(coords: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """
+    Перевести координаты в плоские километры (равнопромежуточная проекция).
+
+    Для территории одной команды (десятки километров) искажение пренебрежимо,
+    а евклидово расстояние в такой проекции подходит для k-means.
+
+    Args:
+        coords: Список координат [(lat, lon), ...]
+
+    Returns:
+        Массив n x 2 (км к северу, км к востоку)
+    """
+    points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    mean_lat = math.radians(float(points[:, 0].mean())) if len(points) else 0.0
+    return np.column_stack((
+        points[:, 0] * KM_PER_DEGREE,
+        points[:, 1] * KM_PER_DEGREE * math.cos(mean_lat)
+    ))
+
+
+def kmeans(points: np.ndarray, k: int, iterations: int = 25, seed: int = 0) -> np.ndarray:
+    """
+    Кластеризация k-means с инициализацией k-means++.
+
+    Args:
+        points: Массив точек n x 2
+        k: Количество кластеров
+        iterations: Максимальное количество итераций
+        seed: Зерно генератора (разбиение детерминировано для одного запроса)
+
+    Returns:
+        Массив меток кластеров длины n
+    """
+    n = len(points)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+
+    # k-means++: каждый следующий центр выбирается с вероятностью ~ квадрату расстояния
+    centers = np.empty((k, points.shape[1]), dtype=np.float64)
+    centers[0] = points[rng.integers(n)]
+    nearest = ((points - centers[0]) ** 2).sum(axis=1)
+    for c in range(1, k):
+        total = nearest.sum()
+        idx = rng.choice(n, p=nearest / total) if total > 0 else rng.integers(n)
+        centers[c] = points[idx]
+        nearest = np.minimum(nearest, ((points - centers[c]) ** 2).sum(axis=1))
+
+    labels = np.full(n, -1)
+    for _ in range(iterations):
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = distances.argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        for c in range(k):
+            members = points[labels == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+
+    return labels
+
+
+def partition(coords: Sequence[Tuple[float, float]], max_size: int) -> List[np.ndarray]:
+    """
+    Разбить точки на компактные группы не больше max_size.
+
+    k-means не ограничивает размер кластера, поэтому слишком большие
+    кластеры разбиваются повторно.
+
+    Args:
+        coords: Список координат [(lat, lon), ...]
+        max_size: Максимальный размер группы
+
+    Returns:
+        Список массивов индексов точек (каждый - одна группа)
+    """
+    points = project(coords)
+    groups: List[np.ndarray] = []
+    pending = [np.arange(len(points))]
+
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= max_size:
+            if len(indices):
+                groups.append(indices)
+            continue
+
+        k = max(2, math.ceil(len(indices) / max_size))
+        labels = kmeans(points[indices], k)
+        parts = [indices[labels == c] for c in range(k)]
+        if max(len(part) for part in parts) == len(indices):
+            # Совпадающие точки не разделить k-means - режем по порядку
+            parts = np.array_split(indices, k)
+        pending.extend(parts)
+
+    # Порядок групп детерминирован: по первому индексу
+    groups.sort(key=lambda group: int(group.min()))
+    return groups
+
+
+def medoid(coords: Sequence[Tuple[float, float]], indices: np.ndarray) -> int:
+    """
+    Точка группы, ближайшая к её центру.
+
+    Args:
+        coords: Список координат [(lat, lon), ...]
+        indices: Индексы точек группы
+
+    Returns:
+        Индекс точки-медоида
+    """
+    points = project([coords[i] for i in indices])
+    center = points.mean(axis=0)
+    return int(indices[((points - center) ** 2).sum(axis=1).argmin()])
+
+
+def nearest_neighbour_order(time_matrix: np.ndarray, start: int = 0) -> List[int]:
+    """
+    Порядок обхода узлов жадным выбором ближайшего (открытый путь от start).
+
+    Args:
+        time_matrix: Матрица времени в пути n x n
+        start: Начальный узел
+
+    Returns:
+        Порядок узлов, начиная со start
+    """
+    n = len(time_matrix)
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    order = [start]
+
+    while len(order) < n:
+        row = np.where(visited, np.inf, time_matrix[order[-1]])
+        nxt = int(row.argmin())
+        visited[nxt] = True
+        order.append(nxt)
+
+    return order
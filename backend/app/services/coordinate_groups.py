@@ -0,0 +1,94 @@
+"""Объединение совпадающих точек в общие узлы матриц"""
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.services.spatial_index import SpatialIndex
+
+
+class CoordinateGroups:
+    """
+    Узлы матриц для списка остановок.
+
+    Остановки ближе допуска друг к другу (клиенты в одном здании, координаты,
+    отличающиеся шумом float) становятся одним узлом: матрицы строятся
+    по узлам, а затем разворачиваются обратно на остановки. Переход между
+    остановками одного узла - 0 минут и 0 км, как у точки с самой собой.
+    """
+
+    def __init__(self, coords: Sequence[Tuple[float, float]], tolerance_m: float = 0.0):
+        """
+        Сгруппировать остановки.
+
+        Узел - первая по порядку ещё не сгруппированная остановка, в него входят
+        все свободные остановки в радиусе допуска от неё.
+
+        Args:
+            coords: Координаты остановок [(lat, lon), ...]
+            tolerance_m: Допуск в метрах (0 - каждая остановка отдельным узлом)
+        """
+        coords = [tuple(coord) for coord in coords]
+        if tolerance_m <= 0 or len(coords) < 2:
+            self.nodes: List[Tuple[float, float]] = coords
+            self.index = np.arange(len(coords), dtype=np.int64)
+            return
+
+        spatial_index = SpatialIndex(coords, cell_km=max(tolerance_m / 1000.0, 0.01))
+        index = np.full(len(coords), -1, dtype=np.int64)
+        nodes = []
+        for i, coord in enumerate(coords):
+            if index[i] >= 0:
+                continue
+            members = spatial_index.within(coord, tolerance_m / 1000.0, lambda idx: index[idx] < 0)
+            index[members] = len(nodes)
+            index[i] = len(nodes)
+            nodes.append(coord)
+
+        self.nodes = nodes
+        self.index = index
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def stop_coords(self) -> List[Tuple[float, float]]:
+        """Координаты узла каждой остановки"""
+        return [self.nodes[node] for node in self.index.tolist()]
+
+    def remap(self, node_coords: Sequence[Tuple[float, float]]):
+        """
+        Заменить координаты узлов (например, привязанными к дорогам).
+
+        Узлы, координаты которых совпали до 5 знаков (точность ключа кэша
+        OSRM), объединяются.
+
+        Args:
+            node_coords: Новые координаты узлов в прежнем порядке
+        """
+        position: Dict[Tuple[float, float], int] = {}
+        nodes = []
+        mapping = []
+        for lat, lon in node_coords:
+            key = (round(lat, 5), round(lon, 5))
+            if key not in position:
+                position[key] = len(nodes)
+                nodes.append((lat, lon))
+            mapping.append(position[key])
+
+        self.index = np.asarray(mapping, dtype=np.int64)[self.index]
+        self.nodes = nodes
+
+    def expand(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Развернуть матрицу по узлам в матрицу по остановкам.
+
+        Args:
+            matrix: Матрица узлов (с нулевой диагональю)
+
+        Returns:
+            Матрица остановок
+        """
+        if np.array_equal(self.index, np.arange(len(self.index))):
+            return matrix
+        return matrix[np.ix_(self.index, self.index)]
@@ -0,0 +1,110 @@
+"""Ленивая матрица времени и расстояний"""
+
+import asyncio
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from app.services.spatial_index import SpatialIndex
+from app.services.travel_cost import HaversineCostProvider, TravelCostProvider
+
+
+class LazyCostMatrix:
+    """
+    Матрица, точные значения которой запрашиваются по мере надобности.
+
+    Сначала матрица заполнена оценкой по прямой (HaversineCostProvider).
+    На каждом шаге жадного построения оптимизатор берёт из пространственного
+    индекса k ближайших доступных кандидатов и запрашивает у источника только
+    переходы к ним - одним запросом на шаг. Вместо n² пар источник считает
+    порядка n·k. Массивы time и distance изменяются на месте, поэтому селектор и
+    локальный поиск, получившие их, видят уже запрошенные значения.
+
+    Запросы выполняются в event loop приложения, а ждёт их поток пула
+    оптимизации - поэтому ленивая матрица работает только с пулом потоков.
+    """
+
+    def __init__(
+        self,
+        coords: List[tuple],
+        provider: TravelCostProvider,
+        k: int,
+        loop: asyncio.AbstractEventLoop,
+        estimator: HaversineCostProvider = None
+    ):
+        """
+        Инициализация матрицы.
+
+        Args:
+            coords: Координаты точек [(lat, lon), ...]
+            provider: Источник точных значений
+            k: Сколько ближайших кандидатов запрашивать на шаге
+            loop: Event loop, в котором выполняются запросы к источнику
+            estimator: Оценка по прямой (по умолчанию - с параметрами из env)
+        """
+        self.coords = coords
+        self.provider = provider
+        self.k = k
+        self.loop = loop
+
+        self.time, self.distance = (estimator or HaversineCostProvider()).matrices_sync(coords)
+        self.index = SpatialIndex(coords)
+        self.known = np.eye(len(coords), dtype=bool)
+        self.requests = 0
+
+    @property
+    def known_pairs(self) -> int:
+        """Количество пар с точными значениями"""
+        return int(self.known.sum()) - len(self.coords)
+
+    def fetch(self, source: int, targets: Sequence[int]):
+        """
+        Запросить точные значения от одной точки до нескольких (блокирующий вызов из пула).
+
+        Args:
+            source: Индекс точки отправления
+            targets: Индексы точек назначения
+        """
+        self._fetch_rows({source: targets})
+
+    def fetch_neighbours(self):
+        """Запросить переходы от каждой точки к k ближайшим (окрестность локального поиска)"""
+        self._fetch_rows({
+            source: self.index.nearest(coord, self.k, lambda idx, source=source: idx != source)
+            for source, coord in enumerate(self.coords)
+        })
+
+    def fetch_legs(self, order: List[int]):
+        """
+        Запросить точные значения всех переходов маршрута.
+
+        Args:
+            order: Порядок точек маршрута
+        """
+        rows: Dict[int, List[int]] = {}
+        for u, v in zip(order, order[1:]):
+            rows.setdefault(u, []).append(v)
+        self._fetch_rows(rows)
+
+    def _fetch_rows(self, rows: Dict[int, Sequence[int]]):
+        """Запросить недостающие пары: по запросу на точку отправления, все сразу"""
+        missing = {
+            source: [int(j) for j in targets if not self.known[source, j]]
+            for source, targets in rows.items()
+        }
+        missing = {source: targets for source, targets in missing.items() if targets}
+        if not missing:
+            return
+
+        async def fetch_all():
+            return await asyncio.gather(*(
+                self.provider.row(self.coords, source, targets)
+                for source, targets in missing.items()
+            ))
+
+        results = asyncio.run_coroutine_threadsafe(fetch_all(), self.loop).result()
+        for (source, targets), (times, distances) in zip(missing.items(), results):
+            self.time[source, targets] = times
+            self.distance[source, targets] = distances
+            self.known[source, targets] = True
+        self.requests += len(missing)
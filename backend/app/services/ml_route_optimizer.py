@@ -1,17 +1,40 @@
 """Основной сервис ML-оптимизации маршрутов"""
 
+import asyncio
+import math
 import os
-import torch
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Set
-from torch_geometric.data import Data
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from app.ml.route_model import RouteNet
+from app.services.client_records import ClientRecord, get_visit_duration
+from app.services.clustering import medoid, nearest_neighbour_order, partition
+from app.services.coordinate_groups import CoordinateGroups
+from app.services.lazy_matrix import LazyCostMatrix
 from app.services.osrm_service import OSRMService
-from app.services.traffic_service import TrafficService
+from app.services.result_cache import RouteResultCache, response_etag, route_cache_key
+from app.services.route_improver import IMPROVEMENT_EPS, RouteImprover, RouteSchedule, RouteTimer
+from app.services.route_selector import MINUTE_US, GreedySelector
+from app.services.traffic_service import DAY_INDEX, DAYS, TrafficService, TrafficTable
+from app.services.travel_cost import create_cost_provider
+from app.services.travel_time import TravelTimeEngine
 from app.schemas.route import RouteAnalysisResponse, RoutePoint
 
 
+# Обработчик событий хода оптимизации: (тип события, данные).
+# Может вызываться из потока пула, поэтому должен быть потокобезопасным.
+# Исключение OptimizationCancelled из обработчика прерывает построение маршрута
+RouteEventHandler = Callable[[str, Dict[str, Any]], None]
+
+
+class OptimizationCancelled(Exception):
+    """Результат оптимизации больше не нужен (например, клиент потока отключился)"""
+
+
 class MLRouteOptimizer:
     """ML-оптимизатор маршрутов на базе нейронной сети"""
 
@@ -30,33 +53,95 @@ class MLRouteOptimizer:
             osrm_base_url: URL OSRM сервера
         """
         self.model_path = model_path or os.getenv("MODEL_PATH", "models/routenet_traffic.pt")
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+        # Бэкенд инференса: torch (RouteNet) или numpy (NumpyRouteNet, без импорта torch)
+        self.model_backend = os.getenv("MODEL_BACKEND", "torch").lower()
+        self.device = None
 
         # Инициализируем сервисы
         self.osrm_service = OSRMService(base_url=osrm_base_url)
+
+        # Источник матриц времени и расстояний: osrm, haversine (оценка по прямой) или graph (локальный граф дорог)
+        self.cost_provider = create_cost_provider(os.getenv("TRAVEL_COST_PROVIDER", "osrm"), self.osrm_service)
         self.traffic_service = TrafficService(traffic_config_path=traffic_config_path)
 
         # Модель будет загружена при первом использовании
-        self.model: Optional[RouteNet] = None
+        self.model: Optional[Any] = None
         self._model_loaded = False
+        self.model_version = ""
+
+        # Кэш attention scores по координатам, общий для всех запросов
+        self._score_cache: "OrderedDict[Tuple[float, float], float]" = OrderedDict()
+        self.score_cache_size = int(os.getenv("SCORE_CACHE_SIZE", "100000"))
+        self._score_lock = threading.Lock()
+
+        # Пул для CPU-части оптимизации (thread или process), чтобы не блокировать event loop
+        self.executor_type = os.getenv("OPTIMIZER_EXECUTOR", "thread").lower()
+        self.executor_workers = int(os.getenv("OPTIMIZER_WORKERS", str(os.cpu_count() or 1)))
+        self.max_concurrent = int(os.getenv("OPTIMIZER_MAX_CONCURRENT", str(self.executor_workers)))
+        self._executor: Optional[Executor] = None
+        self._optimization_slots = asyncio.Semaphore(max(1, self.max_concurrent))
+
+        # Бюджет улучшения маршрута локальным поиском по умолчанию (мс, 0 - выключено)
+        self.local_search_budget_ms = int(os.getenv("LOCAL_SEARCH_BUDGET_MS", "0"))
+
+        # Большие маршруты: свыше порога клиенты разбиваются на кластеры и решаются параллельно
+        self.max_clients = int(os.getenv("MAX_CLIENTS", "2000"))
+        self.large_instance_threshold = int(os.getenv("LARGE_INSTANCE_THRESHOLD", "50"))
+        self.cluster_size = int(os.getenv("CLUSTER_SIZE", "40"))
+
+        # Ленивая матрица: на каждом шаге запрашиваются только переходы к k ближайшим
+        # доступным клиентам (0 - полная матрица до построения маршрута)
+        self.lazy_matrix_k = int(os.getenv("LAZY_MATRIX_K", "0"))
+        self.lazy_candidate_pool = int(os.getenv("LAZY_CANDIDATE_POOL", "4"))
+
+        # Остановки ближе допуска (метры) - один узел матриц; привязка узлов к дорогам
+        self.coord_dedup_m = float(os.getenv("COORD_DEDUP_METERS", "1"))
+        self.snap_to_roads = os.getenv("SNAP_TO_ROADS", "False").lower() in ("1", "true", "yes")
+
+        # Максимум маршрутов в пакетном запросе
+        self.batch_max_routes = int(os.getenv("BATCH_MAX_ROUTES", "500"))
+
+        # Кэш готовых маршрутов по каноническому ключу запроса (0 - выключен)
+        self.result_cache = RouteResultCache(
+            max_entries=int(os.getenv("RESULT_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "300"))
+        )
+        # Одинаковые запросы, которые уже оптимизируются: ключ -> future результата
+        self._inflight: Dict[str, asyncio.Future] = {}
 
     async def load_model(self):
         """Загрузить ML-модель"""
+        self.load_model_sync()
+
+    def load_model_sync(self):
+        """Загрузить ML-модель (блокирующий вариант для пула процессов)"""
         if self._model_loaded:
             return
 
         try:
-            # Создаём модель (in_dim=3: lat, lon, feature)
-            self.model = RouteNet(in_dim=3).to(self.device)
+            if self.model_backend == "numpy":
+                from app.ml.numpy_route_model import NumpyRouteNet
 
-            # Загружаем веса
-            self.model.load_state_dict(
-                torch.load(self.model_path, map_location=self.device)
-            )
-            self.model.eval()
+                self.model = NumpyRouteNet.load(self.model_path)
+            else:
+                import torch
+                from app.ml.route_model import RouteNet
+
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+                # Создаём модель (in_dim=3: lat, lon, feature)
+                self.model = RouteNet(in_dim=3).to(self.device)
+
+                # Загружаем веса
+                self.model.load_state_dict(
+                    torch.load(self.model_path, map_location=self.device)
+                )
+                self.model.eval()
 
             self._model_loaded = True
-            print(f"✅ ML-модель загружена из {self.model_path}")
+            self.model_version = f"{self.model_backend}:{os.path.getmtime(self.model_path)}"
+            print(f"✅ ML-модель загружена из {self.model_path} (бэкенд: {self.model_backend})")
 
         except FileNotFoundError:
             print(f"⚠ Модель не найдена: {self.model_path}")
@@ -65,6 +150,32 @@ class MLRouteOptimizer:
             print(f"⚠ Ошибка загрузки модели: {e}")
             raise
 
+    def _get_executor(self) -> Executor:
+        """Получить пул для CPU-части оптимизации, создав его при первом обращении"""
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.executor_workers,
+                    initializer=_init_process_optimizer,
+                    initargs=(
+                        self.model_path,
+                        self.traffic_service.traffic_config_path,
+                        self.model_backend
+                    )
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.executor_workers,
+                    thread_name_prefix="route-optimizer"
+                )
+        return self._executor
+
+    def shutdown(self):
+        """Остановить пул оптимизации (вызывается при завершении приложения)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
     def get_visit_duration(self, level: str) -> int:
         """
         Получить время обслуживания клиента в минутах.
@@ -75,109 +186,530 @@ class MLRouteOptimizer:
         Returns:
             Время обслуживания в минутах
         """
-        if level.lower() == "vip":
-            return 25
+        return get_visit_duration(level)
+
+    async def optimize_route(
+        self,
+        clients: List[ClientRecord],
+        start_point: Optional[ClientRecord] = None,
+        start_time: Optional[str] = "09:00",
+        start_day: Optional[str] = None,
+        time_budget_ms: Optional[int] = None,
+        on_event: Optional[RouteEventHandler] = None
+    ) -> RouteAnalysisResponse:
+        """
+        Оптимизировать маршрут посещения клиентов с использованием ML-модели.
+
+        Args:
+            clients: Список записей клиентов
+            start_point: Запись стартовой точки. Если None - используется первый клиент
+            start_time: Время начала маршрута (формат HH:MM)
+            start_day: День недели (Monday, Tuesday, etc.)
+            time_budget_ms: Бюджет улучшения маршрута локальным поиском (мс).
+                Если None - LOCAL_SEARCH_BUDGET_MS
+            on_event: Обработчик событий хода оптимизации ("matrix", "point" и т.д.)
+
+        Returns:
+            Оптимизированный маршрут
+        """
+        # Загружаем модель если ещё не загружена
+        if not self._model_loaded:
+            await self.load_model()
+
+        if time_budget_ms is None:
+            time_budget_ms = self.local_search_budget_ms
+
+        large_instance = len(clients) > self.large_instance_threshold
+
+        # Если указана стартовая точка, добавляем её в начало списка клиентов
+        if start_point:
+            clients = [start_point] + clients
+
+        if large_instance:
+            return await self._optimize_large(clients, start_time, start_day, time_budget_ms, on_event)
+
+        # Извлекаем координаты клиентов
+        coords = [c.coords for c in clients]
+
+        loop = asyncio.get_running_loop()
+
+        # Строим матрицы времени и расстояний (или ленивую матрицу, если она включена)
+        groups = await self._matrix_nodes(coords)
+        lazy_matrix = self._lazy_matrix(groups.stop_coords, loop)
+        if lazy_matrix is not None:
+            print(f"⏳ Ленивая матрица ({self.cost_provider.name}, k={lazy_matrix.k})")
+            if on_event:
+                on_event("matrix", {"status": "lazy", "points": len(coords), "k": lazy_matrix.k})
+            base_time_matrix, distance_matrix = lazy_matrix.time, lazy_matrix.distance
         else:
-            return 15
+            print(f"⏳ Расчёт матриц времени и расстояний ({self.cost_provider.name})...")
+            if on_event:
+                on_event("matrix", {"status": "started", "points": len(coords)})
+            base_time_matrix, distance_matrix = await self._node_matrices(groups)
+            if on_event:
+                on_event("matrix", {"status": "done", "points": len(coords)})
+            print("✅ Матрицы готовы.")
+
+        # CPU-часть (модель и построение маршрута) выполняется в пуле, event loop только ждёт
+        args = (
+            clients,
+            coords,
+            base_time_matrix,
+            distance_matrix,
+            start_time,
+            start_day,
+            self.traffic_service.get_engine(),
+            time_budget_ms
+        )
+        async with self._optimization_slots:
+            if self.executor_type == "process":
+                # Обработчик событий не передать в другой процесс - точки отдаются по готовности маршрута
+                response = await loop.run_in_executor(self._get_executor(), _build_route_in_process, *args)
+                self._emit_points(response, on_event)
+                return response
+            return await loop.run_in_executor(
+                self._get_executor(),
+                self._build_route,
+                *args,
+                on_event,
+                lazy_matrix
+            )
 
-    def parse_time_safe(self, val: str, default: str) -> datetime.time:
+    async def _matrix_nodes(self, coords: List[tuple]) -> CoordinateGroups:
         """
-        Безопасный парсинг времени.
+        Узлы матриц для точек маршрута.
+
+        Точки ближе COORD_DEDUP_METERS объединяются в один узел, при
+        SNAP_TO_ROADS узлы привязываются к дорогам источника (один раз на
+        точку, с кэшем) и совпавшие после привязки тоже объединяются.
 
         Args:
-            val: Значение времени (HH:MM)
-            default: Значение по умолчанию
+            coords: Координаты точек маршрута
 
         Returns:
-            Объект time
+            Узлы и соответствие точка -> узел
         """
-        try:
-            return datetime.strptime(str(val), "%H:%M").time()
-        except Exception:
-            return datetime.strptime(default, "%H:%M").time()
+        groups = CoordinateGroups(coords, self.coord_dedup_m)
+        if self.snap_to_roads:
+            groups.remap(await self.cost_provider.snap(groups.nodes))
+        if len(groups) < len(coords):
+            print(f"📍 Узлов матриц: {len(groups)} на {len(coords)} точек")
+        return groups
+
+    async def _node_matrices(self, groups: CoordinateGroups) -> Tuple[np.ndarray, np.ndarray]:
+        """Матрицы времени и расстояний по узлам, развёрнутые на точки маршрута"""
+        time_matrix, distance_matrix = await self.cost_provider.matrix(groups.nodes)
+        return groups.expand(time_matrix), groups.expand(distance_matrix)
+
+    async def build_matrices(self, coords: List[tuple]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Построить матрицы времени и расстояний для точек через узлы матриц.
 
-    def can_visit(self, at_time: datetime, client: Dict) -> bool:
+        Args:
+            coords: Координаты точек
+
+        Returns:
+            Кортеж (time_matrix, distance_matrix) по точкам
         """
-        Проверить, можно ли посетить клиента в указанное время.
+        return await self._node_matrices(await self._matrix_nodes(coords))
+
+    async def prefetch_matrices(self, coord_groups: List[list]) -> int:
+        """
+        Заранее загрузить матрицы нескольких маршрутов (пакетный запрос).
+
+        Маршруты с ленивой матрицей пропускаются: полная матрица им не нужна,
+        они запросят только переходы к ближайшим кандидатам.
 
         Args:
-            at_time: Время посещения
-            client: Данные клиента
+            coord_groups: Координаты точек каждого маршрута
 
         Returns:
-            True если клиент доступен
+            Количество обращений к источнику
         """
-        work_start = self.parse_time_safe(
-            client.get("work_start", "09:00"),
-            "09:00"
+        coord_groups = [coords for coords in coord_groups if not self._uses_lazy_matrix(len(coords))]
+        if not coord_groups:
+            return 0
+        groups = await asyncio.gather(*(self._matrix_nodes(coords) for coords in coord_groups))
+        return await self.cost_provider.prefetch([group.nodes for group in groups])
+
+    def _uses_lazy_matrix(self, points: int) -> bool:
+        """
+        Строится ли для маршрута из points точек ленивая матрица.
+
+        Не используется с пулом процессов (запросы к источнику выполняются
+        в event loop этого процесса), для оценки по прямой (она и так
+        бесплатна) и для маршрутов, где кандидатов не больше k.
+        """
+        return (
+            self.lazy_matrix_k > 0
+            and self.executor_type != "process"
+            and self.cost_provider.name != "haversine"
+            and points - 1 > self.lazy_matrix_k
         )
-        work_end = self.parse_time_safe(
-            client.get("work_end", "18:00"),
-            "18:00"
+
+    def _lazy_matrix(self, coords: List[tuple], loop: asyncio.AbstractEventLoop) -> Optional[LazyCostMatrix]:
+        """
+        Создать ленивую матрицу для маршрута, если она включена и имеет смысл.
+
+        Args:
+            coords: Координаты точек маршрута
+            loop: Event loop для запросов к источнику
+
+        Returns:
+            Ленивая матрица или None - тогда строится полная
+        """
+        if not self._uses_lazy_matrix(len(coords)):
+            return None
+        return LazyCostMatrix(coords, self.cost_provider, self.lazy_matrix_k, loop)
+
+    async def optimize_route_cached(
+        self,
+        clients: List[ClientRecord],
+        start_point: Optional[ClientRecord] = None,
+        start_time: Optional[str] = "09:00",
+        start_day: Optional[str] = None,
+        time_budget_ms: Optional[int] = None,
+        on_event: Optional[RouteEventHandler] = None
+    ) -> Tuple[RouteAnalysisResponse, str, bool]:
+        """
+        Оптимизировать маршрут через кэш результатов.
+
+        Ключ кэша - канонический хэш запроса: клиенты без учёта порядка,
+        стартовая точка, время и день старта, бюджет локального поиска,
+        версии модели и конфига трафика. Одновременные одинаковые запросы
+        ждут одну оптимизацию.
+
+        Args:
+            clients: Список записей клиентов
+            start_point: Запись стартовой точки. Если None - используется первый клиент
+            start_time: Время начала маршрута (формат HH:MM)
+            start_day: День недели (Monday, Tuesday, etc.). Если None - сегодня
+            time_budget_ms: Бюджет улучшения маршрута локальным поиском (мс)
+            on_event: Обработчик событий хода оптимизации. Для результата
+                из кэша сразу отдаются все точки маршрута
+
+        Returns:
+            Кортеж (оптимизированный маршрут, ETag, взят ли результат из кэша)
+        """
+        # Версия модели входит в ключ, поэтому модель загружается до его расчёта
+        if not self._model_loaded:
+            await self.load_model()
+
+        if time_budget_ms is None:
+            time_budget_ms = self.local_search_budget_ms
+        start_day = (start_day or datetime.now().strftime("%A")).lower()
+
+        key = route_cache_key(
+            clients,
+            start_point,
+            start_time,
+            start_day,
+            {
+                "model": self.model_version,
+                "traffic": self.traffic_service.get_table().version,
+                "cost_provider": self.cost_provider.name,
+                "time_budget_ms": time_budget_ms,
+                "large_instance_threshold": self.large_instance_threshold,
+                "cluster_size": self.cluster_size,
+                "lazy_matrix_k": self.lazy_matrix_k,
+                "lazy_candidate_pool": self.lazy_candidate_pool,
+                "coord_dedup_m": self.coord_dedup_m,
+                "snap_to_roads": self.snap_to_roads
+            }
         )
-        lunch_start = self.parse_time_safe(
-            client.get("lunch_start", "13:00"),
-            "13:00"
+
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            self._emit_points(cached[0], on_event)
+            return cached[0], cached[1], True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            try:
+                response, etag = await asyncio.shield(inflight)
+                self._emit_points(response, on_event)
+                return response, etag, True
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+            # Запрос, который считал маршрут, отменён - считаем заново
+            return await self.optimize_route_cached(
+                clients, start_point, start_time, start_day, time_budget_ms, on_event
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self.optimize_route(
+                clients, start_point, start_time, start_day, time_budget_ms, on_event
+            )
+            etag = response_etag(response)
+            self.result_cache.set(key, response, etag)
+            future.set_result((response, etag))
+            return response, etag, False
+        except (asyncio.CancelledError, OptimizationCancelled):
+            # Ожидающие этого расчёта не получают отмену чужого запроса - они считают заново
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку получает сам запрос; ожидающих может не быть
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def _optimize_large(
+        self,
+        clients: List[ClientRecord],
+        start_time: str,
+        start_day: Optional[str],
+        time_budget_ms: int,
+        on_event: Optional[RouteEventHandler] = None
+    ) -> RouteAnalysisResponse:
+        """
+        Оптимизировать большой маршрут через кластеризацию.
+
+        Клиенты разбиваются k-means на компактные кластеры (не больше
+        CLUSTER_SIZE), порядок кластеров выбирается по матрице между
+        медоидами, а полные матрицы строятся только внутри кластеров. Каждый
+        кластер решается отдельно (в пуле, параллельно) от медоида
+        предыдущего кластера с оценкой времени старта. Затем маршруты
+        сшиваются и итоговое расписание пересчитывается целиком.
+
+        Args:
+            clients: Список клиентов (первый - стартовая точка)
+            start_time: Время начала маршрута (формат HH:MM)
+            start_day: День недели (Monday, Tuesday, etc.)
+            time_budget_ms: Бюджет локального поиска для каждого кластера (мс)
+            on_event: Обработчик событий хода оптимизации. Точки маршрута
+                отдаются после сшивки кластеров
+
+        Returns:
+            Оптимизированный маршрут
+        """
+        coords = [c.coords for c in clients]
+        loop = asyncio.get_running_loop()
+        travel_engine = self.traffic_service.get_engine()
+
+        # Слот оптимизации занимается только на CPU-части, не на время запросов матриц
+        async with self._optimization_slots:
+            # Кластеры по клиентам без стартовой точки (индексы сдвинуты на 1)
+            groups = await loop.run_in_executor(
+                self._get_executor(),
+                partition,
+                coords[1:],
+                self.cluster_size
+            )
+        groups = [group + 1 for group in groups]
+        medoids = [medoid(coords, group) for group in groups]
+        print(f"🧩 Большой маршрут: {len(clients) - 1} клиентов, {len(groups)} кластеров")
+
+        # Порядок обхода кластеров по матрице между стартом и медоидами
+        cluster_time, _ = await self.build_matrices(
+            [coords[0]] + [coords[m] for m in medoids]
         )
-        lunch_end = self.parse_time_safe(
-            client.get("lunch_end", "14:00"),
-            "14:00"
+        cluster_order = [k - 1 for k in nearest_neighbour_order(cluster_time)[1:]]
+
+        # Каждый кластер стартует из медоида предыдущего (первый - из стартовой точки)
+        entries = [0] + [medoids[k] for k in cluster_order[:-1]]
+        sub_nodes = [[entry] + groups[k].tolist() for entry, k in zip(entries, cluster_order)]
+
+        built = 0
+
+        async def cluster_matrices(nodes: List[int]):
+            nonlocal built
+            # Ленивая матрица кластера: точные переходы запрашиваются при построении маршрута
+            groups = await self._matrix_nodes([coords[i] for i in nodes])
+            lazy_matrix = self._lazy_matrix(groups.stop_coords, loop)
+            if lazy_matrix is not None:
+                result = lazy_matrix.time, lazy_matrix.distance
+            else:
+                result = await self._node_matrices(groups)
+            built += 1
+            if on_event:
+                on_event("matrix", {"status": "progress", "done": built, "total": len(sub_nodes)})
+            return result, lazy_matrix
+
+        print(f"⏳ Расчёт матриц кластеров ({self.cost_provider.name})...")
+        if on_event:
+            on_event("matrix", {"status": "started", "points": len(coords), "clusters": len(sub_nodes)})
+        built_matrices = await asyncio.gather(*(cluster_matrices(nodes) for nodes in sub_nodes))
+        matrices = [result for result, _ in built_matrices]
+        lazy_matrices = [lazy_matrix for _, lazy_matrix in built_matrices]
+        if on_event:
+            on_event("matrix", {"status": "done", "points": len(coords), "clusters": len(sub_nodes)})
+        print("✅ Матрицы готовы.")
+
+        start_dt, day_of_week, day_index, clock_engine = self._route_clock(
+            start_time,
+            start_day,
+            travel_engine
         )
+        start_minutes = start_dt.hour * 60 + start_dt.minute
+
+        # Оценка времени старта каждого кластера: обслуживание + переход к ближайшему соседу
+        sub_args = []
+        t = float(start_minutes)
+        for nodes, (time_matrix, distance_matrix), lazy_matrix in zip(sub_nodes, matrices, lazy_matrices):
+            sub_clients = [clients[nodes[0]] if nodes[0] == 0 else ClientRecord.from_start_point(clients[nodes[0]])]
+            sub_clients += [clients[i] for i in nodes[1:]]
+
+            day_offset, minute = divmod(int(t), 24 * 60)
+            sub_day = DAYS[(day_index + day_offset) % 7] if day_of_week in DAY_INDEX else start_day
+            sub_args.append((
+                sub_clients,
+                [coords[i] for i in nodes],
+                time_matrix,
+                distance_matrix,
+                f"{minute // 60:02d}:{minute % 60:02d}",
+                sub_day,
+                travel_engine,
+                time_budget_ms,
+                None,
+                lazy_matrix
+            ))
 
-        t = at_time.time()
+            nearest = np.where(np.eye(len(nodes), dtype=bool), np.inf, time_matrix)[:, 1:].min(axis=0)
+            base_estimate = float(nearest.sum()) if len(nodes) > 1 else 0.0
+            t += float(clock_engine.travel_times(clock_engine.week_minute(day_index, t), base_estimate))
+            t += sum(c.service_time for c in sub_clients[1:])
+
+        # Подзадачи решаются параллельно в пуле
+        solve = _solve_order_in_process if self.executor_type == "process" else self._solve_order
+        async with self._optimization_slots:
+            orders = await asyncio.gather(*(
+                loop.run_in_executor(self._get_executor(), solve, *args)
+                for args in sub_args
+            ))
 
-        # Проверяем рабочее время и обеденный перерыв
-        return work_start <= t < work_end and not (lunch_start <= t < lunch_end)
+        # Сшиваем маршруты кластеров: переходы внутри берутся из матриц кластеров
+        full_order = [0]
+        legs: List[Optional[Tuple[float, float]]] = []
+        junctions: List[Tuple[int, int]] = []
+        for nodes, order, (time_matrix, distance_matrix) in zip(sub_nodes, orders, matrices):
+            for prev, pos in zip(order, order[1:]):
+                if prev == 0 and nodes[0] != full_order[-1]:
+                    # Переход между кластерами - его нет ни в одной матрице
+                    junctions.append((full_order[-1], nodes[pos]))
+                    legs.append(None)
+                else:
+                    legs.append((time_matrix[prev, pos], distance_matrix[prev, pos]))
+                full_order.append(nodes[pos])
+
+        if junctions:
+            endpoints = sorted({i for pair in junctions for i in pair})
+            position = {i: k for k, i in enumerate(endpoints)}
+            junction_time, junction_distance = await self.build_matrices(
+                [coords[i] for i in endpoints]
+            )
+            pending = iter(junctions)
+            for k, leg in enumerate(legs):
+                if leg is None:
+                    u, v = next(pending)
+                    legs[k] = (
+                        junction_time[position[u], position[v]],
+                        junction_distance[position[u], position[v]]
+                    )
 
-    async def optimize_route(
+        timer = RouteTimer(clock_engine, clients)
+        schedule = timer.schedule_legs(
+            full_order,
+            clock_engine.week_minute(day_index, start_minutes),
+            [leg[0] for leg in legs]
+        )
+        if schedule is None:
+            raise RuntimeError("Не удалось составить расписание сшитого маршрута")
+
+        route_data, total_time, total_distance = self._schedule_route_data(
+            schedule,
+            clients,
+            [leg[1] for leg in legs],
+            (0, start_dt, start_dt, 0.0, 0.0),
+            start_dt.replace(hour=0, minute=0),
+            clock_engine.week_minute(day_index, 0)
+        )
+        response = self._route_response(clients, route_data, total_time, total_distance)
+        self._emit_points(response, on_event)
+        return response
+
+    def _build_route(
         self,
-        clients: List[Dict],
-        start_point: Optional[Dict] = None,
-        start_time: Optional[str] = "09:00",
-        start_day: Optional[str] = None
+        clients: List[ClientRecord],
+        coords: List[tuple],
+        base_time_matrix: np.ndarray,
+        distance_matrix: np.ndarray,
+        start_time: str,
+        start_day: Optional[str],
+        travel_engine: TravelTimeEngine,
+        time_budget_ms: int = 0,
+        on_event: Optional[RouteEventHandler] = None,
+        lazy_matrix: Optional[LazyCostMatrix] = None
     ) -> RouteAnalysisResponse:
         """
-        Оптимизировать маршрут посещения клиентов с использованием ML-модели.
+        Построить маршрут по готовым матрицам (CPU-часть, выполняется в пуле).
 
         Args:
-            clients: Список клиентов с данными
-            start_point: Стартовая точка dict с 'address', 'latitude', 'longitude'. Если None - используется первый клиент
+            clients: Список клиентов (первый - стартовая точка)
+            coords: Координаты клиентов [(lat, lon), ...]
+            base_time_matrix: Матрица времени в пути без учёта трафика (минуты)
+            distance_matrix: Матрица расстояний (км)
             start_time: Время начала маршрута (формат HH:MM)
             start_day: День недели (Monday, Tuesday, etc.)
+            travel_engine: Снимок движка времени в пути на момент запроса
+            time_budget_ms: Бюджет улучшения маршрута локальным поиском (мс, 0 - без улучшения)
+            on_event: Обработчик событий: точка маршрута отдаётся, как только выбран переход к ней
+            lazy_matrix: Ленивая матрица, массивы которой переданы как матрицы времени и расстояний
 
         Returns:
             Оптимизированный маршрут
         """
-        # Загружаем модель если ещё не загружена
-        if not self._model_loaded:
-            await self.load_model()
+        route_data, total_time, total_distance = self._construct_route(
+            clients,
+            coords,
+            base_time_matrix,
+            distance_matrix,
+            start_time,
+            start_day,
+            travel_engine,
+            time_budget_ms,
+            on_event,
+            lazy_matrix
+        )
+        return self._route_response(clients, route_data, total_time, total_distance)
 
-        # Если указана стартовая точка, добавляем её в начало списка клиентов
-        if start_point:
-            start_client = {
-                "address": start_point["address"],
-                "latitude": start_point["latitude"],
-                "longitude": start_point["longitude"],
-                "level": "start",
-                "work_start": "00:00",
-                "work_end": "23:59",
-                "lunch_start": "23:59",
-                "lunch_end": "23:59",
-                "id": "START"
-            }
-            clients = [start_client] + clients
+    def _solve_order(self, *args) -> List[int]:
+        """
+        Построить маршрут подзадачи и вернуть только порядок точек.
 
-        # Извлекаем координаты и данные клиентов
-        coords = [(c["latitude"], c["longitude"]) for c in clients]
-        n = len(clients)
+        Args:
+            *args: Аргументы _build_route
 
-        # Строим матрицы времени и расстояний через OSRM
-        print("⏳ Расчёт матриц времени и расстояний через OSRM...")
-        base_time_matrix = await self.osrm_service.build_time_matrix(coords)
-        distance_matrix = await self.osrm_service.build_distance_matrix(coords)
-        print("✅ Матрицы готовы.")
+        Returns:
+            Порядок индексов клиентов (первый - стартовая точка)
+        """
+        route_data, _, _ = self._construct_route(*args)
+        return [data[0] for data in route_data]
+
+    @staticmethod
+    def _route_clock(
+        start_time: str,
+        start_day: Optional[str],
+        travel_engine: TravelTimeEngine
+    ) -> Tuple[datetime, str, int, TravelTimeEngine]:
+        """
+        Определить время и день старта маршрута.
 
-        # Определяем время старта
+        Args:
+            start_time: Время начала маршрута (формат HH:MM)
+            start_day: День недели (Monday, Tuesday, etc.)
+            travel_engine: Движок времени в пути
+
+        Returns:
+            Кортеж (время старта, день недели, индекс дня, движок времени в пути).
+            Для неизвестного дня трафик не учитывается (коэффициент 1.0)
+        """
         current_time = datetime.now().replace(
             hour=int(start_time.split(":")[0]),
             minute=int(start_time.split(":")[1]),
@@ -185,97 +717,157 @@ class MLRouteOptimizer:
             microsecond=0
         )
 
-        # Определяем день недели
         if start_day:
             day_of_week = start_day.lower()
         else:
             day_of_week = current_time.strftime("%A").lower()
 
+        day_index = DAY_INDEX.get(day_of_week)
+        if day_index is None:
+            travel_engine = TravelTimeEngine(TrafficTable.from_config({}), travel_engine.scale)
+            day_index = 0
+
+        return current_time, day_of_week, day_index, travel_engine
+
+    def _construct_route(
+        self,
+        clients: List[ClientRecord],
+        coords: List[tuple],
+        base_time_matrix: np.ndarray,
+        distance_matrix: np.ndarray,
+        start_time: str,
+        start_day: Optional[str],
+        travel_engine: TravelTimeEngine,
+        time_budget_ms: int = 0,
+        on_event: Optional[RouteEventHandler] = None,
+        lazy_matrix: Optional[LazyCostMatrix] = None
+    ) -> Tuple[list, float, float]:
+        """
+        Построить маршрут жадным выбором и улучшить его локальным поиском.
+
+        Args:
+            clients: Список клиентов (первый - стартовая точка)
+            coords: Координаты клиентов [(lat, lon), ...]
+            base_time_matrix: Матрица времени в пути без учёта трафика (минуты)
+            distance_matrix: Матрица расстояний (км)
+            start_time: Время начала маршрута (формат HH:MM)
+            start_day: День недели (Monday, Tuesday, etc.)
+            travel_engine: Снимок движка времени в пути на момент запроса
+            time_budget_ms: Бюджет улучшения маршрута локальным поиском (мс, 0 - без улучшения)
+            on_event: Обработчик событий "point". Без локального поиска точка отдаётся
+                сразу после выбора перехода, с ним - после улучшения маршрута
+                (локальный поиск может изменить порядок)
+            lazy_matrix: Ленивая матрица, массивы которой переданы как матрицы времени
+                и расстояний. На каждом шаге выбор идёт среди k лучших по оценке
+                кандидатов, переходы к которым запрашиваются у источника
+
+        Returns:
+            Кортеж (данные переходов, общее время, общее расстояние)
+        """
+        n = len(clients)
+        stream_legs = on_event is not None and not (time_budget_ms > 0 and n > 2)
+        emitted = 0
+
+        # Attention scores всех клиентов - одним батчем
+        attn_scores = self._get_attention_scores(coords)
+
+        # Определяем время и день старта
+        current_time, day_of_week, day_index, travel_engine = self._route_clock(
+            start_time,
+            start_day,
+            travel_engine
+        )
+
+        # Отсчёт времени маршрута от полуночи дня старта (для переходов через полночь)
+        route_day_start = current_time.replace(hour=0, minute=0)
+        route_start = travel_engine.week_minute(day_index, current_time.hour * 60 + current_time.minute)
+
         print(f"\n📅 День недели: {day_of_week.capitalize()}, старт: {current_time.strftime('%H:%M')}")
 
+        selector = GreedySelector.from_records(base_time_matrix, attn_scores, clients)
+
         # Инициализация маршрута
         route: List[int] = [0]  # Начинаем с первого клиента
-        visited: Set[int] = {0}
+        selector.mark_visited(0)
         total_time = 0.0
         total_distance = 0.0
 
         # Для хранения данных о каждом переходе
         route_data = []  # [(client_idx, arrival_time, departure_time, travel_time, distance)]
         route_data.append((0, current_time, current_time, 0.0, 0.0))  # Стартовая точка
+        if stream_legs:
+            emitted = self._emit_route_data(clients, route_data, emitted, on_event)
 
         # Основной цикл построения маршрута
-        while len(visited) < n:
+        while selector.visited_count < n:
             current_node = route[-1]
 
-            best_j: Optional[int] = None
-            best_score = -float("inf")
-            best_arrival_time: Optional[datetime] = None
-            best_departure_time: Optional[datetime] = None
-            best_travel_time: Optional[float] = None
-
-            any_available_later = False
-
-            # Перебираем всех непосещённых клиентов
-            for j in range(n):
-                if j in visited or j == current_node:
-                    continue
-
-                # Получаем базовое время в пути
-                base_time = base_time_matrix[current_node][j]
-
-                # Применяем коэффициент трафика
-                traffic_mult = self.traffic_service.get_traffic_multiplier(
-                    current_time.hour,
-                    day_of_week
+            # Время в пути ко всем клиентам с учётом трафика на всём протяжении перехода
+            depart = travel_engine.week_minute(
+                day_index,
+                (current_time - route_day_start) // timedelta(microseconds=1) / MINUTE_US
+            )
+            if lazy_matrix is None:
+                travel_times = travel_engine.travel_times(depart, base_time_matrix[current_node])
+
+                # Выбираем лучшего доступного клиента среди всех непосещённых
+                best_j, best_travel_time, any_available_later = selector.select(
+                    current_node,
+                    current_time,
+                    travel_times
+                )
+            else:
+                # Кандидаты - ближайшие доступные по пространственному индексу
+                best_j, best_travel_time, any_available_later, travel_times = self._lazy_select(
+                    selector,
+                    lazy_matrix,
+                    travel_engine,
+                    current_node,
+                    current_time,
+                    depart,
+                    self.lazy_candidate_pool
                 )
-                # Умножаем коэффициент пробки на 0.65
-                adjusted_time = base_time * (traffic_mult * 0.65)
-
-                # Вычисляем время прибытия
-                tentative_arrival = current_time + timedelta(minutes=adjusted_time)
-
-                # Проверяем доступность клиента
-                if not self.can_visit(tentative_arrival, clients[j]):
-                    any_available_later = True
-                    continue
-
-                # Получаем attention score от модели
-                attn_score = await self._get_attention_score(coords[j])
-
-                # Вычисляем итоговый score
-                score = attn_score / (adjusted_time + 1e-5)
-
-                if score > best_score:
-                    best_score = score
-                    best_j = j
-                    best_arrival_time = tentative_arrival
-                    best_travel_time = adjusted_time
-
-                    # Время обслуживания зависит от уровня клиента
-                    service_duration = self.get_visit_duration(
-                        clients[j].get("level", "standard")
-                    )
-                    best_departure_time = tentative_arrival + timedelta(minutes=service_duration)
 
             # Если никого не нашли
             if best_j is None:
+                wake_time = None
                 if any_available_later:
-                    # Ждём 15 минут
-                    print(f"⏸ Все клиенты заняты. Ждём 15 минут... ({current_time.strftime('%H:%M')})")
-                    current_time += timedelta(minutes=15)
-                    continue
-                else:
+                    wake_time = self._next_opening(
+                        selector,
+                        travel_engine,
+                        base_time_matrix[current_node],
+                        current_node,
+                        current_time,
+                        travel_times,
+                        depart,
+                        route_day_start,
+                        day_index
+                    )
+
+                if wake_time is None:
                     # Больше нет доступных клиентов
                     break
 
+                # Ждём сразу до ближайшего открытия окна
+                print(
+                    f"⏸ Все клиенты заняты. Ждём до {wake_time.strftime('%H:%M')}... "
+                    f"({current_time.strftime('%H:%M')})"
+                )
+                current_time = wake_time
+                continue
+
+            best_arrival_time = current_time + timedelta(minutes=best_travel_time)
+
+            # Время обслуживания зависит от уровня клиента
+            service_time = clients[best_j].service_time
+            best_departure_time = best_arrival_time + timedelta(minutes=service_time)
+
             # Добавляем клиента в маршрут
             route.append(best_j)
-            visited.add(best_j)
-
-            service_time = self.get_visit_duration(clients[best_j].get("level", "standard"))
+            selector.mark_visited(best_j)
 
             # Получаем расстояние между текущей точкой и следующей
-            distance = distance_matrix[current_node][best_j]
+            distance = distance_matrix[current_node, best_j]
 
             total_time += best_travel_time + service_time
             total_distance += distance
@@ -289,10 +881,12 @@ class MLRouteOptimizer:
                 best_travel_time,
                 distance
             ))
+            if stream_legs:
+                emitted = self._emit_route_data(clients, route_data, emitted, on_event)
 
             # Получаем ID клиентов для лога
-            current_id = clients[current_node].get("id", f"client_{current_node}")
-            next_id = clients[best_j].get("id", f"client_{best_j}")
+            current_id = clients[current_node].id
+            next_id = clients[best_j].id
 
             print(
                 f"➡ ID {current_id} → ID {next_id} | "
@@ -302,20 +896,224 @@ class MLRouteOptimizer:
                 f"Отправление: {best_departure_time.strftime('%H:%M')}"
             )
 
-        # Формируем результат
-        route_points = []
-        for idx, (client_idx, arrival_time, departure_time, travel_time, distance) in enumerate(route_data):
-            client = clients[client_idx]
-            route_points.append(RoutePoint(
-                order=idx + 1,
-                address=client["address"],
-                latitude=client["latitude"],
-                longitude=client["longitude"],
-                estimated_arrival=arrival_time.strftime("%H:%M") if arrival_time else None,
-                departure_time=departure_time.strftime("%H:%M") if departure_time else None,
-                travel_time=round(travel_time, 2),
-                service_time=self.get_visit_duration(client.get("level", "standard"))
-            ))
+        # Улучшаем маршрут локальным поиском (2-opt / Or-opt) в пределах бюджета
+        if time_budget_ms > 0 and len(route) > 2:
+            if lazy_matrix is None:
+                improver = RouteImprover(base_time_matrix, travel_engine, clients)
+                schedule, moves = improver.improve(route, route_start, time_budget_ms)
+            else:
+                schedule, moves = self._lazy_improve(
+                    lazy_matrix,
+                    travel_engine,
+                    clients,
+                    route,
+                    route_start,
+                    time_budget_ms
+                )
+            if schedule is not None:
+                greedy_travel = sum(data[3] for data in route_data)
+                route_data, total_time, total_distance = self._schedule_route_data(
+                    schedule,
+                    clients,
+                    [distance_matrix[u, v] for u, v in zip(schedule.order, schedule.order[1:])],
+                    route_data[0],
+                    route_day_start,
+                    travel_engine.week_minute(day_index, 0)
+                )
+                print(
+                    f"🔧 Локальный поиск: {moves} улучшений, "
+                    f"в пути {greedy_travel:.1f} → {schedule.total_travel:.1f} мин"
+                )
+
+        if lazy_matrix is not None:
+            print(
+                f"🔎 Ленивая матрица: {lazy_matrix.known_pairs} из {n * (n - 1)} пар, "
+                f"{lazy_matrix.requests} запросов"
+            )
+
+        if on_event is not None:
+            self._emit_route_data(clients, route_data, emitted, on_event)
+
+        return route_data, total_time, total_distance
+
+    @staticmethod
+    def _lazy_select(
+        selector: GreedySelector,
+        lazy_matrix: LazyCostMatrix,
+        travel_engine: TravelTimeEngine,
+        current_node: int,
+        current_time: datetime,
+        depart: float,
+        pool: int = 1
+    ) -> Tuple[Optional[int], float, bool, np.ndarray]:
+        """
+        Выбрать следующего клиента по ленивой матрице.
+
+        Пространственный индекс отбирает пул из pool * k ближайших
+        непосещённых клиентов, доступных к прибытию по оценке времени в пути.
+        Пул ранжируется по score GreedySelector (attention score / оценка
+        времени), переходы к k лучшим запрашиваются одним запросом, и выбор
+        идёт только среди них - так клиент с высоким score чуть дальше k
+        ближайших не теряется. Если по точному времени никто из них не
+        доступен, берутся следующие k (пул растёт вместе с ними); когда
+        доступных по оценке больше нет, выбор или ожидание открытия окна
+        решается по всем клиентам, как с полной матрицей (для незапрошенных -
+        по оценке).
+
+        Args:
+            selector: Движок выбора следующего клиента
+            lazy_matrix: Ленивая матрица
+            travel_engine: Движок времени в пути
+            current_node: Индекс текущей точки
+            current_time: Время отправления
+            depart: Время отправления в минутах от начала недели
+            pool: Во сколько раз пул ранжируемых кандидатов больше k
+
+        Returns:
+            Кортеж как у GreedySelector.select и время в пути ко всем клиентам
+            после запроса точных значений
+        """
+        row = lazy_matrix.time[current_node]
+
+        limit = 0
+        while True:
+            limit += lazy_matrix.k
+            pool_size = limit * max(pool, 1)
+
+            # Оценка может ошибаться на время самого перехода: клиент, к открытию
+            # которого по оценке приезжаем раньше, по точному времени может быть доступен
+            estimated = travel_engine.travel_times(depart, row)
+            waits = selector.opening_waits(current_node, current_time, estimated) / MINUTE_US
+
+            def feasible(idx: np.ndarray) -> np.ndarray:
+                return waits[idx] <= estimated[idx]
+
+            nearest = lazy_matrix.index.nearest(lazy_matrix.coords[current_node], pool_size, feasible)
+
+            # Ранжируем пул по score выбора на оценочном времени с ожиданием открытия
+            with np.errstate(divide="ignore", invalid="ignore"):
+                estimate = selector.attn_scores[nearest] / (estimated[nearest] + waits[nearest] + 1e-5)
+            estimate = np.where(np.isnan(estimate), -np.inf, estimate)
+            candidates = nearest[np.argsort(-estimate, kind="stable")[:limit]]
+
+            lazy_matrix.fetch(current_node, candidates)
+            travel_times = travel_engine.travel_times(depart, row)
+
+            # Пока пул не исчерпан, выбираем только среди запрошенных
+            allowed = None
+            if len(nearest) == pool_size or len(candidates) < len(nearest):
+                allowed = np.zeros(len(row), dtype=bool)
+                allowed[candidates] = True
+
+            best_j, best_travel_time, any_available_later = selector.select(
+                current_node,
+                current_time,
+                travel_times,
+                allowed
+            )
+            if best_j is not None or allowed is None:
+                return best_j, best_travel_time, any_available_later, travel_times
+
+    @staticmethod
+    def _lazy_improve(
+        lazy_matrix: LazyCostMatrix,
+        travel_engine: TravelTimeEngine,
+        clients: List[ClientRecord],
+        route: List[int],
+        route_start: float,
+        time_budget_ms: int
+    ) -> Tuple[Optional[RouteSchedule], int]:
+        """
+        Улучшить маршрут локальным поиском по ленивой матрице.
+
+        Сначала запрашиваются переходы от каждой точки к k ближайшим, для
+        остальных пар локальный поиск видит оценку по прямой. Переходы
+        найденного маршрута запрашиваются, и он принимается, только если
+        лучше текущего по точным значениям. Поиск повторяется от текущего
+        маршрута по уточнённой матрице, пока не исчерпан бюджет или проход
+        не перестал находить улучшения.
+
+        Args:
+            lazy_matrix: Ленивая матрица
+            travel_engine: Движок времени в пути
+            clients: Записи клиентов (первая - стартовая точка)
+            route: Порядок точек жадного маршрута (все переходы точные)
+            route_start: Время старта в минутах от начала недели
+            time_budget_ms: Бюджет времени на улучшение (мс)
+
+        Returns:
+            Кортеж (лучшее расписание по точным значениям или None, если
+            улучшить не удалось, количество принятых ходов)
+        """
+        deadline = time.perf_counter() + time_budget_ms / 1000.0
+        timer = RouteTimer(travel_engine, clients)
+
+        # Улучшающие ходы в основном соединяют соседние точки - их переходы запрашиваются сразу
+        lazy_matrix.fetch_neighbours()
+
+        def exact(order: List[int]) -> Optional[RouteSchedule]:
+            return timer.schedule_legs(
+                order,
+                route_start,
+                [lazy_matrix.time[u, v] for u, v in zip(order, order[1:])]
+            )
+
+        current = exact(route)
+        if current is None:
+            return None, 0
+
+        best, best_moves = None, 0
+        while True:
+            remaining_ms = (deadline - time.perf_counter()) * 1000.0
+            if remaining_ms <= 0:
+                break
+
+            improver = RouteImprover(lazy_matrix.time, travel_engine, clients)
+            candidate, moves = improver.improve(current.order, route_start, remaining_ms)
+            if candidate is None:
+                break
+
+            legs = list(zip(candidate.order, candidate.order[1:]))
+            estimated = not all(lazy_matrix.known[u, v] for u, v in legs)
+            lazy_matrix.fetch_legs(candidate.order)
+
+            # Принимается только улучшение по точным значениям, следующий проход - от него
+            candidate = exact(candidate.order)
+            if (
+                candidate is not None
+                and candidate.total_travel < current.total_travel - IMPROVEMENT_EPS
+                and candidate.end <= current.end + IMPROVEMENT_EPS
+            ):
+                current = best = candidate
+                best_moves += moves
+            elif not estimated:
+                break
+
+        return best, best_moves
+
+    @staticmethod
+    def _route_response(
+        clients: List[ClientRecord],
+        route_data: list,
+        total_time: float,
+        total_distance: float
+    ) -> RouteAnalysisResponse:
+        """
+        Сформировать ответ по данным переходов маршрута.
+
+        Args:
+            clients: Список клиентов
+            route_data: Данные переходов [(client_idx, arrival, departure, travel_time, distance)]
+            total_time: Общее время (минуты)
+            total_distance: Общее расстояние (км)
+
+        Returns:
+            Оптимизированный маршрут
+        """
+        route_points = [
+            MLRouteOptimizer._route_point(clients, idx, data)
+            for idx, data in enumerate(route_data)
+        ]
 
         print("\n✅ Оптимальный маршрут построен!")
         print(f"⏱ Общее время: {total_time:.1f} минут")
@@ -327,35 +1125,254 @@ class MLRouteOptimizer:
             optimized_route=route_points,
         )
 
-    async def _get_attention_score(self, coords: tuple) -> float:
+    @staticmethod
+    def _route_point(clients: List[ClientRecord], idx: int, data: tuple) -> RoutePoint:
         """
-        Получить attention score от модели для конкретных координат.
+        Точка ответа по данным перехода.
 
         Args:
-            coords: Кортеж (latitude, longitude)
+            clients: Список клиентов
+            idx: Позиция точки в маршруте (с 0)
+            data: Данные перехода (client_idx, arrival, departure, travel_time, distance)
 
         Returns:
-            Attention score
+            Точка маршрута
+        """
+        client_idx, arrival_time, departure_time, travel_time, _ = data
+        client = clients[client_idx]
+        return RoutePoint(
+            order=idx + 1,
+            address=client.address,
+            latitude=client.latitude,
+            longitude=client.longitude,
+            estimated_arrival=arrival_time.strftime("%H:%M") if arrival_time else None,
+            departure_time=departure_time.strftime("%H:%M") if departure_time else None,
+            travel_time=round(travel_time, 2),
+            service_time=client.service_time
+        )
+
+    @staticmethod
+    def _emit_route_data(
+        clients: List[ClientRecord],
+        route_data: list,
+        emitted: int,
+        on_event: RouteEventHandler
+    ) -> int:
+        """
+        Отдать обработчику ещё не отданные точки маршрута.
+
+        Args:
+            clients: Список клиентов
+            route_data: Данные переходов маршрута
+            emitted: Сколько точек уже отдано
+            on_event: Обработчик событий
+
+        Returns:
+            Количество отданных точек
+        """
+        for idx in range(emitted, len(route_data)):
+            on_event("point", MLRouteOptimizer._route_point(clients, idx, route_data[idx]).model_dump())
+        return len(route_data)
+
+    @staticmethod
+    def _emit_points(response: RouteAnalysisResponse, on_event: Optional[RouteEventHandler]):
+        """Отдать обработчику все точки готового маршрута"""
+        if on_event is None:
+            return
+        for point in response.optimized_route:
+            on_event("point", point.model_dump())
+
+    @staticmethod
+    def _schedule_route_data(
+        schedule: RouteSchedule,
+        clients: List[ClientRecord],
+        leg_distances: List[float],
+        start_data: tuple,
+        route_day_start: datetime,
+        day_offset: float
+    ) -> Tuple[list, float, float]:
+        """
+        Перевести расписание локального поиска в данные переходов маршрута.
+
+        Args:
+            schedule: Расписание маршрута
+            clients: Список клиентов
+            leg_distances: Расстояние каждого перехода (км)
+            start_data: Данные стартовой точки маршрута
+            route_day_start: Полночь дня старта маршрута
+            day_offset: Начало дня старта в минутах от начала недели
+
+        Returns:
+            Кортеж (данные переходов, общее время, общее расстояние)
+        """
+        route_data = [start_data]
+        total_time = 0.0
+        total_distance = 0.0
+
+        order = schedule.order
+        for k in range(1, len(order)):
+            client_idx = order[k]
+            service_time = clients[client_idx].service_time
+            arrival_time = route_day_start + timedelta(minutes=schedule.arrival[k] - day_offset)
+            departure_time = arrival_time + timedelta(minutes=service_time)
+            travel_time = schedule.travel[k - 1]
+            distance = leg_distances[k - 1]
+
+            total_time += travel_time + service_time
+            total_distance += distance
+            route_data.append((client_idx, arrival_time, departure_time, travel_time, distance))
+
+        return route_data, total_time, total_distance
+
+    @staticmethod
+    def _next_opening(
+        selector: GreedySelector,
+        travel_engine: TravelTimeEngine,
+        base_times: np.ndarray,
+        current_node: int,
+        current_time: datetime,
+        travel_times: np.ndarray,
+        depart: float,
+        route_day_start: datetime,
+        day_index: int
+    ) -> Optional[datetime]:
+        """
+        Найти момент отправления, при котором первый из клиентов станет доступен.
+
+        Для каждого кандидата прибытие сдвигается на ожидание до открытия его окна,
+        а по профилю трафика находится отправление, дающее такое прибытие.
+        Ожидание - минимум по всем кандидатам, без пошагового перебора времени.
+
+        Args:
+            selector: Движок выбора клиентов
+            travel_engine: Движок времени в пути
+            base_times: Базовое время в пути от текущей точки (минуты)
+            current_node: Индекс текущей точки
+            current_time: Текущее время
+            travel_times: Время в пути от текущей точки с учётом трафика (минуты)
+            depart: Текущее время в минутах от начала недели
+            route_day_start: Полночь дня старта маршрута
+            day_index: Индекс дня старта маршрута
+
+        Returns:
+            Время, до которого нужно ждать, или None, если окон больше нет
         """
-        # Создаём признаки узла
+        waits = selector.opening_waits(current_node, current_time, travel_times)
+        reachable = np.isfinite(waits)
+        if not reachable.any():
+            return None
+
+        arrivals = depart + travel_times[reachable] + waits[reachable] / MINUTE_US
+        wake = float(travel_engine.departure_times(arrivals, base_times[reachable]).min())
+
+        # Округляем вверх до секунды, чтобы погрешность не вернула прибытие раньше открытия
+        wake_time = route_day_start + timedelta(
+            seconds=math.ceil((wake - travel_engine.week_minute(day_index, 0)) * 60)
+        )
+        return max(wake_time, current_time + timedelta(seconds=1))
+
+    def _get_attention_scores(self, coords: List[tuple]) -> np.ndarray:
+        """
+        Получить attention scores от модели для списка координат.
+
+        Каждая точка оценивается как отдельный граф из одного узла с петлёй,
+        поэтому все непосчитанные точки проходят через модель за один батч:
+        граф из n несвязанных петель, softmax применяется внутри каждого
+        графа-узла. Результаты запоминаются по координатам и переиспользуются
+        между запросами.
+
+        Args:
+            coords: Список кортежей (latitude, longitude)
+
+        Returns:
+            Массив attention scores в порядке coords
+        """
+        keys = [(float(lat), float(lon)) for lat, lon in coords]
+        with self._score_lock:
+            cached = {key: self._score_cache[key] for key in keys if key in self._score_cache}
+        missing = list(dict.fromkeys(key for key in keys if key not in cached))
+
+        if missing:
+            if self.model_backend == "numpy":
+                attn = self.model.attention_scores(np.array(missing)).tolist()
+            else:
+                attn = self._get_torch_attention_scores(missing)
+            cached.update(zip(missing, attn))
+
+        scores = np.array([cached[key] for key in keys], dtype=np.float64)
+
+        with self._score_lock:
+            for key in keys:
+                self._score_cache[key] = cached[key]
+                self._score_cache.move_to_end(key)
+
+            while len(self._score_cache) > self.score_cache_size:
+                self._score_cache.popitem(last=False)
+
+        return scores
+
+    def _get_torch_attention_scores(self, coords: List[Tuple[float, float]]) -> List[float]:
+        """
+        Прогнать точки через torch-модель одним батчем.
+
+        Args:
+            coords: Список кортежей (latitude, longitude)
+
+        Returns:
+            Список attention scores в порядке coords
+        """
+        import torch
+
+        # Создаём признаки узлов
         node_feat = torch.tensor(
-            [[coords[0], coords[1], 0.0]],
+            [[lat, lon, 0.0] for lat, lon in coords],
             dtype=torch.float32
         ).to(self.device)
 
-        # Создаём фиктивный граф (для одного узла)
-        edge_index = torch.tensor(
-            [[0, 0], [0, 0]],
-            dtype=torch.long
-        ).to(self.device)
+        # Каждый узел связан только сам с собой
+        edge_index = torch.arange(len(coords), dtype=torch.long).repeat(2, 1).to(self.device)
 
-        edge_attr = torch.zeros((1, 1), dtype=torch.float32).to(self.device)
+        # Получаем scores от модели и нормализуем их внутри каждого графа
+        with torch.no_grad():
+            node_scores = self.model.node_scores(node_feat, edge_index)
+            attn = torch.softmax(node_scores.unsqueeze(-1), dim=-1).squeeze(-1)
 
-        # Создаём Data объект
-        data = Data(x=node_feat, edge_index=edge_index, edge_attr=edge_attr)
+        return attn.cpu().tolist()
+
+    def _get_attention_score(self, coords: tuple) -> float:
+        """
+        Получить attention score от модели для конкретных координат.
+
+        Args:
+            coords: Кортеж (latitude, longitude)
+
+        Returns:
+            Attention score
+        """
+        scores = self._get_attention_scores([coords])
+        return float(scores[0])
+
+
+# Оптимизатор процесса-воркера (для OPTIMIZER_EXECUTOR=process)
+_process_optimizer: Optional[MLRouteOptimizer] = None
+
+
+def _init_process_optimizer(model_path: str, traffic_config_path: str, model_backend: str):
+    """Инициализировать оптимизатор в процессе-воркере и загрузить модель"""
+    global _process_optimizer
+    _process_optimizer = MLRouteOptimizer(
+        model_path=model_path,
+        traffic_config_path=traffic_config_path
+    )
+    _process_optimizer.model_backend = model_backend
+    _process_optimizer.load_model_sync()
+
+
+def _build_route_in_process(*args) -> RouteAnalysisResponse:
+    """Построить маршрут в процессе-воркере"""
+    return _process_optimizer._build_route(*args)
 
-        # Получаем attention score от модели
-        with torch.no_grad():
-            attn_score = self.model(data).item()
 
-        return attn_score
+def _solve_order_in_process(*args) -> List[int]:
+    """Построить маршрут подзадачи в процессе-воркере и вернуть порядок точек"""
+    return _process_optimizer._solve_order(*args)
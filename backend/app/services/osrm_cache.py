@@ -0,0 +1,355 @@
+"""Кэш результатов OSRM для пар точек"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+# Примерный размер одной записи в памяти (ключ из 4 float, словарь значения,
+# узел OrderedDict), используется для перевода бюджета памяти в число записей
+ENTRY_SIZE_BYTES = 512
+
+
+class OSRMPairCache:
+    """
+    Ограниченный кэш пар точек с вытеснением LRU и временем жизни записей.
+
+    Размер задаётся бюджетом памяти, который переводится в максимальное
+    число записей. У каждой записи свой TTL: обычные результаты живут
+    долго, fallback-значения (негативный кэш) - коротко, чтобы временный
+    сбой OSRM не портил пары до перезапуска.
+    """
+
+    def __init__(
+        self,
+        max_memory_mb: float = 64.0,
+        ttl: float = 7 * 24 * 3600,
+        negative_ttl: float = 300.0
+    ):
+        """
+        Инициализация кэша.
+
+        Args:
+            max_memory_mb: Бюджет памяти в мегабайтах
+            ttl: Время жизни обычной записи в секундах (0 - без ограничения)
+            negative_ttl: Время жизни fallback-записи в секундах
+        """
+        self.max_entries = max(1, int(max_memory_mb * 1024 * 1024 / ENTRY_SIZE_BYTES))
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        # key -> (value, expires_at), порядок - от давно использованных к недавним
+        self._data: "OrderedDict[Hashable, Tuple[Dict[str, float], float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expires_at(self, ttl: Optional[float]) -> float:
+        """Вычислить момент истечения записи"""
+        ttl = self.ttl if ttl is None else ttl
+        return time.monotonic() + ttl if ttl > 0 else float("inf")
+
+    def get(self, key: Hashable) -> Optional[Dict[str, float]]:
+        """
+        Получить значение по ключу с учётом TTL.
+
+        Args:
+            key: Ключ пары точек
+
+        Returns:
+            Значение или None, если записи нет или она устарела
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Dict[str, float], ttl: Optional[float] = None):
+        """
+        Сохранить значение, вытесняя давно не использованные записи.
+
+        Args:
+            key: Ключ пары точек
+            value: Словарь с 'duration' и 'distance'
+            ttl: Время жизни в секундах (по умолчанию - обычный TTL)
+        """
+        self._data[key] = (value, self._expires_at(ttl))
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def set_negative(self, key: Hashable, value: Dict[str, float]):
+        """Сохранить fallback-значение с коротким TTL"""
+        self.set(key, value, ttl=self.negative_ttl)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Проверить наличие актуальной записи без учёта в статистике"""
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class OSRMDiskCache:
+    """
+    Постоянный кэш пар точек в SQLite (режим WAL).
+
+    Стоит за кэшем в памяти и переживает перезапуски контейнера.
+    Ключ - кортеж округлённых координат (lat1, lon1, lat2, lon2).
+    Там же хранятся точки, привязанные к дорогам (ключ - округлённые lat, lon).
+    Чтение и запись выполняются пачками - по одной на построение матрицы.
+    Методы блокирующие, из asyncio их нужно вызывать через asyncio.to_thread.
+
+    Файл базы общий для процессов-воркеров (serve.py): соединение SQLite
+    нельзя использовать после fork, поэтому каждый процесс открывает своё.
+    """
+
+    # Ключей в одном SELECT (4 параметра на ключ, лимит SQLite - 999 параметров)
+    READ_CHUNK = 200
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600):
+        """
+        Инициализация кэша.
+
+        Args:
+            path: Путь к файлу базы SQLite
+            ttl: Время жизни записи в секундах (0 - без ограничения)
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Схема создаётся отдельным соединением, рабочее открывается при первом запросе
+        # (в процессе, который будет с ним работать)
+        self._pid = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pairs (
+                lat1 REAL NOT NULL,
+                lon1 REAL NOT NULL,
+                lat2 REAL NOT NULL,
+                lon2 REAL NOT NULL,
+                duration REAL NOT NULL,
+                distance REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (lat1, lon1, lat2, lon2)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS snapped (
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                snapped_lat REAL NOT NULL,
+                snapped_lon REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (lat, lon)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.commit()
+        conn.close()
+
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть соединение с базой"""
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего процесса (после fork открывается заново)"""
+        if self._pid != os.getpid():
+            self._connection = self._connect()
+            self._pid = os.getpid()
+        return self._connection
+
+    def get_many(
+        self,
+        keys: Iterable[Tuple[float, float, float, float]]
+    ) -> Dict[Tuple[float, float, float, float], Tuple[Dict[str, float], float]]:
+        """
+        Прочитать пачку ключей.
+
+        Args:
+            keys: Ключи пар точек
+
+        Returns:
+            Словарь key -> (значение, оставшийся TTL в секундах) для найденных
+            и не устаревших записей
+        """
+        keys = list(keys)
+        result = {}
+        if not keys:
+            return result
+
+        now = time.time()
+        min_updated = now - self.ttl if self.ttl > 0 else 0.0
+
+        with self._lock:
+            for start in range(0, len(keys), self.READ_CHUNK):
+                chunk = keys[start:start + self.READ_CHUNK]
+                values_sql = ",".join(["(?, ?, ?, ?)"] * len(chunk))
+                params = [v for key in chunk for v in key]
+                rows = self._conn.execute(
+                    f"""
+                    WITH k(lat1, lon1, lat2, lon2) AS (VALUES {values_sql})
+                    SELECT p.lat1, p.lon1, p.lat2, p.lon2, p.duration, p.distance, p.updated_at
+                    FROM pairs p JOIN k USING (lat1, lon1, lat2, lon2)
+                    WHERE p.updated_at >= ?
+                    """,
+                    params + [min_updated]
+                ).fetchall()
+
+                for lat1, lon1, lat2, lon2, duration, distance, updated_at in rows:
+                    remaining = updated_at + self.ttl - now if self.ttl > 0 else 0.0
+                    result[(lat1, lon1, lat2, lon2)] = (
+                        {"duration": duration, "distance": distance},
+                        remaining
+                    )
+
+        self.reads += len(keys)
+        self.hits += len(result)
+        return result
+
+    def set_many(self, items: List[Tuple[Tuple[float, float, float, float], Dict[str, float]]]):
+        """
+        Записать пачку значений одной транзакцией.
+
+        Args:
+            items: Список (key, значение с 'duration' и 'distance')
+        """
+        if not items:
+            return
+
+        now = time.time()
+        rows = [
+            (*key, value["duration"], value["distance"], now)
+            for key, value in items
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+        self.writes += len(rows)
+
+    def get_snapped(self, keys: Iterable[Tuple[float, float]]) -> Dict[Tuple[float, float], Tuple[float, float]]:
+        """
+        Прочитать привязанные к дорогам точки.
+
+        Args:
+            keys: Округлённые координаты точек
+
+        Returns:
+            Словарь key -> привязанная точка (lat, lon) для найденных и не устаревших записей
+        """
+        keys = list(keys)
+        result = {}
+        min_updated = time.time() - self.ttl if self.ttl > 0 else 0.0
+
+        with self._lock:
+            for start in range(0, len(keys), self.READ_CHUNK):
+                chunk = keys[start:start + self.READ_CHUNK]
+                values_sql = ",".join(["(?, ?)"] * len(chunk))
+                rows = self._conn.execute(
+                    f"""
+                    WITH k(lat, lon) AS (VALUES {values_sql})
+                    SELECT s.lat, s.lon, s.snapped_lat, s.snapped_lon
+                    FROM snapped s JOIN k USING (lat, lon)
+                    WHERE s.updated_at >= ?
+                    """,
+                    [v for key in chunk for v in key] + [min_updated]
+                ).fetchall()
+                for lat, lon, snapped_lat, snapped_lon in rows:
+                    result[(lat, lon)] = (snapped_lat, snapped_lon)
+
+        return result
+
+    def set_snapped(self, items: List[Tuple[Tuple[float, float], Tuple[float, float]]]):
+        """
+        Записать привязанные к дорогам точки одной транзакцией.
+
+        Args:
+            items: Список (округлённые координаты точки, привязанная точка)
+        """
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO snapped VALUES (?, ?, ?, ?, ?)",
+                    [(*key, *snapped, now) for key, snapped in items]
+                )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    def close(self):
+        """Закрыть соединение с базой"""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._pid = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику постоянного кэша"""
+        return {
+            "path": self.path,
+            "reads": self.reads,
+            "hits": self.hits,
+            "writes": self.writes
+        }
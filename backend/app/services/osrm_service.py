@@ -1,9 +1,191 @@
 """Сервис для работы с OSRM API"""
 
+import asyncio
 import time
 import httpx
-from typing import Tuple, Dict
+import numpy as np
+from contextlib import asynccontextmanager
+from typing import Tuple, Dict, List, Optional, Any
 import os
+from collections import OrderedDict
+
+from app.services.osrm_cache import OSRMPairCache, OSRMDiskCache
+
+
+class UpstreamUnavailable(Exception):
+    """Запрос не выполнялся: upstream недоступен или ожидание очереди превысило лимит"""
+
+
+class FetchScheduler:
+    """
+    Планировщик запросов к одному upstream.
+
+    Ограничивает число одновременных запросов, выдаёт их с частотой
+    token bucket и адаптивно притормаживает при ответах 429/5xx:
+    все запросы ждут окончания backoff, а частота снижается вдвое и
+    постепенно восстанавливается после успешных ответов.
+
+    Сетевые ошибки (отказ в соединении, таймаут) не замедляют очередь -
+    ждать там нечего. После нескольких таких ошибок подряд планировщик
+    размыкает цепь: запросы сразу завершаются UpstreamUnavailable, и
+    вызывающий код без ожидания переходит к fallback. По истечении паузы
+    пропускается пробный запрос; первый же ответ upstream замыкает цепь.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 4,
+        rate: float = 5.0,
+        burst: float = 5.0,
+        base_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+        circuit_failures: int = 3,
+        circuit_open_seconds: float = 30.0
+    ):
+        """
+        Инициализация планировщика.
+
+        Args:
+            max_in_flight: Максимум одновременных запросов
+            rate: Запросов в секунду (0 - без ограничения)
+            burst: Ёмкость token bucket (допустимая пачка запросов)
+            base_backoff: Начальная пауза после 429/5xx в секундах
+            max_backoff: Максимальная пауза после 429/5xx в секундах
+            circuit_failures: Сетевых ошибок подряд до размыкания цепи (0 - не размыкать)
+            circuit_open_seconds: Сколько секунд цепь остаётся разомкнутой
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.rate = max(0.0, rate)
+        self.burst = max(1.0, burst)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.circuit_failures = max(0, circuit_failures)
+        self.circuit_open_seconds = circuit_open_seconds
+
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._lock = asyncio.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._current_rate = self.rate
+        self._backoff = 0.0
+        self._blocked_until = 0.0
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.network_errors = 0
+        self.rejected = 0
+
+    @property
+    def circuit_open(self) -> bool:
+        """Цепь разомкнута: upstream считается недоступным"""
+        return time.monotonic() < self._open_until
+
+    @asynccontextmanager
+    async def slot(self, deadline: Optional[float] = None):
+        """
+        Дождаться разрешения на запрос и удерживать слот на время его выполнения.
+
+        Args:
+            deadline: Момент time.monotonic(), позже которого запрос не начинать
+
+        Raises:
+            UpstreamUnavailable: Цепь разомкнута или разрешения не дождаться до deadline
+        """
+        self._check_circuit()
+        async with self._semaphore:
+            await self._wait_turn(deadline)
+            self.in_flight += 1
+            self.requests += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def _check_circuit(self):
+        """Отказать сразу, если цепь разомкнута"""
+        if self.circuit_open:
+            self.rejected += 1
+            raise UpstreamUnavailable("upstream недоступен (цепь разомкнута)")
+
+    async def _wait_turn(self, deadline: Optional[float] = None):
+        """Дождаться окончания backoff и свободного токена (спит без блокировки)"""
+        while True:
+            async with self._lock:
+                self._check_circuit()
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    delay = self._blocked_until - now
+                elif self._current_rate <= 0:
+                    return
+                else:
+                    self._tokens = min(
+                        self.burst,
+                        self._tokens + (now - self._updated) * self._current_rate
+                    )
+                    self._updated = now
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        return
+                    delay = (1.0 - self._tokens) / self._current_rate
+
+            if deadline is not None and now + delay > deadline:
+                self.rejected += 1
+                raise UpstreamUnavailable(f"ожидание очереди upstream больше лимита ({delay:.1f} с)")
+            await asyncio.sleep(delay)
+
+    def report(self, status_code: Optional[int], retry_after: Optional[float] = None):
+        """
+        Учесть результат запроса для адаптации частоты.
+
+        Args:
+            status_code: HTTP статус ответа (None - сетевая ошибка)
+            retry_after: Значение заголовка Retry-After в секундах
+        """
+        if status_code is None:
+            # Сетевая ошибка: без backoff, при серии ошибок размыкаем цепь
+            self.network_errors += 1
+            self._consecutive_failures += 1
+            if self.circuit_failures and self._consecutive_failures >= self.circuit_failures:
+                if not self.circuit_open:
+                    print(f"⚠ OSRM недоступен: запросы переходят на fallback на {self.circuit_open_seconds:.0f} с")
+                self._open_until = time.monotonic() + self.circuit_open_seconds
+            return
+
+        # Upstream ответил - цепь замыкается
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+        if status_code == 429 or status_code >= 500:
+            self.throttled += 1
+            self._backoff = min(self.max_backoff, max(self.base_backoff, self._backoff * 2))
+            pause = max(self._backoff, retry_after or 0.0)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            if self.rate > 0:
+                self._current_rate = max(self.rate / 16, self._current_rate / 2)
+            return
+
+        # Успешный ответ: постепенно снимаем ограничения
+        self._backoff = self._backoff / 2 if self._backoff > self.base_backoff else 0.0
+        if self.rate > 0:
+            self._current_rate = min(self.rate, self._current_rate + self.rate / 10)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику планировщика"""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "rate_limit": self.rate,
+            "current_rate": round(self._current_rate, 3),
+            "backoff": round(self._backoff, 3),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "network_errors": self.network_errors,
+            "rejected": self.rejected,
+            "circuit_open": self.circuit_open
+        }
 
 
 class OSRMService:
@@ -20,7 +202,133 @@ class OSRMService:
             "OSRM_BASE_URL",
             "http://router.project-osrm.org"
         )
-        self._cache: Dict[Tuple[float, float, float, float], Dict[str, float]] = {}
+        # Ограниченный кэш пар: LRU + TTL, короткий TTL для fallback-значений
+        self._cache = OSRMPairCache(
+            max_memory_mb=float(os.getenv("OSRM_CACHE_MAX_MB", "64")),
+            ttl=float(os.getenv("OSRM_CACHE_TTL", str(7 * 24 * 3600))),
+            negative_ttl=float(os.getenv("OSRM_CACHE_NEGATIVE_TTL", "300"))
+        )
+
+        # Постоянный кэш на диске (включается, если задан OSRM_CACHE_DB_PATH)
+        cache_db_path = os.getenv("OSRM_CACHE_DB_PATH")
+        self._disk_cache: Optional[OSRMDiskCache] = None
+        if cache_db_path:
+            try:
+                self._disk_cache = OSRMDiskCache(
+                    cache_db_path,
+                    ttl=float(os.getenv("OSRM_CACHE_DB_TTL", str(30 * 24 * 3600)))
+                )
+            except Exception as e:
+                print(f"⚠ Не удалось открыть постоянный кэш OSRM {cache_db_path}: {e}")
+
+        # Полученные от OSRM пары, ещё не записанные в постоянный кэш
+        self._pending_disk_writes: List[Tuple[Tuple[float, float, float, float], Dict[str, float]]] = []
+
+        # Точки, привязанные к дорогам через /nearest: округлённые координаты -> привязанная точка
+        self._snapped: "OrderedDict[Tuple[float, float], Tuple[float, float]]" = OrderedDict()
+        self.snap_cache_size = int(os.getenv("OSRM_SNAP_CACHE_SIZE", "100000"))
+
+        # Максимум координат в одном запросе /table (у публичного OSRM лимит 100)
+        self.table_max_coords = max(2, int(os.getenv("OSRM_TABLE_MAX_COORDS", "100")))
+
+        # Общий HTTP клиент с пулом соединений (создаётся в start() или при первом запросе)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.max_connections = int(os.getenv("OSRM_MAX_CONNECTIONS", "20"))
+        self.max_keepalive_connections = int(os.getenv("OSRM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+        self.keepalive_expiry = float(os.getenv("OSRM_KEEPALIVE_EXPIRY", "30"))
+        self.http2 = os.getenv("OSRM_HTTP2", "True").lower() in ("1", "true", "yes")
+
+        # Планировщик запросов: параллелизм, token bucket и backoff при 429/5xx
+        self._scheduler = FetchScheduler(
+            max_in_flight=int(os.getenv("OSRM_MAX_IN_FLIGHT", "4")),
+            rate=float(os.getenv("OSRM_RATE_LIMIT", "5")),
+            burst=float(os.getenv("OSRM_RATE_BURST", "5")),
+            circuit_failures=int(os.getenv("OSRM_CIRCUIT_FAILURES", "3")),
+            circuit_open_seconds=float(os.getenv("OSRM_CIRCUIT_OPEN_SECONDS", "30"))
+        )
+        # Сколько секунд один вызов может ждать очереди планировщика до fallback
+        self.max_wait = float(os.getenv("OSRM_MAX_WAIT", "10"))
+
+    async def start(self):
+        """Открыть общий HTTP клиент OSRM (вызывается при старте приложения)"""
+        if self._client is not None and not self._client.is_closed:
+            return
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("⚠ Пакет h2 не установлен. OSRM клиент работает по HTTP/1.1.")
+                http2 = False
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=5.0
+        )
+
+    async def close(self):
+        """Закрыть общий HTTP клиент OSRM (вызывается при завершении приложения)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+        await self._flush_disk_cache()
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Получить общий HTTP клиент, открыв его при необходимости"""
+        if self._client is None or self._client.is_closed:
+            await self.start()
+        return self._client
+
+    def _deadline(self) -> Optional[float]:
+        """Крайний срок ожидания очереди для одного вызова (все его попытки)"""
+        return time.monotonic() + self.max_wait if self.max_wait > 0 else None
+
+    async def _fetch(
+        self,
+        url: str,
+        timeout: Optional[float] = None,
+        deadline: Optional[float] = None
+    ) -> httpx.Response:
+        """
+        Выполнить GET запрос к OSRM через планировщик.
+
+        Args:
+            url: Полный URL запроса
+            timeout: Таймаут запроса (по умолчанию - таймаут клиента)
+            deadline: Момент time.monotonic(), позже которого запрос не начинать
+
+        Returns:
+            Ответ OSRM
+
+        Raises:
+            UpstreamUnavailable: OSRM недоступен или очередь не дождаться до deadline
+        """
+        client = await self._get_client()
+        async with self._scheduler.slot(deadline):
+            try:
+                if timeout is None:
+                    response = await client.get(url)
+                else:
+                    response = await client.get(url, timeout=timeout)
+            except Exception:
+                self._scheduler.report(None)
+                raise
+
+        retry_after = None
+        if "Retry-After" in response.headers:
+            try:
+                retry_after = float(response.headers["Retry-After"])
+            except ValueError:
+                pass
+        self._scheduler.report(response.status_code, retry_after)
+        return response
 
     async def get_duration(
         self,
@@ -92,53 +400,46 @@ class OSRMService:
             Словарь с ключами 'duration' (минуты) и 'distance' (км)
         """
         # Округляем координаты для кэширования
-        key = (
-            round(lat1, 5),
-            round(lon1, 5),
-            round(lat2, 5),
-            round(lon2, 5)
-        )
+        key = self._cache_key(lat1, lon1, lat2, lon2)
 
-        # Проверяем кэш (теперь кэш хранит словарь)
-        if key in self._cache:
-            return self._cache[key]
+        # Проверяем кэш (кэш хранит словарь)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
 
         # Формируем URL для OSRM
         url = f"{self.base_url}/route/v1/driving/{lon1},{lat1};{lon2},{lat2}?overview=false"
 
-        # Пытаемся получить данные
+        # Пытаемся получить данные (ожидание очереди ограничено на все попытки сразу)
+        deadline = self._deadline()
         for attempt in range(retries):
             try:
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    response = await client.get(url)
-
-                    if response.status_code == 200:
-                        data = response.json()
+                response = await self._fetch(url, deadline=deadline)
 
-                        if "routes" in data and len(data["routes"]) > 0:
-                            route = data["routes"][0]
+                if response.status_code == 200:
+                    data = response.json()
 
-                            # OSRM возвращает время в секундах, расстояние в метрах
-                            duration_minutes = route["duration"] / 60.0
-                            distance_km = route["distance"] / 1000.0
+                    if "routes" in data and len(data["routes"]) > 0:
+                        route = data["routes"][0]
 
-                            result = {
-                                "duration": duration_minutes,
-                                "distance": distance_km
-                            }
+                        # OSRM возвращает время в секундах, расстояние в метрах
+                        duration_minutes = route["duration"] / 60.0
+                        distance_km = route["distance"] / 1000.0
 
-                            # Кэшируем результат
-                            self._cache[key] = result
+                        result = {
+                            "duration": duration_minutes,
+                            "distance": distance_km
+                        }
 
-                            # Задержка для предотвращения rate limiting на публичном OSRM
-                            await self._sleep(0.2)
+                        # Кэшируем результат
+                        self._store(key, result)
 
-                            return result
+                        return result
 
+            except UpstreamUnavailable:
+                break
             except Exception as e:
                 print(f"⚠ Ошибка OSRM (попытка {attempt + 1}/{retries}): {e}")
-                if attempt < retries - 1:
-                    await self._sleep(1)
 
         # Если все попытки неудачны - используем fallback
         print(f"⚠ Не удалось получить данные OSRM между ({lat1},{lon1}) и ({lat2},{lon2}). Использую fallback.")
@@ -146,34 +447,457 @@ class OSRMService:
             "duration": 10.0,  # 10 минут
             "distance": 5.0    # 5 км
         }
-        self._cache[key] = fallback_result
+        # Fallback кэшируется ненадолго, чтобы после восстановления OSRM получить реальные данные
+        self._cache.set_negative(key, fallback_result)
         return fallback_result
 
-    async def build_time_matrix(self, coords: list) -> list:
+    @staticmethod
+    def _cache_key(
+        lat1: float,
+        lon1: float,
+        lat2: float,
+        lon2: float
+    ) -> Tuple[float, float, float, float]:
+        """Ключ кэша: координаты пары, округлённые до 5 знаков"""
+        return (
+            round(lat1, 5),
+            round(lon1, 5),
+            round(lat2, 5),
+            round(lon2, 5)
+        )
+
+    async def _get_table_data(
+        self,
+        coords: List[Tuple[float, float]],
+        sources: List[int],
+        destinations: List[int],
+        retries: int = 3
+    ) -> Optional[Tuple[list, list]]:
         """
-        Построить матрицу времени между всеми точками.
+        Получить матрицы времени и расстояний одним запросом OSRM /table.
+
+        Args:
+            coords: Координаты, участвующие в запросе [(lat, lon), ...]
+            sources: Индексы точек-источников в coords
+            destinations: Индексы точек-назначений в coords
+            retries: Количество попыток при ошибке
+
+        Returns:
+            Кортеж (durations, distances) в секундах и метрах размером
+            len(sources) x len(destinations) или None, если запрос не удался
+        """
+        coords_str = ";".join(f"{lon},{lat}" for lat, lon in coords)
+        url = (
+            f"{self.base_url}/table/v1/driving/{coords_str}"
+            f"?sources={';'.join(map(str, sources))}"
+            f"&destinations={';'.join(map(str, destinations))}"
+            f"&annotations=duration,distance"
+        )
+
+        deadline = self._deadline()
+        for attempt in range(retries):
+            try:
+                response = await self._fetch(url, timeout=15.0, deadline=deadline)
+
+                if response.status_code == 200:
+                    data = response.json()
+
+                    if data.get("code") == "Ok" and "durations" in data and "distances" in data:
+                        return data["durations"], data["distances"]
+
+            except UpstreamUnavailable:
+                break
+            except Exception as e:
+                print(f"⚠ Ошибка OSRM /table (попытка {attempt + 1}/{retries}): {e}")
+
+        return None
+
+    async def fill_cache_from_table(self, coords: list) -> None:
+        """
+        Заполнить кэш пар для всех точек через OSRM /table.
+
+        Точки разбиваются на блоки так, чтобы в одном запросе было не больше
+        table_max_coords координат. Блоки, все пары которых уже есть в кэше,
+        не запрашиваются. Пары, для которых OSRM не вернул значения, остаются
+        незаполненными и будут получены через /route.
 
         Args:
             coords: Список координат [(lat, lon), (lat, lon), ...]
+        """
+        n = len(coords)
+        if n < 2:
+            return
+
+        await self._load_from_disk_cache(coords)
+
+        # Если все точки помещаются в один запрос - один блок, иначе блоки по половине лимита
+        block_size = n if n <= self.table_max_coords else self.table_max_coords // 2
+        blocks = [list(range(start, min(start + block_size, n))) for start in range(0, n, block_size)]
+
+        for src_block in blocks:
+            for dst_block in blocks:
+                missing = any(
+                    i != j and self._cache_key(*coords[i], *coords[j]) not in self._cache
+                    for i in src_block
+                    for j in dst_block
+                )
+                if not missing:
+                    continue
+
+                # Объединяем блоки в один список координат запроса
+                indices = src_block if src_block is dst_block else src_block + dst_block
+                sources = list(range(len(src_block)))
+                destinations = (
+                    sources if src_block is dst_block
+                    else list(range(len(src_block), len(indices)))
+                )
+
+                table = await self._get_table_data(
+                    [coords[k] for k in indices],
+                    sources,
+                    destinations
+                )
+                if table is None:
+                    print(f"⚠ OSRM /table недоступен для блока {len(src_block)}x{len(dst_block)}. Использую /route.")
+                    continue
+
+                durations, distances = table
+                for si, i in enumerate(src_block):
+                    for di, j in enumerate(dst_block):
+                        if i == j:
+                            continue
+                        duration = durations[si][di]
+                        distance = distances[si][di]
+                        if duration is None or distance is None:
+                            continue
+
+                        # OSRM возвращает время в секундах, расстояние в метрах
+                        key = self._cache_key(*coords[i], *coords[j])
+                        result = {
+                            "duration": duration / 60.0,
+                            "distance": distance / 1000.0
+                        }
+                        self._store(key, result)
+
+    async def prefetch_matrices(self, coord_groups: List[list]) -> int:
+        """
+        Заполнить кэш пар сразу для нескольких маршрутов.
+
+        Точки всех маршрутов дедуплицируются по ключу кэша. Маршруты, у которых
+        есть незаполненные пары, раскладываются по пакетам не больше
+        table_max_coords уникальных точек - в первую очередь в пакет, с которым
+        у маршрута больше общих точек (общие склады и клиенты). Каждый пакет
+        заполняется через /table один раз, пакеты запрашиваются параллельно.
+
+        Args:
+            coord_groups: Списки координат маршрутов [[(lat, lon), ...], ...]
 
         Returns:
-            Матрица времени n x n, где matrix[i][j] = время от i до j
+            Количество пакетов, отправленных в OSRM
+        """
+        bins: List[Dict[Tuple[float, float], Tuple[float, float]]] = []
+
+        for group in sorted(coord_groups, key=len, reverse=True):
+            points: Dict[Tuple[float, float], Tuple[float, float]] = {}
+            for lat, lon in group:
+                points.setdefault((round(lat, 5), round(lon, 5)), (lat, lon))
+
+            cached = all(
+                a == b or self._cache_key(*a, *b) in self._cache
+                for a in points
+                for b in points
+            )
+            if cached:
+                continue
+
+            best, best_overlap = None, -1
+            for bin_points in bins:
+                union = len(bin_points.keys() | points.keys())
+                if union > self.table_max_coords:
+                    continue
+                overlap = len(bin_points) + len(points) - union
+                if overlap > best_overlap:
+                    best, best_overlap = bin_points, overlap
+
+            if best is None:
+                best = {}
+                bins.append(best)
+            best.update(points)
+
+        await asyncio.gather(*(
+            self.fill_cache_from_table(list(bin_points.values()))
+            for bin_points in bins
+        ))
+        await self._flush_disk_cache()
+
+        return len(bins)
+
+    async def build_matrices(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Построить матрицы времени и расстояний за один проход по парам.
+
+        Сначала кэш заполняется через OSRM /table, затем значения читаются
+        из кэша, а недостающие пары запрашиваются через /route параллельно.
+
+        Args:
+            coords: Список координат [(lat, lon), (lat, lon), ...]
+
+        Returns:
+            Кортеж (time_matrix, distance_matrix) - массивы float64 n x n,
+            где [i, j] = время в минутах / расстояние в км от i до j
         """
+        await self.fill_cache_from_table(coords)
+
         n = len(coords)
-        matrix = [[0.0 for _ in range(n)] for _ in range(n)]
+        time_matrix = np.zeros((n, n), dtype=np.float64)
+        distance_matrix = np.zeros((n, n), dtype=np.float64)
 
+        missing: List[Tuple[int, int]] = []
         for i in range(n):
             for j in range(n):
-                if i != j:
-                    duration = await self.get_duration(
-                        coords[i][0],
-                        coords[i][1],
-                        coords[j][0],
-                        coords[j][1]
-                    )
-                    matrix[i][j] = duration
+                if i == j:
+                    continue
+                route_data = self._cache.get(self._cache_key(*coords[i], *coords[j]))
+                if route_data is None:
+                    missing.append((i, j))
+                    continue
+                time_matrix[i, j] = route_data["duration"]
+                distance_matrix[i, j] = route_data["distance"]
+
+        # Пары, которых нет в кэше, запрашиваем одновременно
+        if missing:
+            results = await asyncio.gather(*(
+                self._get_route_data(*coords[i], *coords[j])
+                for i, j in missing
+            ))
+            for (i, j), route_data in zip(missing, results):
+                time_matrix[i, j] = route_data["duration"]
+                distance_matrix[i, j] = route_data["distance"]
+
+        await self._flush_disk_cache()
+
+        return time_matrix, distance_matrix
+
+    async def build_row(self, coords: list, source: int, targets: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Время и расстояние от одной точки до нескольких.
+
+        Пары, которых нет в кэше, запрашиваются одним запросом OSRM /table
+        (при большом числе целей - блоками по table_max_coords), пары без
+        значения в ответе - через /route.
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+            source: Индекс точки отправления
+            targets: Индексы точек назначения
+
+        Returns:
+            Кортеж (время в минутах, расстояние в км) - массивы по targets
+        """
+        keys = [self._cache_key(*coords[source], *coords[j]) for j in targets]
+        await self._load_keys_from_disk_cache(keys)
+
+        # Цели с одинаковыми координатами (один узел) запрашиваются один раз
+        missing = list({
+            key: j
+            for j, key in reversed(list(zip(targets, keys)))
+            if j != source and key not in self._cache
+        }.values())
+        block_size = self.table_max_coords - 1
+        for start in range(0, len(missing), block_size):
+            block = missing[start:start + block_size]
+            table = await self._get_table_data(
+                [coords[source]] + [coords[j] for j in block],
+                [0],
+                list(range(1, len(block) + 1))
+            )
+            if table is None:
+                print(f"⚠ OSRM /table недоступен для строки 1x{len(block)}. Использую /route.")
+                continue
+
+            durations, distances = table
+            for k, j in enumerate(block):
+                duration = durations[0][k]
+                distance = distances[0][k]
+                if duration is None or distance is None:
+                    continue
+                self._store(
+                    self._cache_key(*coords[source], *coords[j]),
+                    {"duration": duration / 60.0, "distance": distance / 1000.0}
+                )
+
+        times = np.zeros(len(targets), dtype=np.float64)
+        distances = np.zeros(len(targets), dtype=np.float64)
+        results = await asyncio.gather(*(
+            self._get_route_data(*coords[source], *coords[j])
+            for j in targets
+            if j != source
+        ))
+        results = iter(results)
+        for k, j in enumerate(targets):
+            if j == source:
+                continue
+            route_data = next(results)
+            times[k] = route_data["duration"]
+            distances[k] = route_data["distance"]
+
+        await self._flush_disk_cache()
+
+        return times, distances
+
+    async def snap_points(self, coords: list) -> List[Tuple[float, float]]:
+        """
+        Привязать точки к ближайшим дорогам через OSRM /nearest.
+
+        Каждая точка привязывается один раз: результат хранится в памяти
+        и в постоянном кэше. Если OSRM не ответил, точка остаётся как есть
+        и в кэш не попадает.
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+
+        Returns:
+            Привязанные координаты в том же порядке
+        """
+        keys = [(round(lat, 5), round(lon, 5)) for lat, lon in coords]
+        found = {key: self._snapped[key] for key in set(keys) if key in self._snapped}
+        missing = set(keys) - found.keys()
+
+        if missing and self._disk_cache is not None:
+            try:
+                stored = await asyncio.to_thread(self._disk_cache.get_snapped, missing)
+            except Exception as e:
+                print(f"⚠ Ошибка чтения постоянного кэша OSRM: {e}")
+                stored = {}
+            found.update(stored)
+            missing -= stored.keys()
+            self._remember_snapped(stored.items())
+
+        if missing:
+            missing = list(missing)
+            results = await asyncio.gather(*(self._get_nearest(*key) for key in missing))
+            fetched = [(key, snapped) for key, snapped in zip(missing, results) if snapped is not None]
+            found.update(fetched)
+            self._remember_snapped(fetched)
+
+            if fetched and self._disk_cache is not None:
+                try:
+                    await asyncio.to_thread(self._disk_cache.set_snapped, fetched)
+                except Exception as e:
+                    print(f"⚠ Ошибка записи постоянного кэша OSRM: {e}")
+
+        return [found.get(key, coord) for key, coord in zip(keys, coords)]
+
+    def _remember_snapped(self, items):
+        """Сохранить привязанные точки в памяти, вытесняя давно использованные"""
+        for key, snapped in items:
+            self._snapped[key] = snapped
+            self._snapped.move_to_end(key)
+        while len(self._snapped) > self.snap_cache_size:
+            self._snapped.popitem(last=False)
+
+    async def _get_nearest(self, lat: float, lon: float, retries: int = 3) -> Optional[Tuple[float, float]]:
+        """
+        Ближайшая к точке точка дорожной сети (OSRM /nearest).
+
+        Args:
+            lat: Широта точки
+            lon: Долгота точки
+            retries: Количество попыток при ошибке
+
+        Returns:
+            Координаты (lat, lon) или None, если запрос не удался
+        """
+        url = f"{self.base_url}/nearest/v1/driving/{lon},{lat}?number=1"
 
-        return matrix
+        deadline = self._deadline()
+        for attempt in range(retries):
+            try:
+                response = await self._fetch(url, deadline=deadline)
+
+                if response.status_code == 200:
+                    data = response.json()
+
+                    if data.get("code") == "Ok" and data.get("waypoints"):
+                        snapped_lon, snapped_lat = data["waypoints"][0]["location"]
+                        return snapped_lat, snapped_lon
+
+            except UpstreamUnavailable:
+                break
+            except Exception as e:
+                print(f"⚠ Ошибка OSRM /nearest (попытка {attempt + 1}/{retries}): {e}")
+
+        return None
+
+    def _store(self, key: Tuple[float, float, float, float], result: Dict[str, float]):
+        """Сохранить полученный от OSRM результат в память и в очередь на запись на диск"""
+        self._cache.set(key, result)
+        if self._disk_cache is not None:
+            self._pending_disk_writes.append((key, result))
+
+    async def _load_from_disk_cache(self, coords: list) -> None:
+        """
+        Подгрузить в память пары из постоянного кэша одним пакетным чтением.
+
+        Args:
+            coords: Список координат [(lat, lon), (lat, lon), ...]
+        """
+        if self._disk_cache is None:
+            return
+
+        await self._load_keys_from_disk_cache({
+            self._cache_key(*coords[i], *coords[j])
+            for i in range(len(coords))
+            for j in range(len(coords))
+            if i != j
+        })
+
+    async def _load_keys_from_disk_cache(self, keys) -> None:
+        """
+        Подгрузить в память заданные пары из постоянного кэша.
+
+        Args:
+            keys: Ключи пар (см. _cache_key)
+        """
+        if self._disk_cache is None:
+            return
+
+        keys = [key for key in keys if key not in self._cache]
+        if not keys:
+            return
+
+        try:
+            found = await asyncio.to_thread(self._disk_cache.get_many, keys)
+        except Exception as e:
+            print(f"⚠ Ошибка чтения постоянного кэша OSRM: {e}")
+            return
+
+        for key, (value, remaining_ttl) in found.items():
+            self._cache.set(key, value, ttl=remaining_ttl if remaining_ttl > 0 else None)
+
+    async def _flush_disk_cache(self) -> None:
+        """Записать накопленные результаты OSRM в постоянный кэш одной транзакцией"""
+        if self._disk_cache is None or not self._pending_disk_writes:
+            return
+
+        items, self._pending_disk_writes = self._pending_disk_writes, []
+        try:
+            await asyncio.to_thread(self._disk_cache.set_many, items)
+        except Exception as e:
+            print(f"⚠ Ошибка записи постоянного кэша OSRM: {e}")
+
+    async def build_time_matrix(self, coords: list) -> list:
+        """
+        Построить матрицу времени между всеми точками.
+
+        Args:
+            coords: Список координат [(lat, lon), (lat, lon), ...]
+
+        Returns:
+            Матрица времени n x n, где matrix[i][j] = время от i до j
+        """
+        time_matrix, _ = await self.build_matrices(coords)
+        return time_matrix.tolist()
 
     async def build_distance_matrix(self, coords: list) -> list:
         """
@@ -185,31 +909,25 @@ class OSRMService:
         Returns:
             Матрица расстояний n x n, где matrix[i][j] = расстояние от i до j в км
         """
-        n = len(coords)
-        matrix = [[0.0 for _ in range(n)] for _ in range(n)]
-
-        for i in range(n):
-            for j in range(n):
-                if i != j:
-                    distance = await self.get_distance(
-                        coords[i][0],
-                        coords[i][1],
-                        coords[j][0],
-                        coords[j][1]
-                    )
-                    matrix[i][j] = distance
-
-        return matrix
+        _, distance_matrix = await self.build_matrices(coords)
+        return distance_matrix.tolist()
 
     def clear_cache(self):
         """Очистить кэш OSRM запросов"""
         self._cache.clear()
+        self._snapped.clear()
 
     def get_cache_size(self) -> int:
         """Получить размер кэша"""
         return len(self._cache)
 
-    async def _sleep(self, seconds: float):
-        """Асинхронная задержка"""
-        import asyncio
-        await asyncio.sleep(seconds)
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша (попадания, промахи, вытеснения)"""
+        stats = self._cache.get_stats()
+        stats["disk"] = self._disk_cache.get_stats() if self._disk_cache else None
+        stats["snapped_points"] = len(self._snapped)
+        return stats
+
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        """Получить статистику планировщика запросов к OSRM"""
+        return self._scheduler.get_stats()
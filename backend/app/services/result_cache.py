@@ -0,0 +1,169 @@
+"""Кэш результатов оптимизации маршрутов"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.schemas.route import RouteAnalysisResponse
+from app.services.client_records import ClientRecord
+
+
+def _record_key(record: ClientRecord) -> list:
+    """Каноническое представление клиента (всё, что влияет на маршрут и ответ)"""
+    return [
+        record.address,
+        round(record.latitude, 6),
+        round(record.longitude, 6),
+        record.level.lower(),
+        record.work_start,
+        record.work_end,
+        record.lunch_start,
+        record.lunch_end
+    ]
+
+
+def route_cache_key(
+    clients: List[ClientRecord],
+    start_point: Optional[ClientRecord],
+    start_time: str,
+    start_day: str,
+    options: Dict[str, Any]
+) -> str:
+    """
+    Канонический ключ запроса на оптимизацию.
+
+    Клиенты сортируются, поэтому их порядок в запросе не важен - кроме
+    первого клиента при отсутствии стартовой точки: с него начинается
+    маршрут, поэтому он входит в ключ как старт. ID клиентов в ключ не
+    входят - в ответе их нет.
+
+    Args:
+        clients: Записи клиентов
+        start_point: Запись стартовой точки или None
+        start_time: Время начала маршрута (HH:MM)
+        start_day: День недели (уже определённый, в нижнем регистре)
+        options: Прочие параметры, от которых зависит результат
+            (версии модели и трафика, бюджет локального поиска и т.д.)
+
+    Returns:
+        SHA-256 канонического представления запроса
+    """
+    # Без стартовой точки маршрут начинается с первого клиента
+    if start_point is None and clients:
+        start_point, clients = clients[0], clients[1:]
+        start = ["client", _record_key(start_point)]
+    else:
+        start = _record_key(start_point) if start_point else None
+
+    payload = {
+        "clients": sorted(_record_key(c) for c in clients),
+        "start_point": start,
+        "start_time": start_time,
+        "start_day": start_day,
+        "options": options
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def response_etag(response: RouteAnalysisResponse) -> str:
+    """ETag ответа: хэш его содержимого"""
+    digest = hashlib.sha256(response.model_dump_json().encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+class RouteResultCache:
+    """
+    Кэш готовых маршрутов с вытеснением LRU и временем жизни записей.
+
+    Значение - ответ оптимизатора и его ETag. Ответы не изменяются после
+    построения, поэтому один объект отдаётся всем повторным запросам.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 300.0):
+        """
+        Инициализация кэша.
+
+        Args:
+            max_entries: Максимальное количество маршрутов (0 - кэш выключен)
+            ttl: Время жизни записи в секундах (0 - без ограничения)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # key -> (response, etag, expires_at), порядок - от давно использованных к недавним
+        self._data: "OrderedDict[str, Tuple[RouteAnalysisResponse, str, float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Tuple[RouteAnalysisResponse, str]]:
+        """
+        Получить маршрут по ключу с учётом TTL.
+
+        Args:
+            key: Канонический ключ запроса
+
+        Returns:
+            Кортеж (ответ, ETag) или None, если записи нет или она устарела
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        response, etag, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return response, etag
+
+    def set(self, key: str, response: RouteAnalysisResponse, etag: str):
+        """
+        Сохранить маршрут, вытесняя давно не использованные записи.
+
+        Args:
+            key: Канонический ключ запроса
+            response: Ответ оптимизатора
+            etag: ETag ответа
+        """
+        if self.max_entries <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else float("inf")
+        self._data[key] = (response, etag, expires_at)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -0,0 +1,330 @@
+"""Локальный граф дорог для расчёта матриц без OSRM"""
+
+import csv
+import sys
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from app.services.clustering import KM_PER_DEGREE
+from app.services.spatial_index import SpatialIndex
+
+
+# Сколько меток (источник, узел) держит одна пачка поиска: время, длина и флаг очереди -
+# около 17 байт на метку, так что 2 млн - порядка 34 МБ независимо от размера графа
+SEARCH_BATCH_LABELS = 2_000_000
+
+
+class RoadGraph:
+    """
+    Ориентированный граф дорог в формате CSR.
+
+    Рёбра узла u - indices[indptr[u]:indptr[u + 1]], для каждого ребра
+    хранится время (минуты) и длина (км). Граф готовится заранее из
+    выгрузки OSM (см. main ниже) и загружается из .npz целиком.
+    Кратчайшие пути по времени ищутся сразу от пачки источников над
+    массивами NumPy (delta-stepping) с остановкой, как только найдены
+    все нужные узлы; точки привязываются к узлам через SpatialIndex.
+    """
+
+    def __init__(
+        self,
+        node_lat: np.ndarray,
+        node_lon: np.ndarray,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        duration: np.ndarray,
+        distance: np.ndarray
+    ):
+        """
+        Инициализация графа.
+
+        Args:
+            node_lat: Широта узлов
+            node_lon: Долгота узлов
+            indptr: Смещения рёбер узлов (длина - число узлов + 1)
+            indices: Конечные узлы рёбер
+            duration: Время проезда рёбер (минуты)
+            distance: Длина рёбер (км)
+        """
+        self.node_lat = np.asarray(node_lat, dtype=np.float64)
+        self.node_lon = np.asarray(node_lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.duration = np.asarray(duration, dtype=np.float64)
+        self.distance = np.asarray(distance, dtype=np.float64)
+
+        # Проекция узлов для поиска ближайшего (как в clustering.project, по средней широте)
+        self._cos_lat = float(np.cos(np.radians(self.node_lat.mean()))) if len(self.node_lat) else 1.0
+        self._index = SpatialIndex(np.column_stack((self.node_lat, self.node_lon)))
+
+        # Ширина корзины поиска - несколько средних рёбер: меньше корзин - меньше шагов,
+        # шире корзина - больше повторных релаксаций
+        self.bucket_minutes = float(self.duration.mean()) * 4 if len(self.duration) else 1.0
+
+    @property
+    def node_count(self) -> int:
+        return len(self.node_lat)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(
+        cls,
+        node_lat: Sequence[float],
+        node_lon: Sequence[float],
+        edges: Iterable[Tuple[int, int, float, float]]
+    ) -> "RoadGraph":
+        """
+        Построить граф из списка рёбер.
+
+        Args:
+            node_lat: Широта узлов
+            node_lon: Долгота узлов
+            edges: Рёбра (u, v, время в минутах, длина в км)
+
+        Returns:
+            Граф
+        """
+        edge_array = np.asarray(list(edges), dtype=np.float64).reshape(-1, 4)
+        sources = edge_array[:, 0].astype(np.int64)
+        order = np.argsort(sources, kind="stable")
+        counts = np.bincount(sources, minlength=len(node_lat))
+        indptr = np.concatenate(([0], np.cumsum(counts)))
+
+        return cls(
+            node_lat,
+            node_lon,
+            indptr,
+            edge_array[order, 1].astype(np.int64),
+            edge_array[order, 2],
+            edge_array[order, 3]
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RoadGraph":
+        """
+        Загрузить граф из .npz.
+
+        Args:
+            path: Путь к файлу графа
+
+        Returns:
+            Граф
+        """
+        with np.load(path) as data:
+            return cls(
+                data["node_lat"],
+                data["node_lon"],
+                data["indptr"],
+                data["indices"],
+                data["duration"],
+                data["distance"]
+            )
+
+    def save(self, path: str):
+        """
+        Сохранить граф в .npz.
+
+        Args:
+            path: Путь к файлу графа
+        """
+        np.savez(
+            path,
+            node_lat=self.node_lat,
+            node_lon=self.node_lon,
+            indptr=self.indptr,
+            indices=self.indices,
+            duration=self.duration.astype(np.float32),
+            distance=self.distance.astype(np.float32)
+        )
+
+    def nearest_nodes(self, coords: Sequence[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Привязать точки к ближайшим узлам графа.
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+
+        Returns:
+            Кортеж (индексы узлов, расстояние до узла по прямой в км)
+        """
+        points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        nodes = np.empty(len(points), dtype=np.int64)
+        for k, coord in enumerate(points):
+            nodes[k] = self._index.nearest(tuple(coord), 1)[0]
+
+        offsets = np.sqrt(
+            (points[:, 0] - self.node_lat[nodes]) ** 2
+            + ((points[:, 1] - self.node_lon[nodes]) * self._cos_lat) ** 2
+        ) * KM_PER_DEGREE
+        return nodes, offsets
+
+    def shortest_paths(self, sources: Sequence[int], targets: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Кратчайшие по времени пути от набора узлов до набора узлов.
+
+        Источники обрабатываются пачками по SEARCH_BATCH_LABELS меток.
+
+        Args:
+            sources: Начальные узлы
+            targets: Целевые узлы
+
+        Returns:
+            Кортеж (время в минутах, длина в км) - массивы источники x цели,
+            недостижимые пары - inf
+        """
+        sources = np.asarray(sources, dtype=np.int64).reshape(-1)
+        targets = np.asarray(targets, dtype=np.int64).reshape(-1)
+        times = np.full((len(sources), len(targets)), np.inf)
+        lengths = np.full((len(sources), len(targets)), np.inf)
+        if not len(sources) or not len(targets):
+            return times, lengths
+
+        batch = max(1, SEARCH_BATCH_LABELS // max(self.node_count, 1))
+        for start in range(0, len(sources), batch):
+            part = slice(start, start + batch)
+            times[part], lengths[part] = self._search(sources[part], targets)
+        return times, lengths
+
+    def _search(self, sources: np.ndarray, targets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск от пачки источников сразу (delta-stepping над плоскими массивами).
+
+        Метка (источник, узел) хранится по индексу источник * n + узел. На
+        каждом шаге из очереди берутся метки не дальше ширины корзины от
+        ближайшей, и все их рёбра релаксируются одной операцией; улучшенные
+        узлы возвращаются в очередь. Источник снимается с поиска, как только
+        все его цели не дальше ближайшей метки в очереди - дальше их время
+        уже не уменьшится.
+
+        Args:
+            sources: Начальные узлы пачки
+            targets: Целевые узлы
+
+        Returns:
+            Кортеж (время, длина) - массивы источники x цели
+        """
+        n = self.node_count
+        count = len(sources)
+        best = np.full(count * n, np.inf)
+        length = np.full(count * n, np.inf)
+        queued = np.zeros(count * n, dtype=bool)
+
+        frontier = np.arange(count, dtype=np.int64) * n + sources
+        best[frontier] = 0.0
+        length[frontier] = 0.0
+        queued[frontier] = True
+        target_labels = np.arange(count, dtype=np.int64)[:, None] * n + targets[None, :]
+
+        while len(frontier):
+            labels = best[frontier]
+            owner = frontier // n
+
+            # Источники, у которых все цели найдены, больше не расширяются
+            nearest_label = np.full(count, np.inf)
+            np.minimum.at(nearest_label, owner, labels)
+            finished = best[target_labels].max(axis=1) <= nearest_label
+            if finished.any():
+                keep = ~finished[owner]
+                queued[frontier[~keep]] = False
+                frontier, labels = frontier[keep], labels[keep]
+                if not len(frontier):
+                    break
+
+            # Текущая корзина - метки не дальше bucket_minutes от ближайшей
+            current = labels <= labels.min() + self.bucket_minutes
+            active = frontier[current]
+            frontier = frontier[~current]
+            queued[active] = False
+
+            nodes = active % n
+            starts = self.indptr[nodes]
+            degrees = self.indptr[nodes + 1] - starts
+            total = int(degrees.sum())
+            if not total:
+                continue
+            parent = np.repeat(np.arange(len(active)), degrees)
+            edges = np.arange(total) - np.repeat(np.cumsum(degrees) - degrees, degrees) + starts[parent]
+
+            # Релаксация: для каждой метки остаётся лучший кандидат
+            candidate = best[active][parent] + self.duration[edges]
+            labels_to = active[parent] - nodes[parent] + self.indices[edges]
+            better = candidate < best[labels_to]
+            if not better.any():
+                continue
+            candidate, labels_to, edges, parent = (
+                candidate[better], labels_to[better], edges[better], parent[better]
+            )
+            np.minimum.at(best, labels_to, candidate)
+            chosen = candidate == best[labels_to]
+            length[labels_to[chosen]] = length[active][parent[chosen]] + self.distance[edges[chosen]]
+
+            labels_to = labels_to[chosen]
+            fresh = labels_to[~queued[labels_to]]
+            fresh = fresh[np.unique(fresh, return_index=True)[1]] if len(fresh) > 1 else fresh
+            queued[fresh] = True
+            frontier = np.concatenate((frontier, fresh))
+
+        return best[target_labels], length[target_labels]
+
+    def matrices(self, nodes: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Матрицы времени и расстояний между узлами графа.
+
+        Args:
+            nodes: Узлы графа (могут повторяться)
+
+        Returns:
+            Кортеж (time_matrix, distance_matrix). Недостижимые пары - inf
+        """
+        unique, index = np.unique(np.asarray(nodes, dtype=np.int64), return_inverse=True)
+        time_unique, distance_unique = self.shortest_paths(unique, unique)
+        return time_unique[np.ix_(index, index)], distance_unique[np.ix_(index, index)]
+
+
+def main(argv: List[str]):
+    """
+    Собрать граф из выгрузки OSM в CSV.
+
+    Использование:
+        python -m app.services.road_graph nodes.csv edges.csv graph.npz
+
+    nodes.csv - id,lat,lon; edges.csv - from_id,to_id,duration_min,distance_km
+    (одно направление на строку, двусторонние дороги - двумя строками).
+    """
+    if len(argv) != 3:
+        print(main.__doc__)
+        return 1
+
+    nodes_path, edges_path, out_path = argv
+    node_index: Dict[str, int] = {}
+    node_lat: List[float] = []
+    node_lon: List[float] = []
+    with open(nodes_path, newline="") as f:
+        for row in csv.DictReader(f):
+            node_index[row["id"]] = len(node_lat)
+            node_lat.append(float(row["lat"]))
+            node_lon.append(float(row["lon"]))
+
+    with open(edges_path, newline="") as f:
+        edges = [
+            (
+                node_index[row["from_id"]],
+                node_index[row["to_id"]],
+                float(row["duration_min"]),
+                float(row["distance_km"])
+            )
+            for row in csv.DictReader(f)
+        ]
+
+    graph = RoadGraph.from_edges(node_lat, node_lon, edges)
+    graph.save(out_path)
+    print(f"✅ Граф сохранён в {out_path}: {graph.node_count} узлов, {graph.edge_count} рёбер")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
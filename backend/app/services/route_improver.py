@@ -0,0 +1,399 @@
+"""Улучшение готового маршрута локальным поиском (2-opt и Or-opt)"""
+
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.services.client_records import ClientRecord
+from app.services.travel_time import DAY_MINUTES, TravelTimeEngine
+
+
+# Минимальное улучшение суммарного времени в пути (минуты), чтобы принять ход
+IMPROVEMENT_EPS = 1e-6
+
+# Длины сегментов, которые переносит Or-opt
+OR_OPT_LENGTHS = (1, 2, 3)
+
+# Типы ходов
+TWO_OPT = 0
+OR_OPT = 1
+
+
+class RouteSchedule:
+    """
+    Расписание маршрута: порядок точек и времена в минутах от начала недели.
+
+    ready[k] - момент, когда можно выезжать из k-й точки (прибытие +
+    обслуживание), travel_prefix[k] - суммарное время в пути до k-й точки.
+    По ним ход проверяется с первой изменённой позиции, без пересчёта начала.
+    """
+
+    __slots__ = ("order", "arrival", "ready", "travel", "travel_prefix")
+
+    def __init__(self, order: List[int], arrival: List[float], ready: List[float], travel: List[float]):
+        """
+        Инициализация расписания.
+
+        Args:
+            order: Порядок точек (индексы клиентов)
+            arrival: Время прибытия в каждую точку
+            ready: Время готовности к выезду из каждой точки
+            travel: Время в пути на каждом переходе (на один меньше, чем точек)
+        """
+        self.order = order
+        self.arrival = arrival
+        self.ready = ready
+        self.travel = travel
+        self.travel_prefix = np.concatenate(([0.0], np.cumsum(travel)))
+
+    @property
+    def total_travel(self) -> float:
+        """Суммарное время в пути (минуты)"""
+        return float(self.travel_prefix[-1])
+
+    @property
+    def end(self) -> float:
+        """Окончание маршрута (выезд из последней точки)"""
+        return self.ready[-1]
+
+
+class RouteTimer:
+    """
+    Расчёт расписания заданного порядка точек с учётом окон клиентов.
+
+    Время в пути считается по профилю трафика. Как и при построении, если
+    прибытие не попадает в окно клиента, выезд откладывается так, чтобы
+    прибыть к ближайшему открытию.
+    """
+
+    def __init__(self, travel_engine: TravelTimeEngine, clients: List[ClientRecord]):
+        """
+        Инициализация.
+
+        Args:
+            travel_engine: Движок времени в пути
+            clients: Записи клиентов (первая - стартовая точка)
+        """
+        self.travel_engine = travel_engine
+
+        self.service_time = [c.service_time for c in clients]
+        self.work_start = [c.work_start for c in clients]
+        self.work_end = [c.work_end for c in clients]
+        self.lunch_start = [c.lunch_start for c in clients]
+        self.lunch_end = [c.lunch_end for c in clients]
+
+    def _available(self, j: int, minute: float) -> bool:
+        """Доступен ли клиент в указанную минуту суток"""
+        return (
+            self.work_start[j] <= minute < self.work_end[j]
+            and not (self.lunch_start[j] <= minute < self.lunch_end[j])
+        )
+
+    def _next_opening(self, j: int, minute: float) -> Optional[float]:
+        """Ближайшее открытие окна клиента после указанной минуты суток (может быть завтра)"""
+        best = None
+        for opening in (self.work_start[j], self.lunch_end[j]):
+            if not self._available(j, opening):
+                continue
+            wait = (opening - minute) % DAY_MINUTES
+            if best is None or wait < best:
+                best = wait
+        return None if best is None else minute + best
+
+    def time_leg(self, v: int, depart: float, base_minutes: float) -> Optional[Tuple[float, float]]:
+        """
+        Рассчитать один переход к клиенту v.
+
+        Args:
+            v: Индекс клиента назначения
+            depart: Время готовности к выезду (минуты от начала недели)
+            base_minutes: Базовое время в пути без трафика (минуты)
+
+        Returns:
+            Кортеж (время прибытия, фактическое время выезда) или None,
+            если у клиента нет ни одного окна
+        """
+        engine = self.travel_engine
+        arrive = engine.arrival_time(depart, base_minutes)
+
+        minute = arrive % DAY_MINUTES
+        if not self._available(v, minute):
+            opening = self._next_opening(v, minute)
+            if opening is None:
+                return None
+            arrive = arrive - minute + opening
+            depart = engine.departure_time(arrive, base_minutes)
+
+        return arrive, depart
+
+    def schedule_legs(
+        self,
+        order: List[int],
+        start: float,
+        leg_base_times: List[float]
+    ) -> Optional[RouteSchedule]:
+        """
+        Рассчитать расписание по базовому времени каждого перехода.
+
+        Args:
+            order: Порядок точек (первая - стартовая)
+            start: Время старта в минутах от начала недели
+            leg_base_times: Базовое время перехода к каждой точке, кроме первой (минуты)
+
+        Returns:
+            Расписание или None, если маршрут невыполним
+        """
+        arrival, ready, travel = [start], [start], []
+        for v, base_minutes in zip(order[1:], leg_base_times):
+            leg = self.time_leg(v, ready[-1], base_minutes)
+            if leg is None:
+                return None
+            arrive, depart = leg
+            arrival.append(arrive)
+            ready.append(arrive + self.service_time[v])
+            travel.append(arrive - depart)
+
+        return RouteSchedule(list(order), arrival, ready, travel)
+
+
+class RouteImprover(RouteTimer):
+    """
+    Anytime-улучшение маршрута ходами 2-opt и Or-opt с учётом окон клиентов.
+
+    Цель - уменьшить суммарное время в пути, не сдвигая окончание маршрута
+    позже и не нарушая окна работы и обеда. Ходы отбираются по дельте
+    базового времени OSRM: для 2-opt через префиксные суммы прямых и
+    обратных переходов (матрица несимметрична), для Or-opt - по четырём
+    рёбрам; все дельты окрестности считаются векторно за один проход.
+    Кандидаты с отрицательной дельтой проверяются по времени с трафиком
+    с первой изменённой позиции, начиная с лучшего. Поиск останавливается
+    в локальном оптимуме или по исчерпании бюджета времени.
+    """
+
+    def __init__(
+        self,
+        base_time_matrix: np.ndarray,
+        travel_engine: TravelTimeEngine,
+        clients: List[ClientRecord]
+    ):
+        """
+        Инициализация.
+
+        Args:
+            base_time_matrix: Матрица времени в пути без учёта трафика (минуты)
+            travel_engine: Движок времени в пути
+            clients: Записи клиентов (первая - стартовая точка)
+        """
+        super().__init__(travel_engine, clients)
+        self.base_time_matrix = np.asarray(base_time_matrix, dtype=np.float64)
+        self.base_time_matrix_list = self.base_time_matrix.tolist()
+
+    def schedule(
+        self,
+        order: List[int],
+        start: float,
+        from_pos: int = 1,
+        base: Optional[RouteSchedule] = None,
+        travel_limit: float = np.inf
+    ) -> Optional[RouteSchedule]:
+        """
+        Рассчитать расписание маршрута по матрице.
+
+        Args:
+            order: Порядок точек (первая - стартовая)
+            start: Время старта в минутах от начала недели
+            from_pos: Первая позиция, которую нужно пересчитать
+            base: Расписание, из которого берётся неизменённое начало маршрута
+            travel_limit: Прервать расчёт, если время в пути достигнет этого значения
+
+        Returns:
+            Расписание или None, если маршрут невыполним или не лучше travel_limit
+        """
+        if base is None:
+            from_pos = 1
+            arrival, ready, travel = [start], [start], []
+            spent = 0.0
+        else:
+            arrival = base.arrival[:from_pos]
+            ready = base.ready[:from_pos]
+            travel = base.travel[:from_pos - 1]
+            spent = float(base.travel_prefix[from_pos - 1])
+
+        matrix = self.base_time_matrix_list
+
+        for k in range(from_pos, len(order)):
+            u, v = order[k - 1], order[k]
+            leg = self.time_leg(v, ready[-1], matrix[u][v])
+            if leg is None:
+                return None
+
+            arrive, depart = leg
+            spent += arrive - depart
+            if spent >= travel_limit:
+                return None
+
+            arrival.append(arrive)
+            ready.append(arrive + self.service_time[v])
+            travel.append(arrive - depart)
+
+        return RouteSchedule(list(order), arrival, ready, travel)
+
+    def _two_opt_moves(self, order: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Дельты всех ходов 2-opt (разворот order[i..j]) по базовой матрице.
+
+        Returns:
+            Кортеж (дельты, ходы [TWO_OPT, первая изменённая позиция, i, j, 0])
+            только для ходов с отрицательной дельтой
+        """
+        m = len(order)
+        r = np.asarray(order)
+        matrix = self.base_time_matrix
+        fwd = np.concatenate(([0.0], np.cumsum(matrix[r[:-1], r[1:]])))
+        rev = np.concatenate(([0.0], np.cumsum(matrix[r[1:], r[:-1]])))
+
+        i = np.arange(1, m)[:, None]
+        j = np.arange(1, m)[None, :]
+        nxt = np.minimum(j + 1, m - 1)
+        has_next = j + 1 < m
+
+        old = matrix[r[i - 1], r[i]] + (fwd[j] - fwd[i]) + np.where(has_next, matrix[r[j], r[nxt]], 0.0)
+        new = matrix[r[i - 1], r[j]] + (rev[j] - rev[i]) + np.where(has_next, matrix[r[i], r[nxt]], 0.0)
+        delta = np.where(j > i, new - old, np.inf)
+
+        ii, jj = np.nonzero(delta < -IMPROVEMENT_EPS)
+        moves = np.column_stack((
+            np.full(len(ii), TWO_OPT),
+            ii + 1,
+            ii + 1,
+            jj + 1,
+            np.zeros(len(ii), dtype=np.int64)
+        ))
+        return delta[ii, jj], moves
+
+    def _or_opt_moves(self, order: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Дельты всех ходов Or-opt (перенос сегмента order[i:i+length] после позиции p).
+
+        Returns:
+            Кортеж (дельты, ходы [OR_OPT, первая изменённая позиция, i, length, p])
+            только для ходов с отрицательной дельтой
+        """
+        m = len(order)
+        r = np.asarray(order)
+        matrix = self.base_time_matrix
+        p = np.arange(m)[None, :]
+        after = r[np.minimum(p + 1, m - 1)]
+        has_after = p + 1 < m
+
+        deltas, moves = [], []
+        for length in OR_OPT_LENGTHS:
+            if m - length < 1:
+                break
+
+            i = np.arange(1, m - length + 1)[:, None]
+            first, last, prev = r[i], r[i + length - 1], r[i - 1]
+            nxt = r[np.minimum(i + length, m - 1)]
+
+            # Выигрыш от удаления сегмента и стоимость вставки после каждой позиции p
+            removed = matrix[prev, first] + np.where(
+                i + length < m,
+                matrix[last, nxt] - matrix[prev, nxt],
+                0.0
+            )
+            inserted = matrix[r[p], first] + np.where(
+                has_after,
+                matrix[last, after] - matrix[r[p], after],
+                0.0
+            )
+            delta = inserted - removed
+            delta[(p >= i - 1) & (p <= i + length - 1)] = np.inf
+
+            ii, pp = np.nonzero(delta < -IMPROVEMENT_EPS)
+            deltas.append(delta[ii, pp])
+            moves.append(np.column_stack((
+                np.full(len(ii), OR_OPT),
+                np.minimum(ii + 1, pp + 1),
+                ii + 1,
+                np.full(len(ii), length),
+                pp
+            )))
+
+        if not deltas:
+            return np.empty(0), np.empty((0, 5), dtype=np.int64)
+        return np.concatenate(deltas), np.concatenate(moves)
+
+    @staticmethod
+    def _apply_two_opt(order: List[int], i: int, j: int) -> List[int]:
+        """Развернуть участок order[i..j]"""
+        return order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+
+    @staticmethod
+    def _apply_or_opt(order: List[int], i: int, length: int, p: int) -> List[int]:
+        """Перенести сегмент order[i:i+length] после позиции p"""
+        segment = order[i:i + length]
+        rest = order[:i] + order[i + length:]
+        k = p + 1 if p < i else p + 1 - length
+        return rest[:k] + segment + rest[k:]
+
+    def improve(
+        self,
+        order: List[int],
+        start: float,
+        time_budget_ms: float
+    ) -> Tuple[Optional[RouteSchedule], int]:
+        """
+        Улучшать маршрут, пока есть улучшающие ходы и не истёк бюджет времени.
+
+        Args:
+            order: Порядок точек после жадного построения (первая - стартовая)
+            start: Время старта в минутах от начала недели
+            time_budget_ms: Бюджет времени на улучшение (мс)
+
+        Returns:
+            Кортеж (улучшенное расписание или None, если улучшить не удалось,
+            количество принятых ходов)
+        """
+        deadline = time.perf_counter() + time_budget_ms / 1000.0
+
+        current = self.schedule(order, start)
+        if current is None or len(order) < 3:
+            return None, 0
+
+        accepted = 0
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+
+            two_opt_delta, two_opt = self._two_opt_moves(current.order)
+            or_opt_delta, or_opt = self._or_opt_moves(current.order)
+            deltas = np.concatenate((two_opt_delta, or_opt_delta))
+            moves = np.concatenate((two_opt, or_opt))
+
+            # Проверяем кандидатов по времени с трафиком, начиная с лучшей дельты
+            for kind, pos, a, b, c in moves[np.argsort(deltas, kind="stable")].tolist():
+                if time.perf_counter() >= deadline:
+                    break
+
+                if kind == TWO_OPT:
+                    candidate_order = self._apply_two_opt(current.order, a, b)
+                else:
+                    candidate_order = self._apply_or_opt(current.order, a, b, c)
+
+                candidate = self.schedule(
+                    candidate_order,
+                    start,
+                    from_pos=pos,
+                    base=current,
+                    travel_limit=current.total_travel - IMPROVEMENT_EPS
+                )
+                if candidate is None or candidate.end > current.end + IMPROVEMENT_EPS:
+                    continue
+
+                current = candidate
+                accepted += 1
+                improved = True
+                break
+
+        return (current if accepted else None), accepted
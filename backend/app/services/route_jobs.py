@@ -0,0 +1,423 @@
+"""Фоновые задачи оптимизации маршрутов"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    """Очередь задач заполнена - новая задача не принята"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Очередь задач оптимизации заполнена")
+        self.retry_after = retry_after
+
+
+class RouteJob:
+    """Задача оптимизации: статус, время этапов и результат"""
+
+    __slots__ = ("id", "status", "created_at", "started_at", "finished_at", "result", "error", "work")
+
+    def __init__(self, work: Callable[[], Awaitable[Any]]):
+        """
+        Инициализация задачи.
+
+        Args:
+            work: Функция, возвращающая корутину с расчётом результата
+        """
+        self.id = uuid.uuid4().hex
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.work: Optional[Callable[[], Awaitable[Any]]] = work
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+
+class RouteJobStore:
+    """
+    Общее хранилище статусов задач в SQLite (режим WAL).
+
+    Нужно при запуске в несколько процессов (serve.py): задачу принимает
+    один воркер, а статус могут запросить у любого. Результат хранится
+    в JSON и при чтении возвращается словарём. Соединение открывается
+    в каждом процессе своё.
+    """
+
+    def __init__(self, path: str):
+        """
+        Инициализация хранилища.
+
+        Args:
+            path: Путь к файлу базы SQLite
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = 0
+        self._connection: Optional[sqlite3.Connection] = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        status TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        started_at REAL,
+                        finished_at REAL,
+                        result TEXT,
+                        error TEXT
+                    )
+                    """
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)")
+        self.close()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Соединение текущего процесса (после fork открывается заново)"""
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._connection
+
+    def save(self, job: RouteJob):
+        """
+        Записать текущее состояние задачи.
+
+        Args:
+            job: Задача
+        """
+        result = job.result
+        if result is not None:
+            result = result.model_dump_json() if hasattr(result, "model_dump_json") else json.dumps(result)
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.status, job.created_at, job.started_at, job.finished_at, result, job.error)
+                )
+
+    def load(self, job_id: str) -> Optional[RouteJob]:
+        """
+        Прочитать задачу.
+
+        Args:
+            job_id: ID задачи
+
+        Returns:
+            Задача (результат - словарь) или None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, created_at, started_at, finished_at, result, error FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        job = RouteJob(None)
+        job.id = job_id
+        job.status, job.created_at, job.started_at, job.finished_at, result, job.error = row
+        job.result = json.loads(result) if result is not None else None
+        return job
+
+    def evict(self, deadline: float) -> int:
+        """
+        Удалить задачи, завершённые не позже deadline.
+
+        Args:
+            deadline: Граница времени завершения (unix time)
+
+        Returns:
+            Количество удалённых задач
+        """
+        with self._lock:
+            with self._conn:
+                return self._conn.execute(
+                    "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at <= ?",
+                    (deadline,)
+                ).rowcount
+
+    def close(self):
+        """Закрыть соединение текущего процесса"""
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._pid = 0
+
+
+class RouteJobQueue:
+    """
+    Очередь задач с ограниченным пулом обработчиков.
+
+    Задачи выполняются фиксированным числом asyncio-обработчиков, очередь
+    ограничена: если она заполнена, задача отклоняется сразу (backpressure),
+    а не копится в памяти. Завершённые задачи хранятся JOB_TTL секунд,
+    чтобы клиент успел забрать результат. Если задан JOB_STORE_PATH,
+    статусы дублируются в общее хранилище и видны всем процессам.
+    Запросы к хранилищу выполняются в потоке (запись может ждать блокировку
+    другого воркера), а очистка хранилища - не чаще раза в
+    JOB_STORE_EVICT_INTERVAL секунд.
+    """
+
+    def __init__(
+        self,
+        workers: int = None,
+        max_queue: int = None,
+        ttl: float = None,
+        describe_error: Callable[[Exception], str] = str,
+        store_path: str = None,
+        store_evict_interval: float = None
+    ):
+        """
+        Инициализация очереди.
+
+        Args:
+            workers: Количество одновременно выполняемых задач (по умолчанию из env)
+            max_queue: Максимум задач, ожидающих выполнения (по умолчанию из env)
+            ttl: Время хранения завершённых задач в секундах (по умолчанию из env)
+            describe_error: Текст ошибки задачи для клиента
+            store_path: Путь к общему хранилищу статусов (по умолчанию из env, без него - только память)
+            store_evict_interval: Минимальный интервал очистки хранилища в секундах (по умолчанию из env)
+        """
+        self.workers = max(1, workers or int(os.getenv("JOB_WORKERS", str(os.cpu_count() or 1))))
+        self.max_queue = max(1, max_queue or int(os.getenv("JOB_QUEUE_SIZE", "100")))
+        self.ttl = ttl if ttl is not None else float(os.getenv("JOB_TTL", "3600"))
+        self.describe_error = describe_error
+
+        store_path = store_path or os.getenv("JOB_STORE_PATH")
+        self._store: Optional[RouteJobStore] = None
+        if store_path:
+            try:
+                self._store = RouteJobStore(store_path)
+            except Exception as e:
+                print(f"⚠ Не удалось открыть хранилище задач {store_path}: {e}")
+        self.store_evict_interval = (
+            store_evict_interval if store_evict_interval is not None
+            else float(os.getenv("JOB_STORE_EVICT_INTERVAL", "60"))
+        )
+        self._store_evicted_at = 0.0
+        self._store_evict_task: Optional[asyncio.Task] = None
+        # Записи идут в потоках - блокировка сохраняет их порядок (queued раньше running)
+        self._store_write_lock = asyncio.Lock()
+
+        self._jobs: Dict[str, RouteJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.evicted = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    def start(self):
+        """Запустить обработчики очереди (вызывается при старте приложения или первой задаче)"""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"route-job-{k}")
+            for k in range(self.workers)
+        ]
+
+    async def stop(self):
+        """Остановить обработчики (незавершённые задачи отменяются)"""
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queue = None
+
+    async def submit(self, work: Callable[[], Awaitable[Any]]) -> RouteJob:
+        """
+        Поставить задачу в очередь.
+
+        Args:
+            work: Функция, возвращающая корутину с расчётом результата
+
+        Returns:
+            Созданная задача
+
+        Raises:
+            JobQueueFullError: Очередь заполнена
+        """
+        self.start()
+        self._evict_expired()
+        self._schedule_store_eviction()
+
+        job = RouteJob(work)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFullError(self._retry_after())
+
+        self._jobs[job.id] = job
+        self.submitted += 1
+        await self._save(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[RouteJob]:
+        """
+        Получить задачу по ID.
+
+        Args:
+            job_id: ID задачи
+
+        Returns:
+            Задача или None, если её нет или срок хранения истёк
+        """
+        self._evict_expired()
+        self._schedule_store_eviction()
+        job = self._jobs.get(job_id)
+        if job is None and self._store is not None:
+            # Задача принята другим процессом
+            try:
+                job = await asyncio.to_thread(self._store.load, job_id)
+            except Exception as e:
+                print(f"⚠ Ошибка чтения хранилища задач: {e}")
+        return job
+
+    async def _save(self, job: RouteJob):
+        """Записать состояние задачи в общее хранилище (вне event loop)"""
+        if self._store is None:
+            return
+        try:
+            async with self._store_write_lock:
+                await asyncio.to_thread(self._store.save, job)
+        except Exception as e:
+            print(f"⚠ Ошибка записи хранилища задач: {e}")
+
+    async def _worker(self):
+        """Обработчик: берёт задачи из очереди по одной"""
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: RouteJob):
+        """Выполнить задачу и сохранить результат или ошибку"""
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        self._wait_total += job.started_at - job.created_at
+        self._running += 1
+        await self._save(job)
+
+        work, job.work = job.work, None
+        try:
+            job.result = await work()
+            job.status = JOB_DONE
+            self.completed += 1
+        except asyncio.CancelledError:
+            job.status = JOB_FAILED
+            job.error = "Задача отменена"
+            self.failed += 1
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка задачи {job.id}: {e}")
+            job.status = JOB_FAILED
+            job.error = self.describe_error(e)
+            self.failed += 1
+        finally:
+            job.finished_at = time.time()
+            self._run_total += job.finished_at - job.started_at
+            self._running -= 1
+            # Итоговое состояние записывается и при отмене обработчика
+            await asyncio.shield(self._save(job))
+
+    def _evict_expired(self):
+        """Удалить из памяти завершённые задачи, срок хранения которых истёк"""
+        if self.ttl <= 0:
+            return
+        deadline = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at <= deadline
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self.evicted += len(expired)
+
+    def _schedule_store_eviction(self):
+        """Запустить в фоне очистку хранилища, если с прошлой прошло не меньше интервала"""
+        if self._store is None or self.ttl <= 0:
+            return
+        now = time.monotonic()
+        if now - self._store_evicted_at < self.store_evict_interval:
+            return
+        if self._store_evict_task is not None and not self._store_evict_task.done():
+            return
+        self._store_evicted_at = now
+        self._store_evict_task = asyncio.create_task(self._evict_store(time.time() - self.ttl))
+
+    async def _evict_store(self, deadline: float):
+        """Удалить из хранилища задачи, завершённые не позже deadline"""
+        try:
+            await asyncio.to_thread(self._store.evict, deadline)
+        except Exception as e:
+            print(f"⚠ Ошибка очистки хранилища задач: {e}")
+
+    def _average_run(self) -> float:
+        finished = self.completed + self.failed
+        return self._run_total / finished if finished else 0.0
+
+    def _retry_after(self) -> float:
+        """Оценка времени до освобождения места в очереди (секунды)"""
+        return max(1.0, self._average_run() * self.queued / self.workers)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику очереди задач"""
+        self._evict_expired()
+        started = self.completed + self.failed + self._running
+        return {
+            "pid": os.getpid(),
+            "shared_store": self._store is not None,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "running": self._running,
+            "stored_jobs": len(self._jobs),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "avg_wait_ms": round(self._wait_total / started * 1000, 1) if started else 0.0,
+            "avg_run_ms": round(self._average_run() * 1000, 1)
+        }
@@ -0,0 +1,232 @@
+"""Векторизованный выбор следующей точки маршрута"""
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.services.client_records import ClientRecord
+
+
+# Время внутри движка хранится в микросекундах от полуночи - с той же точностью,
+# что и datetime + timedelta, поэтому проверки окон совпадают с can_visit
+MINUTE_US = 60_000_000
+DAY_US = 24 * 60 * MINUTE_US
+
+
+def time_of_day_us(moment: datetime) -> int:
+    """Время суток в микросекундах от полуночи"""
+    return (
+        (moment.hour * 60 + moment.minute) * MINUTE_US
+        + moment.second * 1_000_000
+        + moment.microsecond
+    )
+
+
+class GreedySelector:
+    """
+    Выбор следующего клиента жадным алгоритмом над массивами NumPy.
+
+    Окна работы и обеда клиентов хранятся массивами минут от полуночи,
+    посещённые клиенты - булевой маской. На каждом шаге время в пути,
+    время прибытия, доступность и score считаются для всех кандидатов
+    сразу, а лучший выбирается одним argmax(score / adjusted_time).
+    """
+
+    def __init__(
+        self,
+        base_time_matrix: np.ndarray,
+        attn_scores: np.ndarray,
+        work_start: List[int],
+        work_end: List[int],
+        lunch_start: List[int],
+        lunch_end: List[int]
+    ):
+        """
+        Инициализация движка.
+
+        Args:
+            base_time_matrix: Матрица времени в пути без учёта трафика (минуты)
+            attn_scores: Attention scores клиентов
+            work_start: Начало рабочего дня клиентов (минуты от полуночи)
+            work_end: Конец рабочего дня клиентов (минуты от полуночи)
+            lunch_start: Начало обеда клиентов (минуты от полуночи)
+            lunch_end: Конец обеда клиентов (минуты от полуночи)
+        """
+        self.base_time_matrix = np.asarray(base_time_matrix, dtype=np.float64)
+        self.attn_scores = np.asarray(attn_scores, dtype=np.float64)
+
+        self.work_start_us = np.asarray(work_start, dtype=np.int64) * MINUTE_US
+        self.work_end_us = np.asarray(work_end, dtype=np.int64) * MINUTE_US
+        self.lunch_start_us = np.asarray(lunch_start, dtype=np.int64) * MINUTE_US
+        self.lunch_end_us = np.asarray(lunch_end, dtype=np.int64) * MINUTE_US
+
+        self.visited = np.zeros(len(self.attn_scores), dtype=bool)
+
+    @classmethod
+    def from_records(
+        cls,
+        base_time_matrix: np.ndarray,
+        attn_scores: np.ndarray,
+        clients: List[ClientRecord]
+    ) -> "GreedySelector":
+        """
+        Создать движок по записям клиентов.
+
+        Args:
+            base_time_matrix: Матрица времени в пути без учёта трафика (минуты)
+            attn_scores: Attention scores клиентов
+            clients: Записи клиентов
+
+        Returns:
+            Движок выбора следующего клиента
+        """
+        return cls(
+            base_time_matrix,
+            attn_scores,
+            [c.work_start for c in clients],
+            [c.work_end for c in clients],
+            [c.lunch_start for c in clients],
+            [c.lunch_end for c in clients]
+        )
+
+    @property
+    def visited_count(self) -> int:
+        """Количество посещённых клиентов"""
+        return int(self.visited.sum())
+
+    def mark_visited(self, j: int):
+        """Отметить клиента посещённым"""
+        self.visited[j] = True
+
+    def available_at(self, arrival_us: np.ndarray, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Маска клиентов, доступных в указанное время прибытия.
+
+        Args:
+            arrival_us: Время прибытия к каждому клиенту (микросекунды от полуночи)
+            indices: Индексы клиентов, к которым относится arrival_us (None - все)
+
+        Returns:
+            Булев массив: True, если клиент работает и не на обеде
+        """
+        work_start, work_end = self.work_start_us, self.work_end_us
+        lunch_start, lunch_end = self.lunch_start_us, self.lunch_end_us
+        if indices is not None:
+            work_start, work_end = work_start[indices], work_end[indices]
+            lunch_start, lunch_end = lunch_start[indices], lunch_end[indices]
+
+        return (
+            (work_start <= arrival_us)
+            & (arrival_us < work_end)
+            & ~((lunch_start <= arrival_us) & (arrival_us < lunch_end))
+        )
+
+    def can_visit(self, indices: np.ndarray, current_time: datetime, travel_time: np.ndarray) -> np.ndarray:
+        """
+        Маска клиентов из подмножества, которых можно посетить сейчас.
+
+        Args:
+            indices: Индексы клиентов
+            current_time: Время отправления
+            travel_time: Время в пути до этих клиентов (минуты)
+
+        Returns:
+            Булев массив по indices: клиент не посещён и доступен к прибытию
+        """
+        arrival_us = self.arrival_us(current_time, travel_time)
+        return ~self.visited[indices] & self.available_at(arrival_us, indices)
+
+    def arrival_us(self, current_time: datetime, travel_time: np.ndarray) -> np.ndarray:
+        """
+        Время прибытия ко всем клиентам (микросекунды от полуночи).
+
+        Args:
+            current_time: Время отправления
+            travel_time: Время в пути до каждого клиента (минуты)
+
+        Returns:
+            Массив времени прибытия
+        """
+        return (
+            time_of_day_us(current_time)
+            + np.rint(np.asarray(travel_time, dtype=np.float64) * MINUTE_US).astype(np.int64)
+        ) % DAY_US
+
+    def opening_waits(
+        self,
+        current_node: int,
+        current_time: datetime,
+        travel_time: np.ndarray
+    ) -> np.ndarray:
+        """
+        Ожидание от расчётного прибытия до ближайшего открытия окна клиента.
+
+        Клиент доступен с начала рабочего дня и с конца обеда, если эти
+        моменты попадают в его рабочее время; если сегодня все окна прошли -
+        ожидание считается до первого окна следующего дня.
+
+        Args:
+            current_node: Индекс текущей точки
+            current_time: Время отправления
+            travel_time: Время в пути до каждого клиента (минуты)
+
+        Returns:
+            Ожидание в микросекундах (0 - доступен сразу, inf - посещён
+            или ни одного окна нет)
+        """
+        arrival_us = self.arrival_us(current_time, travel_time)
+
+        waits = np.full(len(self.visited), np.inf)
+        for opening_us in (self.work_start_us, self.lunch_end_us):
+            valid = self.available_at(opening_us)
+            wait = ((opening_us - arrival_us) % DAY_US).astype(np.float64)
+            waits = np.where(valid, np.minimum(waits, wait), waits)
+
+        waits[self.available_at(arrival_us)] = 0.0
+        waits[self.visited] = np.inf
+        waits[current_node] = np.inf
+        return waits
+
+    def select(
+        self,
+        current_node: int,
+        current_time: datetime,
+        travel_time: np.ndarray,
+        allowed: Optional[np.ndarray] = None
+    ) -> Tuple[Optional[int], float, bool]:
+        """
+        Выбрать следующего клиента.
+
+        Args:
+            current_node: Индекс текущей точки
+            current_time: Текущее время
+            travel_time: Время в пути от текущей точки до каждого клиента с учётом трафика (минуты)
+            allowed: Маска клиентов, из которых можно выбирать (None - все непосещённые)
+
+        Returns:
+            Кортеж (индекс лучшего клиента или None, время в пути к нему,
+            есть ли непосещённые клиенты, недоступные сейчас)
+        """
+        candidates = ~self.visited
+        candidates[current_node] = False
+        if allowed is not None:
+            candidates &= allowed
+
+        # Время прибытия ко всем клиентам сразу
+        adjusted_time = np.asarray(travel_time, dtype=np.float64)
+        arrival_us = self.arrival_us(current_time, adjusted_time)
+
+        available = self.available_at(arrival_us)
+        any_available_later = bool(np.any(candidates & ~available))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            score = self.attn_scores / (adjusted_time + 1e-5)
+        score = np.where(candidates & available & ~np.isnan(score), score, -np.inf)
+
+        # argmax возвращает первый максимум - как строгое сравнение в цикле по j
+        best_j = int(np.argmax(score))
+        if not score[best_j] > -np.inf:
+            return None, 0.0, any_available_later
+
+        return best_j, adjusted_time[best_j], any_available_later
@@ -0,0 +1,191 @@
+"""Пространственный индекс точек для поиска ближайших кандидатов"""
+
+import math
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.clustering import KM_PER_DEGREE
+
+
+# Фильтр кандидатов: индексы точек -> булева маска подходящих
+CandidateFilter = Callable[[np.ndarray], np.ndarray]
+
+
+class SpatialIndex:
+    """
+    Сеточный индекс точек (как geohash, но с ячейками в километрах).
+
+    Точки проецируются в плоские километры (как clustering.project) и
+    раскладываются по квадратным ячейкам. Поиск k ближайших обходит кольца
+    ячеек вокруг точки запроса и останавливается, как только k-й найденный
+    кандидат ближе любого следующего кольца; поиск в радиусе смотрит только
+    ячейки, пересекающие круг. Кандидаты из каждого кольца проверяются
+    фильтром одним вызовом - так отбрасываются посещённые клиенты и
+    клиенты, чьё окно закрыто к расчётному прибытию.
+    """
+
+    def __init__(self, coords: Sequence[Tuple[float, float]], cell_km: float = None, per_cell: int = 4):
+        """
+        Инициализация индекса.
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+            cell_km: Размер ячейки (км). По умолчанию - чтобы в ячейке было около per_cell точек
+            per_cell: Среднее число точек в ячейке для размера по умолчанию
+        """
+        points = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self._cos_lat = math.cos(math.radians(float(points[:, 0].mean()))) if len(points) else 1.0
+        self.points = self._project(points)
+
+        if cell_km is None:
+            extent = self.points.max(axis=0) - self.points.min(axis=0) if len(points) else np.zeros(2)
+            area = max(float(extent[0] * extent[1]), float(extent.max()) ** 2 / max(len(points), 1), 1e-4)
+            cell_km = math.sqrt(area * per_cell / max(len(points), 1))
+        self.cell_km = max(cell_km, 0.01)
+
+        cells = np.floor(self.points / self.cell_km).astype(np.int64)
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(points):
+            order = np.lexsort((cells[:, 1], cells[:, 0]))
+            keys, starts = np.unique(cells[order], axis=0, return_index=True)
+            for key, members in zip(keys.tolist(), np.split(order, starts[1:])):
+                self._cells[tuple(key)] = members
+            self._low = cells.min(axis=0)
+            self._high = cells.max(axis=0)
+        else:
+            self._low = self._high = np.zeros(2, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _project(self, points: np.ndarray) -> np.ndarray:
+        """Координаты в плоские километры (км к северу, км к востоку)"""
+        return np.column_stack((points[:, 0] * KM_PER_DEGREE, points[:, 1] * KM_PER_DEGREE * self._cos_lat))
+
+    def _ring(self, center: Tuple[int, int], r: int) -> Iterator[np.ndarray]:
+        """Точки ячеек на кольце r вокруг центральной ячейки (только внутри границ сетки)"""
+        cy, cx = center
+        if r == 0:
+            members = self._cells.get((cy, cx))
+            if members is not None:
+                yield members
+            return
+
+        low_y, low_x = self._low.tolist()
+        high_y, high_x = self._high.tolist()
+        x_from, x_to = max(cx - r, low_x), min(cx + r, high_x)
+        for y in (cy - r, cy + r):
+            if low_y <= y <= high_y:
+                for x in range(x_from, x_to + 1):
+                    members = self._cells.get((y, x))
+                    if members is not None:
+                        yield members
+        for x in (cx - r, cx + r):
+            if low_x <= x <= high_x:
+                for y in range(max(cy - r + 1, low_y), min(cy + r - 1, high_y) + 1):
+                    members = self._cells.get((y, x))
+                    if members is not None:
+                        yield members
+
+    def _query(self, coord: Tuple[float, float]) -> Tuple[np.ndarray, Tuple[int, int], int]:
+        """Точка запроса в км, её ячейка и число колец до дальнего края сетки"""
+        target = self._project(np.asarray(coord, dtype=np.float64).reshape(1, 2))[0]
+        center = tuple(np.floor(target / self.cell_km).astype(np.int64).tolist())
+        max_ring = int(max(
+            abs(center[0] - self._low[0]), abs(self._high[0] - center[0]),
+            abs(center[1] - self._low[1]), abs(self._high[1] - center[1])
+        ))
+        return target, center, max_ring
+
+    def _candidates(
+        self,
+        target: np.ndarray,
+        center: Tuple[int, int],
+        r: int,
+        accept: Optional[CandidateFilter]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Подходящие точки кольца r и расстояния до них (км)"""
+        members = list(self._ring(center, r))
+        if not members:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        idx = np.concatenate(members)
+        if accept is not None:
+            idx = idx[accept(idx)]
+        distances = np.sqrt(((self.points[idx] - target) ** 2).sum(axis=1))
+        return idx, distances
+
+    def nearest(
+        self,
+        coord: Tuple[float, float],
+        k: int,
+        accept: Optional[CandidateFilter] = None
+    ) -> np.ndarray:
+        """
+        Найти k ближайших подходящих точек.
+
+        Args:
+            coord: Точка запроса (lat, lon)
+            k: Количество точек
+            accept: Фильтр кандидатов (None - все точки)
+
+        Returns:
+            Индексы точек по возрастанию расстояния (меньше k, если подходящих меньше)
+        """
+        if k <= 0 or not self._cells:
+            return np.empty(0, dtype=np.int64)
+
+        target, center, max_ring = self._query(coord)
+        found: List[np.ndarray] = []
+        found_distances: List[np.ndarray] = []
+        count = 0
+        for r in range(max_ring + 1):
+            idx, distances = self._candidates(target, center, r, accept)
+            if len(idx):
+                found.append(idx)
+                found_distances.append(distances)
+                count += len(idx)
+
+            # Точки следующих колец не ближе r ячеек от точки запроса
+            if count >= k:
+                kth = np.partition(np.concatenate(found_distances), k - 1)[k - 1]
+                if kth <= r * self.cell_km:
+                    break
+
+        if not count:
+            return np.empty(0, dtype=np.int64)
+        idx = np.concatenate(found)
+        distances = np.concatenate(found_distances)
+        return idx[np.argsort(distances, kind="stable")[:k]]
+
+    def within(
+        self,
+        coord: Tuple[float, float],
+        radius_km: float,
+        accept: Optional[CandidateFilter] = None
+    ) -> np.ndarray:
+        """
+        Найти подходящие точки в радиусе.
+
+        Args:
+            coord: Точка запроса (lat, lon)
+            radius_km: Радиус (км, по плоской проекции)
+            accept: Фильтр кандидатов (None - все точки)
+
+        Returns:
+            Индексы точек по возрастанию расстояния
+        """
+        if not self._cells:
+            return np.empty(0, dtype=np.int64)
+
+        target, center, max_ring = self._query(coord)
+        found: List[np.ndarray] = []
+        found_distances: List[np.ndarray] = []
+        for r in range(min(max_ring, int(radius_km // self.cell_km) + 1) + 1):
+            idx, distances = self._candidates(target, center, r, accept)
+            inside = distances <= radius_km
+            found.append(idx[inside])
+            found_distances.append(distances[inside])
+
+        idx = np.concatenate(found)
+        return idx[np.argsort(np.concatenate(found_distances), kind="stable")]
@@ -1,8 +1,107 @@
 """Сервис для работы с данными о трафике"""
 
+import asyncio
 import json
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from app.services.travel_time import TravelTimeEngine
+
+
+# Дни недели в порядке строк таблицы коэффициентов
+DAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+DAY_INDEX = {day: idx for idx, day in enumerate(DAYS)}
+
+
+class TrafficTable:
+    """
+    Скомпилированная таблица коэффициентов трафика.
+
+    hourly - плотный массив 7 x 24 (день недели x час), minutely - 7 x 1440
+    с коэффициентом на каждую минуту: ступенчатым по часам или линейно
+    интерполированным между началами часов. Таблица не изменяется после
+    создания, при перезагрузке конфига сервис подменяет её целиком.
+    """
+
+    __slots__ = ("hourly", "minutely", "version")
+
+    def __init__(self, hourly: np.ndarray, interpolate: bool = False, version: float = 0.0):
+        """
+        Инициализация таблицы.
+
+        Args:
+            hourly: Массив коэффициентов 7 x 24
+            interpolate: Интерполировать коэффициенты внутри часа
+            version: Версия данных (mtime файла конфигурации)
+        """
+        self.hourly = hourly
+        self.version = version
+
+        if interpolate:
+            # Значение часа h относится к h:00, к следующему часу (и дню) - линейный переход
+            flat = hourly.reshape(-1)
+            nxt = np.roll(flat, -1)
+            frac = np.arange(60, dtype=np.float64) / 60.0
+            self.minutely = (flat[:, None] * (1.0 - frac) + nxt[:, None] * frac).reshape(7, 1440)
+        else:
+            self.minutely = np.repeat(hourly, 60, axis=1)
+
+        self.hourly.setflags(write=False)
+        self.minutely.setflags(write=False)
+
+    @classmethod
+    def from_config(cls, data: Dict[str, Any], interpolate: bool = False, version: float = 0.0) -> "TrafficTable":
+        """
+        Скомпилировать таблицу из данных traffic.json.
+
+        Args:
+            data: Данные конфига {"Monday": {"hours": {"0": {"average": ...}}}}
+            interpolate: Интерполировать коэффициенты внутри часа
+            version: Версия данных
+
+        Returns:
+            Таблица коэффициентов (1.0 там, где данных нет)
+        """
+        hourly = np.ones((7, 24), dtype=np.float64)
+        for day, idx in DAY_INDEX.items():
+            hours_data = (data.get(day.capitalize()) or {}).get("hours", {})
+            for hour in range(24):
+                hour_data = hours_data.get(str(hour), {})
+                hourly[idx, hour] = float(hour_data.get("average", 1.0))
+        return cls(hourly, interpolate=interpolate, version=version)
+
+    def multiplier(self, hour: int, day_index: Optional[int]) -> float:
+        """
+        Коэффициент трафика для часа и индекса дня.
+
+        Args:
+            hour: Час дня (0-23)
+            day_index: Индекс дня недели (0 - понедельник) или None
+
+        Returns:
+            Коэффициент трафика (1.0, если день или час неизвестны)
+        """
+        if day_index is None or not 0 <= hour < 24:
+            return 1.0
+        return self.hourly[day_index, hour]
+
+    def multipliers(self, minutes: np.ndarray, day_index: Optional[int]) -> np.ndarray:
+        """
+        Коэффициенты трафика для массива моментов времени (векторно).
+
+        Args:
+            minutes: Минуты от полуночи (дробные минуты округляются вниз)
+            day_index: Индекс дня недели или None
+
+        Returns:
+            Массив коэффициентов
+        """
+        minutes = np.asarray(minutes)
+        if day_index is None:
+            return np.ones(minutes.shape, dtype=np.float64)
+        return self.minutely[day_index, np.floor(minutes).astype(np.int64) % 1440]
 
 
 class TrafficService:
@@ -19,21 +118,52 @@ class TrafficService:
             "TRAFFIC_CONFIG_PATH",
             "config/traffic.json"
         )
+        self.interpolate = os.getenv("TRAFFIC_INTERPOLATE", "False").lower() in ("1", "true", "yes")
         self._traffic_data: Dict[str, Any] = {}
+        self._engine = TravelTimeEngine(TrafficTable.from_config({}, interpolate=self.interpolate))
+        self._mtime: Optional[float] = None
         self._load_traffic_data()
 
-    def _load_traffic_data(self):
-        """Загрузить данные трафика из JSON файла"""
+    def _load_traffic_data(self, keep_on_error: bool = False):
+        """
+        Загрузить данные трафика из JSON файла и скомпилировать таблицу.
+
+        Args:
+            keep_on_error: При ошибке чтения оставить текущие данные (для горячей перезагрузки)
+        """
         try:
+            mtime = os.path.getmtime(self.traffic_config_path)
             with open(self.traffic_config_path, "r", encoding="utf-8") as f:
-                self._traffic_data = json.load(f)
+                data = json.load(f)
+            table = TrafficTable.from_config(data, interpolate=self.interpolate, version=mtime)
             print(f"✅ Данные трафика загружены из {self.traffic_config_path}")
         except FileNotFoundError:
             print(f"⚠ Файл {self.traffic_config_path} не найден. Используются дефолтные коэффициенты.")
-            self._traffic_data = {}
-        except json.JSONDecodeError as e:
+            if keep_on_error:
+                return
+            mtime, data = None, {}
+            table = TrafficTable.from_config(data, interpolate=self.interpolate)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
             print(f"⚠ Ошибка парсинга {self.traffic_config_path}: {e}")
-            self._traffic_data = {}
+            if keep_on_error:
+                return
+            mtime, data = None, {}
+            table = TrafficTable.from_config(data, interpolate=self.interpolate)
+
+        engine = TravelTimeEngine(table)
+
+        # Атомарная подмена: читатели видят либо старую, либо новую таблицу целиком
+        self._traffic_data = data
+        self._engine = engine
+        self._mtime = mtime
+
+    def get_table(self) -> TrafficTable:
+        """Получить текущую таблицу коэффициентов (неизменяемый снимок)"""
+        return self._engine.table
+
+    def get_engine(self) -> TravelTimeEngine:
+        """Получить движок времени в пути по текущей таблице (неизменяемый снимок)"""
+        return self._engine
 
     def get_traffic_multiplier(self, hour: int, day_of_week: str) -> float:
         """
@@ -46,28 +176,41 @@ class TrafficService:
         Returns:
             Коэффициент трафика (по умолчанию 1.0)
         """
-        # Приводим день недели к формату с заглавной буквы (Monday, Tuesday, etc.)
-        day_capitalized = day_of_week.capitalize()
+        return float(self.get_table().multiplier(hour, DAY_INDEX.get(day_of_week.lower())))
 
-        # Получаем данные для дня
-        day_data = self._traffic_data.get(day_capitalized, {})
+    def reload_traffic_data(self):
+        """Перезагрузить данные трафика из файла"""
+        self._load_traffic_data()
 
-        # Если нет данных для дня - возвращаем 1.0
-        if not day_data:
-            return 1.0
+    def reload_if_changed(self) -> bool:
+        """
+        Перезагрузить данные, если файл конфигурации изменился.
+
+        Returns:
+            True, если данные были перезагружены
+        """
+        try:
+            mtime = os.path.getmtime(self.traffic_config_path)
+        except OSError:
+            return False
 
-        # Получаем данные часов
-        hours_data = day_data.get("hours", {})
+        if mtime == self._mtime:
+            return False
 
-        # Получаем данные для конкретного часа
-        hour_data = hours_data.get(str(hour), {})
+        self._load_traffic_data(keep_on_error=True)
+        return self._mtime == mtime
 
-        # Возвращаем коэффициент (average)
-        return float(hour_data.get("average", 1.0))
+    async def watch(self, interval: float = 5.0):
+        """
+        Следить за изменением файла конфигурации и перезагружать его.
 
-    def reload_traffic_data(self):
-        """Перезагрузить данные трафика из файла"""
-        self._load_traffic_data()
+        Args:
+            interval: Период проверки mtime в секундах
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if self.reload_if_changed():
+                print(f"🔄 Конфигурация трафика перезагружена: {self.traffic_config_path}")
 
     def get_all_traffic_data(self) -> Dict[str, Any]:
         """Получить все данные трафика"""
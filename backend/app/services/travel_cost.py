@@ -0,0 +1,355 @@
+"""Источники матриц времени и расстояний для оптимизатора"""
+
+import asyncio
+import math
+import os
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from app.services.osrm_service import OSRMService
+    from app.services.road_graph import RoadGraph
+
+
+# Радиус Земли (км)
+EARTH_RADIUS_KM = 6371.0
+
+# Скоростной профиль по умолчанию: первые 3 км - улицы, до 15 км - магистрали, дальше - трассы
+DEFAULT_SPEED_PROFILE = "3:25,15:40,inf:70"
+
+
+def parse_speed_profile(value: str) -> List[Tuple[float, float]]:
+    """
+    Разобрать скоростной профиль вида "3:25,15:40,inf:70".
+
+    Args:
+        value: Пары "до скольки км пути : скорость км/ч" по возрастанию границы
+
+    Returns:
+        Список (граница участка в км, скорость км/ч)
+    """
+    profile = []
+    for part in value.split(","):
+        bound, speed = part.split(":")
+        profile.append((float(bound), float(speed)))
+    if not profile or not math.isinf(profile[-1][0]):
+        raise ValueError(f"Последний участок скоростного профиля должен быть inf: {value}")
+    return profile
+
+
+def haversine_matrix(coords: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """
+    Матрица расстояний по большому кругу между всеми точками.
+
+    Args:
+        coords: Список координат [(lat, lon), ...]
+
+    Returns:
+        Массив n x n расстояний в км
+    """
+    points = np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    lat = points[:, 0]
+    lon = points[:, 1]
+    dlat = lat[None, :] - lat[:, None]
+    dlon = lon[None, :] - lon[:, None]
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+class TravelCostProvider(ABC):
+    """
+    Источник матриц для оптимизатора.
+
+    Единственный абстрактный метод - matrix(coords): матрицы времени
+    (минуты без учёта трафика, трафик применяет TravelTimeEngine) и
+    расстояний (км) для всех пар точек.
+    """
+
+    name = "base"
+
+    def preload(self):
+        """Загрузить данные источника до fork воркеров (serve.py), чтобы они были общими"""
+
+    async def start(self):
+        """Подготовить ресурсы (вызывается при старте приложения)"""
+
+    async def close(self):
+        """Освободить ресурсы (вызывается при завершении приложения)"""
+
+    @abstractmethod
+    async def matrix(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Построить матрицы времени и расстояний.
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+
+        Returns:
+            Кортеж (time_matrix, distance_matrix) - массивы float64 n x n
+        """
+
+    async def row(self, coords: list, source: int, targets: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Время и расстояние от одной точки до нескольких (для ленивой матрицы).
+
+        По умолчанию строится матрица по точке отправления и целям.
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+            source: Индекс точки отправления
+            targets: Индексы точек назначения
+
+        Returns:
+            Кортеж (время в минутах, расстояние в км) - массивы по targets
+        """
+        time_matrix, distance_matrix = await self.matrix([coords[source]] + [coords[j] for j in targets])
+        return time_matrix[0, 1:], distance_matrix[0, 1:]
+
+    async def snap(self, coords: list) -> List[Tuple[float, float]]:
+        """
+        Привязать точки к дорожной сети источника.
+
+        По умолчанию точки не изменяются (оценка по прямой не знает дорог,
+        граф дорог сам привязывает точки к узлам и учитывает подъезд).
+
+        Args:
+            coords: Список координат [(lat, lon), ...]
+
+        Returns:
+            Привязанные координаты в том же порядке
+        """
+        return [tuple(coord) for coord in coords]
+
+    async def prefetch(self, coord_groups: List[list]) -> int:
+        """
+        Заранее подготовить матрицы для нескольких маршрутов (пакетный запрос).
+
+        Args:
+            coord_groups: Координаты точек каждого маршрута
+
+        Returns:
+            Количество обращений к внешнему сервису
+        """
+        return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить описание и статистику источника"""
+        return {"provider": self.name}
+
+
+class OSRMCostProvider(TravelCostProvider):
+    """Матрицы из OSRM (с кэшем пар в памяти и на диске)"""
+
+    name = "osrm"
+
+    def __init__(self, osrm_service: "OSRMService"):
+        """
+        Инициализация источника.
+
+        Args:
+            osrm_service: Сервис OSRM
+        """
+        self.osrm_service = osrm_service
+
+    async def start(self):
+        await self.osrm_service.start()
+
+    async def close(self):
+        await self.osrm_service.close()
+
+    async def matrix(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        return await self.osrm_service.build_matrices(coords)
+
+    async def row(self, coords: list, source: int, targets: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        return await self.osrm_service.build_row(coords, source, targets)
+
+    async def snap(self, coords: list) -> List[Tuple[float, float]]:
+        return await self.osrm_service.snap_points(coords)
+
+    async def prefetch(self, coord_groups: List[list]) -> int:
+        return await self.osrm_service.prefetch_matrices(coord_groups)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"provider": self.name, "base_url": self.osrm_service.base_url}
+
+
+class HaversineCostProvider(TravelCostProvider):
+    """
+    Оценка по расстоянию по прямой без обращения к сети.
+
+    Длина пути - расстояние по большому кругу, умноженное на коэффициент
+    извилистости дорог. Время считается по скоростному профилю: первые
+    километры пути проезжаются медленнее (улицы), дальше - быстрее.
+    """
+
+    name = "haversine"
+
+    def __init__(self, speed_profile: str = None, detour: float = None):
+        """
+        Инициализация источника.
+
+        Args:
+            speed_profile: Скоростной профиль "км:км/ч,..." (по умолчанию из env)
+            detour: Отношение длины пути по дорогам к расстоянию по прямой (по умолчанию из env)
+        """
+        self.speed_profile = parse_speed_profile(
+            speed_profile or os.getenv("HAVERSINE_SPEED_PROFILE", DEFAULT_SPEED_PROFILE)
+        )
+        self.detour = detour or float(os.getenv("HAVERSINE_DETOUR", "1.35"))
+
+    def estimate(self, distance_km: np.ndarray) -> np.ndarray:
+        """
+        Время в пути по скоростному профилю.
+
+        Args:
+            distance_km: Длина пути по дорогам (км)
+
+        Returns:
+            Время в минутах
+        """
+        distance_km = np.asarray(distance_km, dtype=np.float64)
+        minutes = np.zeros_like(distance_km)
+        lower = 0.0
+        for bound, speed in self.speed_profile:
+            part = np.clip(distance_km, lower, bound) - lower
+            minutes += part / speed * 60.0
+            lower = bound
+        return minutes
+
+    def matrices_sync(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        """Матрицы времени и расстояний (блокирующий вариант)"""
+        distance_matrix = haversine_matrix(coords) * self.detour
+        return self.estimate(distance_matrix), distance_matrix
+
+    async def matrix(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        return self.matrices_sync(coords)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "detour": self.detour,
+            "speed_profile": [[bound, speed] for bound, speed in self.speed_profile]
+        }
+
+
+class RoadGraphCostProvider(TravelCostProvider):
+    """
+    Матрицы по локальному графу дорог (без сетевых запросов).
+
+    Точки привязываются к ближайшим узлам графа, пути ищутся поиском
+    RoadGraph.shortest_paths (NumPy, от всех источников пачками) в пуле потоков. Участок от точки до узла графа и пары, между которыми
+    в графе нет пути, оцениваются по прямой (HaversineCostProvider).
+    """
+
+    name = "graph"
+
+    def __init__(self, graph_path: str = None):
+        """
+        Инициализация источника.
+
+        Args:
+            graph_path: Путь к графу .npz (по умолчанию ROAD_GRAPH_PATH)
+        """
+        self.graph_path = graph_path or os.getenv("ROAD_GRAPH_PATH", "data/road_graph.npz")
+        self.estimator = HaversineCostProvider()
+        self._graph: Optional["RoadGraph"] = None
+
+    def load_graph(self) -> "RoadGraph":
+        """Загрузить граф при первом обращении"""
+        if self._graph is None:
+            from app.services.road_graph import RoadGraph
+
+            self._graph = RoadGraph.load(self.graph_path)
+            print(
+                f"✅ Граф дорог загружен из {self.graph_path}: "
+                f"{self._graph.node_count} узлов, {self._graph.edge_count} рёбер"
+            )
+        return self._graph
+
+    def preload(self):
+        self.load_graph()
+
+    async def start(self):
+        await asyncio.to_thread(self.load_graph)
+
+    def matrices_sync(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        """Матрицы времени и расстояний (блокирующий вариант)"""
+        graph = self.load_graph()
+        nodes, offsets = graph.nearest_nodes(coords)
+        time_matrix, distance_matrix = graph.matrices(nodes)
+
+        # Подъезд от точки к графу и от графа к точке
+        access_km = offsets * self.estimator.detour
+        access_minutes = self.estimator.estimate(access_km)
+        time_matrix = time_matrix + access_minutes[:, None] + access_minutes[None, :]
+        distance_matrix = distance_matrix + access_km[:, None] + access_km[None, :]
+
+        # Пары, не связанные в графе, и точки на одном узле
+        estimate_time, estimate_distance = self.estimator.matrices_sync(coords)
+        unreachable = ~np.isfinite(time_matrix)
+        same_node = nodes[:, None] == nodes[None, :]
+        time_matrix = np.where(unreachable | same_node, estimate_time, time_matrix)
+        distance_matrix = np.where(unreachable | same_node, estimate_distance, distance_matrix)
+        np.fill_diagonal(time_matrix, 0.0)
+        np.fill_diagonal(distance_matrix, 0.0)
+        return time_matrix, distance_matrix
+
+    async def matrix(self, coords: list) -> Tuple[np.ndarray, np.ndarray]:
+        return await asyncio.to_thread(self.matrices_sync, coords)
+
+    def row_sync(self, coords: list, source: int, targets: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Время и расстояние от одной точки до нескольких - один поиск по графу (блокирующий вариант)"""
+        graph = self.load_graph()
+        points = [coords[source]] + [coords[j] for j in targets]
+        nodes, offsets = graph.nearest_nodes(points)
+        times, distances = graph.shortest_paths(nodes[:1], nodes[1:])
+        times, distances = times[0], distances[0]
+
+        # Подъезд от точки к графу и от графа к точке
+        access_km = offsets * self.estimator.detour
+        access_minutes = self.estimator.estimate(access_km)
+        times = times + access_minutes[0] + access_minutes[1:]
+        distances = distances + access_km[0] + access_km[1:]
+
+        # Пары, не связанные в графе, и точки на одном узле
+        estimate_time, estimate_distance = self.estimator.matrices_sync(points)
+        fallback = ~np.isfinite(times) | (nodes[1:] == nodes[0])
+        times = np.where(fallback, estimate_time[0, 1:], times)
+        distances = np.where(fallback, estimate_distance[0, 1:], distances)
+        return times, distances
+
+    async def row(self, coords: list, source: int, targets: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        return await asyncio.to_thread(self.row_sync, coords, source, targets)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {"provider": self.name, "path": self.graph_path, "loaded": self._graph is not None}
+        if self._graph is not None:
+            stats["nodes"] = self._graph.node_count
+            stats["edges"] = self._graph.edge_count
+        return stats
+
+
+def create_cost_provider(name: str, osrm_service: "OSRMService") -> TravelCostProvider:
+    """
+    Создать источник матриц по имени.
+
+    Args:
+        name: osrm, haversine или graph
+        osrm_service: Сервис OSRM (для источника osrm)
+
+    Returns:
+        Источник матриц
+
+    Raises:
+        ValueError: Неизвестный источник
+    """
+    name = name.lower()
+    if name == "osrm":
+        return OSRMCostProvider(osrm_service)
+    if name == "haversine":
+        return HaversineCostProvider()
+    if name == "graph":
+        return RoadGraphCostProvider()
+    raise ValueError(f"Неизвестный источник матриц: {name}. Допустимые: osrm, haversine, graph")
@@ -0,0 +1,169 @@
+"""Время в пути с учётом трафика на протяжении всего перехода"""
+
+from bisect import bisect_right
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from app.services.traffic_service import TrafficTable
+
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+# Калибровка длительностей OSRM: время в пути = базовое время * 0.65 * коэффициент трафика
+TRAFFIC_TIME_SCALE = 0.65
+
+# Нижняя граница множителя, чтобы нулевой коэффициент в конфиге не давал бесконечную скорость
+MIN_TIME_FACTOR = 1e-3
+
+
+class TravelTimeEngine:
+    """
+    Расчёт времени прибытия по профилю трафика недели.
+
+    Профиль - поминутные коэффициенты TrafficTable за неделю (7 x 1440),
+    ступенчатые или линейно интерполированные по часам. Заранее считается
+    накопленная "базовая работа" F(t) = ∫ ds / (scale * m(s)): сколько минут
+    базового времени OSRM проезжается к моменту t. Прибытие для перехода с
+    базовым временем d и отправлением в t - это F⁻¹(F(t) + d), т.е. часть
+    пути до смены часа едет с одним коэффициентом, остаток - с другим.
+    Обе функции кусочно-линейные, поэтому запрос для любого числа переходов
+    - два вызова np.interp. Переходы через полночь и конец недели
+    продолжаются профилем следующего дня.
+    """
+
+    __slots__ = ("table", "scale", "_knots", "_cumulative", "_cumulative_list", "_week_work")
+
+    def __init__(self, table: "TrafficTable", scale: float = TRAFFIC_TIME_SCALE):
+        """
+        Инициализация движка.
+
+        Args:
+            table: Таблица коэффициентов трафика
+            scale: Общий множитель времени в пути
+        """
+        self.table = table
+        self.scale = scale
+
+        factors = np.maximum(table.minutely.reshape(-1) * scale, MIN_TIME_FACTOR)
+        self._knots = np.arange(WEEK_MINUTES + 1, dtype=np.float64)
+        self._cumulative = np.concatenate(([0.0], np.cumsum(1.0 / factors)))
+        self._week_work = float(self._cumulative[-1])
+
+        # Копия в виде списка для скалярных запросов (bisect без накладных расходов NumPy)
+        self._cumulative_list = self._cumulative.tolist()
+
+        self._knots.setflags(write=False)
+        self._cumulative.setflags(write=False)
+
+    @staticmethod
+    def week_minute(day_index: int, minutes: float) -> float:
+        """
+        Перевести время от полуночи дня маршрута в минуты от начала недели.
+
+        Args:
+            day_index: Индекс дня недели (0 - понедельник)
+            minutes: Минуты от полуночи дня маршрута (могут быть больше суток)
+
+        Returns:
+            Минуты от полуночи понедельника
+        """
+        return day_index * DAY_MINUTES + minutes
+
+    def _work_at(self, minutes: np.ndarray) -> np.ndarray:
+        """Накопленная базовая работа F(t) к моменту t (минуты от начала недели)"""
+        weeks, offset = np.divmod(minutes, WEEK_MINUTES)
+        return weeks * self._week_work + np.interp(offset, self._knots, self._cumulative)
+
+    def _time_at(self, work: np.ndarray) -> np.ndarray:
+        """Обратная функция F⁻¹: момент, к которому накоплена заданная работа"""
+        weeks, offset = np.divmod(work, self._week_work)
+        return weeks * WEEK_MINUTES + np.interp(offset, self._cumulative, self._knots)
+
+    def _work_at_scalar(self, minute: float) -> float:
+        """Скалярная версия _work_at (узлы профиля - целые минуты)"""
+        weeks, offset = divmod(minute, WEEK_MINUTES)
+        idx = min(int(offset), WEEK_MINUTES - 1)
+        cumulative = self._cumulative_list
+        return weeks * self._week_work + (
+            (cumulative[idx + 1] - cumulative[idx]) * (offset - idx) + cumulative[idx]
+        )
+
+    def _time_at_scalar(self, work: float) -> float:
+        """Скалярная версия _time_at"""
+        weeks, offset = divmod(work, self._week_work)
+        cumulative = self._cumulative_list
+        idx = min(max(bisect_right(cumulative, offset) - 1, 0), WEEK_MINUTES - 1)
+        return weeks * WEEK_MINUTES + (
+            (1.0 / (cumulative[idx + 1] - cumulative[idx])) * (offset - cumulative[idx]) + idx
+        )
+
+    def arrival_time(self, depart: float, base_minutes: float) -> float:
+        """
+        Время прибытия для одного перехода (без накладных расходов NumPy).
+
+        Args:
+            depart: Время отправления в минутах от начала недели
+            base_minutes: Базовое время в пути без трафика (минуты)
+
+        Returns:
+            Время прибытия в минутах от начала недели
+        """
+        return self._time_at_scalar(self._work_at_scalar(depart) + base_minutes)
+
+    def departure_time(self, arrival: float, base_minutes: float) -> float:
+        """
+        Последнее время отправления для одного перехода, чтобы прибыть к заданному моменту.
+
+        Args:
+            arrival: Время прибытия в минутах от начала недели
+            base_minutes: Базовое время в пути без трафика (минуты)
+
+        Returns:
+            Время отправления в минутах от начала недели
+        """
+        return self._time_at_scalar(self._work_at_scalar(arrival) - base_minutes)
+
+    def arrival_times(self, depart: np.ndarray, base_minutes: np.ndarray) -> np.ndarray:
+        """
+        Время прибытия для набора переходов (векторно).
+
+        Args:
+            depart: Время отправления в минутах от начала недели (скаляр или массив)
+            base_minutes: Базовое время в пути без трафика (минуты)
+
+        Returns:
+            Время прибытия в минутах от начала недели
+        """
+        depart = np.asarray(depart, dtype=np.float64)
+        return self._time_at(self._work_at(depart) + base_minutes)
+
+    def departure_times(self, arrival: np.ndarray, base_minutes: np.ndarray) -> np.ndarray:
+        """
+        Последнее время отправления, чтобы прибыть к заданному моменту (векторно).
+
+        Args:
+            arrival: Время прибытия в минутах от начала недели (скаляр или массив)
+            base_minutes: Базовое время в пути без трафика (минуты)
+
+        Returns:
+            Время отправления в минутах от начала недели
+        """
+        arrival = np.asarray(arrival, dtype=np.float64)
+        return self._time_at(self._work_at(arrival) - base_minutes)
+
+    def travel_times(self, depart: np.ndarray, base_minutes: np.ndarray) -> np.ndarray:
+        """
+        Время в пути с учётом трафика для набора переходов (векторно).
+
+        Args:
+            depart: Время отправления в минутах от начала недели (скаляр или массив)
+            base_minutes: Базовое время в пути без трафика (минуты)
+
+        Returns:
+            Время в пути в минутах
+        """
+        depart = np.asarray(depart, dtype=np.float64)
+        return self.arrival_times(depart, base_minutes) - depart
@@ -1,5 +1,6 @@
 """Главный файл приложения SmartRoute Backend"""
 
+import asyncio
 import os
 from contextlib import asynccontextmanager
 from pathlib import Path
@@ -22,7 +23,17 @@ async def lifespan(app: FastAPI):
     При старте:
     - Загружаем ML-модель
     - Проверяем наличие конфигураций
+    - Готовим источник матриц (пул соединений к OSRM или граф дорог)
+    - Запускаем слежение за конфигурацией трафика
+    - Запускаем обработчики фоновых задач оптимизации
+
+    При завершении:
+    - Останавливаем обработчики фоновых задач
+    - Закрываем источник матриц (пул соединений к OSRM)
+    - Останавливаем пул оптимизации маршрутов
     """
+    from app.routers.routes import ml_optimizer, route_jobs
+
     print("\n" + "=" * 60)
     print("Запуск SmartRoute API...")
     print("=" * 60)
@@ -34,7 +45,6 @@ async def lifespan(app: FastAPI):
 
         # Загружаем ML-модель
         try:
-            from app.routers.routes import ml_optimizer
             await ml_optimizer.load_model()
             print("ML-модель успешно загружена")
         except Exception as e:
@@ -52,6 +62,22 @@ async def lifespan(app: FastAPI):
     else:
         print(f"Конфигурация трафика не найдена: {traffic_path}")
 
+    # Следим за изменением конфигурации трафика
+    traffic_watcher = None
+    reload_interval = float(os.getenv("TRAFFIC_RELOAD_INTERVAL", "5"))
+    if reload_interval > 0:
+        traffic_watcher = asyncio.create_task(
+            ml_optimizer.traffic_service.watch(reload_interval)
+        )
+
+    # Готовим источник матриц (для OSRM - общий HTTP клиент, для графа - загрузка графа)
+    await ml_optimizer.cost_provider.start()
+    print(f"Источник матриц: {ml_optimizer.cost_provider.name}")
+
+    # Запускаем обработчики очереди фоновых задач
+    route_jobs.start()
+    print(f"Очередь задач: {route_jobs.workers} обработчиков, до {route_jobs.max_queue} задач в очереди")
+
     print("=" * 60)
     print("Документация доступна: /docs")
     print("=" * 60 + "\n")
@@ -60,6 +86,11 @@ async def lifespan(app: FastAPI):
 
     # Очистка при завершении
     print("\nЗавершение работы SmartRoute API...")
+    if traffic_watcher is not None:
+        traffic_watcher.cancel()
+    await route_jobs.stop()
+    await ml_optimizer.cost_provider.close()
+    ml_optimizer.shutdown()
 
 
 # Создание приложения FastAPI
@@ -115,9 +146,14 @@ async def health_check():
         },
         "traffic_config": {
             "path": traffic_path,
-            "exists": os.path.exists(traffic_path)
+            "exists": os.path.exists(traffic_path),
+            "version": ml_optimizer.traffic_service.get_table().version
         },
-        "osrm_cache_size": ml_optimizer.osrm_service.get_cache_size()
+        "travel_cost": ml_optimizer.cost_provider.get_stats(),
+        "osrm_cache_size": ml_optimizer.osrm_service.get_cache_size(),
+        "osrm_cache": ml_optimizer.osrm_service.get_cache_stats(),
+        "osrm_scheduler": ml_optimizer.osrm_service.get_scheduler_stats(),
+        "result_cache": ml_optimizer.result_cache.get_stats()
     }
 
 
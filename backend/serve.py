@@ -0,0 +1,136 @@
+"""Запуск SmartRoute API в один или несколько процессов"""
+
+import gc
+import os
+import signal
+import sys
+import time
+
+import uvicorn
+from dotenv import load_dotenv
+
+# Переменные окружения нужны до импорта приложения (сервисы читают их при создании)
+load_dotenv()
+
+
+def preload():
+    """
+    Загрузить модель, конфигурацию трафика и граф дорог в родительском процессе.
+
+    После fork воркеры получают их copy-on-write: веса модели, таблица
+    трафика, граф, импортированные модули (torch, numpy) не копируются
+    в каждый процесс. gc.freeze() убирает загруженные объекты из сборки мусора,
+    чтобы проходы GC в воркерах не трогали (и не копировали) их страницы.
+    """
+    from app.routers.routes import ml_optimizer
+
+    try:
+        ml_optimizer.load_model_sync()
+    except Exception as e:
+        print(f"⚠ Модель не загружена до запуска воркеров: {e}")
+
+    # Движок времени в пути строится при загрузке трафика - здесь он уже готов
+    ml_optimizer.traffic_service.get_engine()
+
+    # Данные источника матриц (граф дорог) тоже загружаются один раз
+    try:
+        ml_optimizer.cost_provider.preload()
+    except Exception as e:
+        print(f"⚠ Источник матриц не загружен до запуска воркеров: {e}")
+
+    gc.collect()
+    gc.freeze()
+
+
+def serve_workers(workers: int, host: str, port: int):
+    """
+    Запустить несколько воркеров uvicorn на общем сокете.
+
+    Родительский процесс загружает приложение, открывает сокет и
+    запускает воркеры через fork, затем только следит за ними и
+    перезапускает упавшие. У каждого воркера свой event loop, пул
+    оптимизации и кэш в памяти; общие для всех - кэш пар OSRM и
+    хранилище статусов задач в SQLite.
+
+    Args:
+        workers: Количество процессов-воркеров
+        host: Адрес для прослушивания
+        port: Порт
+    """
+    # Общие хранилища между воркерами и пул оптимизации по числу ядер на воркер
+    defaults = {
+        "OSRM_CACHE_DB_PATH": "cache/osrm_cache.sqlite3",
+        "JOB_STORE_PATH": "cache/jobs.sqlite3",
+        "OPTIMIZER_WORKERS": str(max(1, (os.cpu_count() or 1) // workers))
+    }
+    for key, value in defaults.items():
+        if not os.getenv(key):
+            os.environ[key] = value
+
+    from main import app
+
+    preload()
+
+    config = uvicorn.Config(app, host=host, port=port)
+    sock = config.bind_socket()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # Воркер: сигналы обрабатывает uvicorn
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                uvicorn.Server(config).run(sockets=[sock])
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    print(f"🚀 SmartRoute API: {workers} воркеров на {host}:{port} (pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+
+        if not stopping:
+            print(f"⚠ Воркер {pid} завершился (статус {status}), перезапуск...")
+            time.sleep(1)
+            spawn()
+
+    sock.close()
+    print("Все воркеры остановлены")
+
+
+def main():
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8000"))
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+    if workers <= 1 or not hasattr(os, "fork"):
+        uvicorn.run("main:app", host=host, port=port)
+        return
+
+    serve_workers(workers, host, port)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
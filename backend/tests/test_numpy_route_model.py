@@ -0,0 +1,15 @@
+"""Сверка NumPy-модели с torch-моделью"""
+
+import os
+
+import pytest
+
+from app.ml.numpy_route_model import check_parity
+
+MODEL_PATH = os.getenv("MODEL_PATH", "models/routenet_traffic.pt")
+
+
+@pytest.mark.skipif(not os.path.exists(MODEL_PATH), reason="нет файла модели")
+def test_numpy_model_matches_torch():
+    pytest.importorskip("torch")
+    assert check_parity(MODEL_PATH) <= 1e-4
@@ -0,0 +1,29 @@
+"""Тесты ключа кэша результатов"""
+
+from app.services.client_records import ClientRecord
+from app.services.result_cache import route_cache_key
+
+
+def make_clients(n):
+    return [
+        ClientRecord(f"c{i}", f"addr{i}", 55.7 + i * 0.01, 37.5 + i * 0.01, "standard", 540, 1080, 780, 840)
+        for i in range(n)
+    ]
+
+
+def key(clients, start_point=None):
+    return route_cache_key(clients, start_point, "09:00", "monday", {})
+
+
+def test_client_order_ignored_with_start_point():
+    clients = make_clients(5)
+    start = ClientRecord("start", "depot", 55.75, 37.6, "start", 0, 1440, 0, 0)
+    assert key(clients, start) == key(clients[::-1], start)
+
+
+def test_first_client_is_start_without_start_point():
+    clients = make_clients(5)
+    # Маршрут начинается с первого клиента - другой первый клиент даёт другой ключ
+    assert key(clients) != key(clients[::-1])
+    # Порядок остальных клиентов не важен
+    assert key(clients) == key(clients[:1] + clients[:0:-1])
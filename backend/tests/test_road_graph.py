@@ -0,0 +1,85 @@
+"""Сверка поиска путей RoadGraph с Дейкстрой на куче и привязки к узлам с перебором"""
+
+import heapq
+
+import numpy as np
+import pytest
+
+from app.services import road_graph
+from app.services.road_graph import RoadGraph
+
+
+def dijkstra(graph, source):
+    """Эталон: Дейкстра от одного узла до всех (время, длина по пути с лучшим временем)"""
+    best = {source: (0.0, 0.0)}
+    heap = [(0.0, source)]
+    while heap:
+        time_u, u = heapq.heappop(heap)
+        if time_u > best[u][0]:
+            continue
+        for e in range(graph.indptr[u], graph.indptr[u + 1]):
+            v = int(graph.indices[e])
+            time_v = time_u + graph.duration[e]
+            if time_v < best.get(v, (np.inf,))[0]:
+                best[v] = (time_v, best[u][1] + graph.distance[e])
+                heapq.heappush(heap, (time_v, v))
+    return best
+
+
+def random_graph(seed, n=300):
+    """Случайный граф: односторонние рёбра между соседями и отдельная компонента без путей"""
+    rng = np.random.default_rng(seed)
+    lat = 55.7 + rng.random(n) * 0.1
+    lon = 37.5 + rng.random(n) * 0.1
+    main = n - 20
+    edges = []
+    for u in range(main):
+        for v in rng.choice(main, size=3, replace=False):
+            if u != v:
+                edges.append((u, int(v), float(rng.uniform(0.5, 5.0)), float(rng.uniform(0.1, 2.0))))
+    for u in range(main, n - 1):
+        edges.append((u, u + 1, 1.0, 0.5))
+    return RoadGraph.from_edges(lat, lon, edges)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("batch_labels", [road_graph.SEARCH_BATCH_LABELS, 700])
+def test_shortest_paths_match_dijkstra(monkeypatch, seed, batch_labels):
+    monkeypatch.setattr(road_graph, "SEARCH_BATCH_LABELS", batch_labels)
+    graph = random_graph(seed)
+    rng = np.random.default_rng(seed + 100)
+    sources = rng.choice(graph.node_count, size=12, replace=False)
+    targets = np.concatenate((rng.choice(graph.node_count, size=15), sources[:3]))
+
+    times, lengths = graph.shortest_paths(sources, targets)
+
+    for k, source in enumerate(sources):
+        reference = dijkstra(graph, int(source))
+        expected = [reference.get(int(target), (np.inf, np.inf)) for target in targets]
+        np.testing.assert_allclose(times[k], [time for time, _ in expected])
+        np.testing.assert_allclose(lengths[k], [length for _, length in expected])
+
+
+def test_matrices_repeat_nodes():
+    graph = random_graph(0)
+    nodes = [5, 17, 5, 290, 17]
+    time_matrix, distance_matrix = graph.matrices(nodes)
+    times, lengths = graph.shortest_paths(nodes, nodes)
+    np.testing.assert_array_equal(time_matrix, times)
+    np.testing.assert_array_equal(distance_matrix, lengths)
+    assert time_matrix[0, 2] == 0.0
+    assert np.isinf(time_matrix[0, 3])
+
+
+def test_nearest_nodes_match_brute_force():
+    graph = random_graph(1, n=2000)
+    rng = np.random.default_rng(7)
+    coords = np.column_stack((55.68 + rng.random(200) * 0.14, 37.48 + rng.random(200) * 0.14))
+
+    nodes, offsets = graph.nearest_nodes(coords)
+
+    cos_lat = np.cos(np.radians(graph.node_lat.mean()))
+    for k, (lat, lon) in enumerate(coords):
+        squared = (graph.node_lat - lat) ** 2 + ((graph.node_lon - lon) * cos_lat) ** 2
+        assert squared[nodes[k]] == pytest.approx(squared.min())
+        assert offsets[k] == pytest.approx(np.sqrt(squared.min()) * road_graph.KM_PER_DEGREE)
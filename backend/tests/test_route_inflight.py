@@ -0,0 +1,49 @@
+"""Тесты общего расчёта одинаковых запросов"""
+
+import asyncio
+
+from app.schemas.route import RouteAnalysisResponse
+from app.services.client_records import ClientRecord
+from app.services.ml_route_optimizer import MLRouteOptimizer, OptimizationCancelled
+
+
+def make_clients(n):
+    return [
+        ClientRecord(f"c{i}", f"addr{i}", 55.7 + i * 0.01, 37.5 + i * 0.01, "standard", 540, 1080, 780, 840)
+        for i in range(n)
+    ]
+
+
+def test_cancelled_stream_does_not_fail_waiters():
+    optimizer = MLRouteOptimizer()
+    optimizer._model_loaded = True
+    response = RouteAnalysisResponse(total_distance=1.0, total_duration=2.0, optimized_route=[])
+    calls = []
+
+    async def optimize_route(clients, start_point, start_time, start_day, time_budget_ms, on_event):
+        calls.append(on_event)
+        if len(calls) == 1:
+            # Первый запрос - поток, клиент которого отключился во время расчёта
+            await asyncio.sleep(0.05)
+            raise OptimizationCancelled()
+        return response
+
+    optimizer.optimize_route = optimize_route
+
+    async def scenario():
+        clients = make_clients(3)
+        stream = asyncio.create_task(optimizer.optimize_route_cached(clients, None, "09:00", "monday", 0))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(optimizer.optimize_route_cached(clients, None, "09:00", "monday", 0))
+        return await asyncio.gather(stream, waiter, return_exceptions=True)
+
+    try:
+        stream_result, waiter_result = asyncio.run(scenario())
+    finally:
+        optimizer.shutdown()
+
+    assert isinstance(stream_result, OptimizationCancelled)
+    # Ожидающий запрос пересчитал маршрут сам
+    assert waiter_result[0] is response
+    assert waiter_result[2] is False
+    assert len(calls) == 2
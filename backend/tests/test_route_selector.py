@@ -0,0 +1,126 @@
+"""Сверка векторизованного GreedySelector с исходным циклом по кандидатам"""
+
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pytest
+
+from app.services.route_selector import GreedySelector
+
+
+def can_visit(at_time, window):
+    """Проверка доступности из исходной реализации (окна - объекты time)"""
+    work_start, work_end, lunch_start, lunch_end = window
+    t = at_time.time()
+    return work_start <= t < work_end and not (lunch_start <= t < lunch_end)
+
+
+def select_loop(base_time_matrix, attn_scores, windows, visited, current_node, current_time, mult):
+    """Исходный выбор: перебор кандидатов со строгим сравнением score"""
+    best_j = None
+    best_score = -float("inf")
+    best_travel_time = None
+    any_available_later = False
+    for j in range(len(attn_scores)):
+        if j in visited or j == current_node:
+            continue
+        adjusted_time = base_time_matrix[current_node, j] * mult
+        if not can_visit(current_time + timedelta(minutes=adjusted_time), windows[j]):
+            any_available_later = True
+            continue
+        score = attn_scores[j] / (adjusted_time + 1e-5)
+        if score > best_score:
+            best_score = score
+            best_j = j
+            best_travel_time = adjusted_time
+    return best_j, best_travel_time, any_available_later
+
+
+def to_time(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def build_route(select, n, start, mult):
+    """Жадный маршрут с ожиданием по 15 минут, пока клиенты закрыты"""
+    route = [0]
+    current_time = start
+    steps = []
+    while len(route) < n:
+        best_j, travel_time, later = select(route, current_time)
+        steps.append((best_j, travel_time, later))
+        if best_j is None:
+            if not later:
+                break
+            current_time += timedelta(minutes=15)
+            continue
+        route.append(best_j)
+        current_time += timedelta(minutes=travel_time + 15)
+    return route, steps
+
+
+def make_case(seed, n):
+    rng = np.random.default_rng(seed)
+    # Целые времена и несколько значений score - много равных score у разных кандидатов
+    base_time_matrix = rng.integers(1, 6, size=(n, n)).astype(np.float64) * 5
+    np.fill_diagonal(base_time_matrix, 0.0)
+    attn_scores = rng.choice([0.5, 1.0, 2.0], size=n)
+    work_start = rng.choice([480, 540, 600, 690], size=n).tolist()
+    work_end = rng.choice([870, 1020, 1080], size=n).tolist()
+    lunch_start = rng.choice([720, 780], size=n).tolist()
+    lunch_end = [start + 60 for start in lunch_start]
+    return base_time_matrix, attn_scores, work_start, work_end, lunch_start, lunch_end
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("start_hour", [7, 9, 12])
+def test_selector_matches_loop(seed, start_hour):
+    n = 25
+    base_time_matrix, attn_scores, *windows = make_case(seed, n)
+    window_times = [tuple(to_time(w[j]) for w in windows) for j in range(n)]
+    start = datetime(2024, 1, 1, start_hour, 50)
+    mult = 0.65 * 1.3
+
+    def loop_select(route, current_time):
+        return select_loop(base_time_matrix, attn_scores, window_times, set(route), route[-1], current_time, mult)
+
+    selector = GreedySelector(base_time_matrix, attn_scores, *windows)
+
+    def vector_select(route, current_time):
+        for j in route:
+            selector.mark_visited(j)
+        best_j, travel_time, later = selector.select(route[-1], current_time, base_time_matrix[route[-1]] * mult)
+        return best_j, (travel_time if best_j is not None else None), later
+
+    loop_route, loop_steps = build_route(loop_select, n, start, mult)
+    vector_route, vector_steps = build_route(vector_select, n, start, mult)
+
+    assert vector_route == loop_route
+    assert vector_steps == loop_steps
+
+
+def test_ties_pick_first_candidate():
+    # Три кандидата с одинаковым score - выбирается первый, как при строгом сравнении
+    base_time_matrix = np.full((4, 4), 10.0)
+    np.fill_diagonal(base_time_matrix, 0.0)
+    attn_scores = np.ones(4)
+    windows = ([540] * 4, [1080] * 4, [780] * 4, [840] * 4)
+    selector = GreedySelector(base_time_matrix, attn_scores, *windows)
+    selector.mark_visited(0)
+
+    best_j, travel_time, later = selector.select(0, datetime(2024, 1, 1, 10, 0), base_time_matrix[0])
+
+    assert (best_j, travel_time, later) == (1, 10.0, False)
+
+
+def test_waits_before_opening():
+    # До открытия никто не доступен: выбора нет, но клиенты доступны позже
+    base_time_matrix = np.full((3, 3), 10.0)
+    np.fill_diagonal(base_time_matrix, 0.0)
+    attn_scores = np.ones(3)
+    windows = ([540] * 3, [1080] * 3, [780] * 3, [840] * 3)
+    selector = GreedySelector(base_time_matrix, attn_scores, *windows)
+    selector.mark_visited(0)
+
+    assert selector.select(0, datetime(2024, 1, 1, 8, 0), base_time_matrix[0]) == (None, 0.0, True)
+    # Прибытие ровно к открытию (08:50 + 10 минут) - клиент доступен
+    assert selector.select(0, datetime(2024, 1, 1, 8, 50), base_time_matrix[0])[0] == 1